@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import threading
+import numpy as np
+from capture import CaptureHub
+from client_core import RemoteClient
+from protocol import TRANSPORT_TCP, TRANSPORT_UDP, TRANSPORT_SHM
+from codec import DEFAULT_QUALITY, available_codecs
+from pixel_format import FORMAT_IDS, DEFAULT_PIXEL_FORMAT
+from metrics import REGISTRY, SIZE_BUCKETS
+from scaler import PRESETS, PRESET_AUTO
+from server_core import RemoteDesktopServer, parse_size
+from synthetic import SyntheticSource, SCENES
+from log_config import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# 线程名前缀 -> 统计CPU时间的阶段
+THREAD_STAGES = (
+    ('CaptureHub', 'capture'),
+    ('Stage-scale', 'scale'),
+    ('Stage-encode', 'encode'),
+    ('TileEncoder', 'encode'),
+    ('Stage-send', 'send'),
+    ('BenchmarkServer', 'server'),
+)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def thread_cpu_seconds():
+    # 按阶段汇总各线程的CPU时间（Linux的/proc/self/task），其他平台返回空
+    clock_ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+    totals = {}
+    for thread in threading.enumerate():
+        stage = next((stage for prefix, stage in THREAD_STAGES if thread.name.startswith(prefix)), None)
+        if stage is None or thread.native_id is None:
+            continue
+        try:
+            with open(f"/proc/self/task/{thread.native_id}/stat") as f:
+                # comm字段可能含空格，从最后一个')'之后开始计数: utime、stime为第12、13个字段
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        totals[stage] = totals.get(stage, 0.0) + (int(fields[11]) + int(fields[12])) / clock_ticks
+    return totals
+
+
+class MetricsWindow:
+    # 记录一组指标在测量开始时的值，结束时计算增量和分位数
+    HISTOGRAMS = {
+        'end_to_end': ('frame_end_to_end_seconds', {}),
+        'grab': ('capture_grab_seconds', {}),
+        'scale': ('capture_scale_seconds', {}),
+        'encode': ('frame_latency_seconds', {'stage': 'encode'}),
+        'send': ('frame_latency_seconds', {'stage': 'send'}),
+        'decode': ('frame_decode_seconds', {}),
+    }
+
+    def __init__(self):
+        self.histograms = {name: REGISTRY.histogram(metric, **labels)
+                           for name, (metric, labels) in self.HISTOGRAMS.items()}
+        self.received_bytes = REGISTRY.histogram('frame_received_bytes', buckets=SIZE_BUCKETS)
+        self.counters = {
+            'frames_captured': REGISTRY.histogram('capture_grab_seconds'),
+            'frames_sent': REGISTRY.counter('frames_sent_total'),
+            'frames_received': REGISTRY.counter('frames_received_total'),
+            'dropped_encode': REGISTRY.counter('pipeline_dropped_frames_total', stage='encode'),
+            'dropped_scale': REGISTRY.counter('pipeline_dropped_frames_total', stage='scale'),
+        }
+
+    def value(self, metric):
+        return metric.snapshot()[2] if hasattr(metric, 'snapshot') else metric.value
+
+    def begin(self):
+        self.start_time = time.perf_counter()
+        self.start_process_cpu = time.process_time()
+        self.start_cpu = thread_cpu_seconds()
+        self.start_histograms = {name: h.snapshot() for name, h in self.histograms.items()}
+        self.start_bytes = self.received_bytes.snapshot()
+        self.start_counters = {name: self.value(c) for name, c in self.counters.items()}
+
+    def end(self):
+        duration = time.perf_counter() - self.start_time
+        process_cpu = time.process_time() - self.start_process_cpu
+        cpu = thread_cpu_seconds()
+        counts = {name: self.value(c) - self.start_counters[name] for name, c in self.counters.items()}
+        received_bytes = self.received_bytes.snapshot()[1] - self.start_bytes[1]
+        latency = {}
+        for name, histogram in self.histograms.items():
+            since = self.start_histograms[name]
+            samples = histogram.snapshot()[2] - since[2]
+            latency[name] = {f"p{int(q * 100)}_ms": round(histogram.quantile(q, since) * 1000, 3)
+                             for q in QUANTILES}
+            latency[name]['samples'] = samples
+        return {
+            'duration_s': round(duration, 3),
+            'fps': round(counts['frames_received'] / duration, 2),
+            'capture_fps': round(counts['frames_captured'] / duration, 2),
+            'bytes_per_second': round(received_bytes / duration),
+            'bytes_per_frame': round(received_bytes / counts['frames_received']) if counts['frames_received'] else 0,
+            'frames': counts,
+            # 占单个CPU核心的百分比
+            'cpu_percent': {stage: round((seconds - self.start_cpu.get(stage, 0.0)) / duration * 100, 1)
+                            for stage, seconds in sorted(cpu.items())},
+            'process_cpu_percent': round(process_cpu / duration * 100, 1),
+            'latency': latency,
+        }
+
+
+def run_scene(scene, args):
+    end_to_end = REGISTRY.histogram('frame_end_to_end_seconds', "抓取到解码完成的延迟")
+
+    def on_frame(framebuffer, rects, timing):
+        # 回环连接两端共用时钟，来源端延迟 + 服务器收到至解码完成即为端到端延迟
+        _, source_latency, received = timing
+        end_to_end.observe(source_latency + time.perf_counter() - received)
+
+    server = RemoteDesktopServer('127.0.0.1', 0, on_frame=on_frame)
+    server_thread = threading.Thread(target=lambda: asyncio.run(server.serve()), name="BenchmarkServer")
+    server_thread.start()
+    if not server.started.wait(5):
+        raise RuntimeError("服务器启动超时")
+
+    # 与客户端相同的发送端，固定帧率和质量（不做拥塞调整）保证结果可复现，不监听本机输入
+    source = SyntheticSource(scene, args.size, args.seed)
+    hub = CaptureHub(scale_preset=args.scale, source=source)
+    client = RemoteClient('127.0.0.1', server.port, hub, args.codec, args.quality,
+                          target_size=args.target_size, pixel_format=args.pixel_format, fps=args.fps,
+                          adaptive=False, workers=args.workers, capture_input=False, transport=args.transport)
+    client_thread = threading.Thread(target=client.run, name="BenchmarkClient")
+    client_thread.start()
+    try:
+        window = MetricsWindow()
+        time.sleep(args.warmup)
+        if not client.connected:
+            raise RuntimeError("连接服务器失败")
+        window.begin()
+        time.sleep(args.duration)
+        result = window.end()
+        result['session'] = {key: client.session[key] for key in ('codec', 'quality', 'pixel_format', 'size', 'transport')}
+        return result
+    finally:
+        client.stop()
+        client_thread.join(timeout=5)
+        hub.stop()
+        server.stop()
+        server_thread.join(timeout=5)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="合成画面 + 本机回环连接的性能测试，结果以JSON输出")
+    parser.add_argument('--scenes', nargs='+', choices=SCENES, default=list(SCENES))
+    parser.add_argument('--duration', type=float, default=10.0, help="每个场景的测量时长（秒）")
+    parser.add_argument('--warmup', type=float, default=2.0, help="测量前的预热时长（秒）")
+    parser.add_argument('--size', type=parse_size, default=(1920, 1080), help="合成画面分辨率")
+    parser.add_argument('--target-size', type=parse_size, help="传输分辨率，默认与画面相同")
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--codec', choices=available_codecs(), default='zlib')
+    parser.add_argument('--quality', type=int, default=DEFAULT_QUALITY)
+    parser.add_argument('--transport', choices=(TRANSPORT_TCP, TRANSPORT_UDP, TRANSPORT_SHM), default=TRANSPORT_TCP,
+                        help="画面传输方式（本机回环上测量）")
+    parser.add_argument('--pixel-format', choices=sorted(FORMAT_IDS), default=DEFAULT_PIXEL_FORMAT)
+    parser.add_argument('--scale', choices=PRESETS + (PRESET_AUTO,), default=PRESET_AUTO)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="编码线程数")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="结果写入文件，默认输出到标准输出")
+    args = parser.parse_args(argv)
+
+    # 其他模块的日志只保留警告和错误，避免干扰测量
+    setup_logging(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    report = {
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'scenes': {},
+    }
+    for scene in args.scenes:
+        logger.info(f"场景 {scene}: 测量 {args.duration} 秒")
+        report['scenes'][scene] = run_scene(scene, args)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,46 @@
+import threading
+from metrics import REGISTRY
+
+# 编码输出缓冲区的复用池: 原始编码等需要整块拷贝的场合从池中取缓冲区，发送完成后归还，
+# 稳定运行时不再分配新内存（长时间运行的会话中避免大块内存反复分配和碎片）
+GRANULARITY = 64 * 1024  # 新分配的缓冲区按此大小向上取整，尺寸略有变化的请求也能复用
+MAX_POOLED_BYTES = 64 * 1024 * 1024  # 空闲缓冲区总量上限，超出的直接释放
+
+
+class BufferPool:
+    # acquire()返回指定长度的memoryview，release()传入发送过的分段，只回收本池借出的缓冲区
+    # 可在编码线程借出、发送线程归还
+    def __init__(self, max_pooled_bytes=MAX_POOLED_BYTES):
+        self.max_pooled_bytes = max_pooled_bytes
+        self.lock = threading.Lock()
+        self.free = []  # 空闲的bytearray，按容量从小到大
+        self.free_bytes = 0
+        self.lent = {}  # id(bytearray) -> bytearray
+        self.allocated_metric = REGISTRY.counter('buffer_pool_allocations_total', "缓冲池新分配的缓冲区数")
+
+    def acquire(self, size):
+        with self.lock:
+            for index, buffer in enumerate(self.free):
+                if len(buffer) >= size:
+                    del self.free[index]
+                    self.free_bytes -= len(buffer)
+                    break
+            else:
+                buffer = bytearray(-(-size // GRANULARITY) * GRANULARITY)
+                self.allocated_metric.inc()
+            self.lent[id(buffer)] = buffer
+        return memoryview(buffer)[:size]
+
+    def release(self, parts):
+        with self.lock:
+            for part in parts:
+                if not isinstance(part, memoryview):
+                    continue
+                buffer = self.lent.pop(id(part.obj), None)
+                if buffer is None:
+                    continue
+                if self.free_bytes + len(buffer) > self.max_pooled_bytes:
+                    continue
+                self.free.append(buffer)
+                self.free.sort(key=len)
+                self.free_bytes += len(buffer)
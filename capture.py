@@ -0,0 +1,256 @@
+import time
+import logging
+import threading
+import numpy as np
+from mss import mss
+from pipeline import Stage
+from pixel_format import DEFAULT_PIXEL_FORMAT, PIXEL_BGRX32, convert
+from scaler import AutoScaler, PRESET_AUTO, STILL_FRAMES
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZE = (800, 600)
+IDLE_FPS = 2  # 画面静止时的抓取帧率
+IDLE_AFTER = 1.0  # 画面持续静止多少秒后进入空闲模式
+
+
+class Subscription:
+    # 订阅者各自选择帧率、输出尺寸和像素格式，可在运行中修改
+    # size为None表示原始分辨率，不缩放
+    # 画面无变化的帧不分发，改为在抓取线程中调用on_unchanged(抓取时刻)（须立即返回）
+    def __init__(self, callback, fps=30, size=DEFAULT_SIZE, name=None, pixel_format=DEFAULT_PIXEL_FORMAT,
+                 on_unchanged=None):
+        self.callback = callback
+        self.on_unchanged = on_unchanged
+        self.fps = fps
+        self.size = size
+        self.pixel_format = pixel_format
+        self.name = name or getattr(callback, '__qualname__', 'subscriber')
+        self.last_time = 0
+
+    def next_due(self):
+        return self.last_time + 1 / self.fps
+
+
+class ScreenSource:
+    # 用mss抓取显示器画面；open()在抓取线程中调用（mss需要在使用它的线程中创建）
+    # 其他画面来源（如benchmark的合成画面）实现相同的 open/close/size/grab 接口即可
+    def __init__(self, monitor_index=1):
+        self.monitor_index = monitor_index
+        self.sct = None
+
+    def open(self):
+        self.sct = mss()
+
+    def close(self):
+        if self.sct:
+            self.sct.close()
+            self.sct = None
+
+    def size(self):
+        # 显示器的原始分辨率
+        with mss() as sct:
+            monitor = sct.monitors[self.monitor_index]
+            return monitor['width'], monitor['height']
+
+    def grab(self):
+        # 直接使用mss的原始BGRA数据（bgrx32），不做通道转换和拷贝
+        screenshot = self.sct.grab(self.sct.monitors[self.monitor_index])
+        width, height = screenshot.size
+        return np.frombuffer(screenshot.raw, dtype=np.uint8).reshape(height, width, 4)
+
+
+class CaptureHub:
+    # 每个时刻只抓取一次屏幕，按订阅者的尺寸缩放后分发
+    # 回调参数为 (像素数组, 抓取时刻)，抓取时刻为time.perf_counter()，用于统计端到端延迟
+    # 抓取和缩放是两个流水线阶段，缩放跟不上时丢弃旧帧，不拖慢抓取
+    # 回调在缩放线程中执行，耗时的订阅者应自行转交到其他线程
+    # 缩放前先与上一次抓取逐字节比较，无变化的帧不缩放不分发；静止超过idle_after秒后
+    # 抓取降到idle_fps，画面变化或调用wake()（本机有输入时）后恢复
+    def __init__(self, monitor_index=1, scale_preset=PRESET_AUTO, scale_budget=0.8, source=None,
+                 idle_fps=IDLE_FPS, idle_after=IDLE_AFTER):
+        self.source = source or ScreenSource(monitor_index)
+        self.scale_preset = scale_preset
+        self.scale_budget = scale_budget  # 缩放可占用的帧间隔比例
+        self.scalers = {}  # 输出尺寸 -> AutoScaler，各自记录耗时和静止状态
+        self.grab_metric = REGISTRY.histogram('capture_grab_seconds', "屏幕抓取耗时")
+        self.scale_metric = REGISTRY.histogram('capture_scale_seconds', "缩放和像素格式转换耗时")
+        self.cpu_metric = REGISTRY.counter('capture_cpu_seconds_total', "抓取线程占用的CPU时间")
+        self.unchanged_metric = REGISTRY.counter('capture_unchanged_frames_total', "与上一次抓取相同而跳过的帧数")
+        REGISTRY.gauge('capture_idle', "是否处于空闲抓取模式", func=lambda: int(self.idle))
+        self.idle_fps = idle_fps
+        self.idle_after = idle_after
+        self.idle = False
+        self.last_frame = None  # 上一次抓取的画面（每次抓取都是新数组，保留引用即可）
+        self.equal_buffer = None  # 逐字节比较结果，尺寸不变时复用
+        self.unchanged_count = 0
+        self.last_change = time.time()
+        self.last_grab = 0
+        self.wake_event = threading.Event()
+        self.subscriptions = []
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def subscribe(self, callback, fps=30, size=DEFAULT_SIZE, name=None, pixel_format=DEFAULT_PIXEL_FORMAT,
+                  on_unchanged=None):
+        subscription = Subscription(callback, fps, size, name, pixel_format, on_unchanged)
+        with self.lock:
+            self.subscriptions.append(subscription)
+            self.last_frame = None  # 新订阅者需要一帧完整画面，即使画面静止
+            self.running = True
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="CaptureHub", daemon=True)
+                self.thread.start()
+        size_text = f"{size[0]}x{size[1]}" if size else "原始分辨率"
+        logger.info(f"新增屏幕订阅: {subscription.name}, {fps} FPS, {size_text}, {pixel_format}")
+        self.wake()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        # 没有订阅者时抓取线程自行退出
+        with self.lock:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+
+    def wake(self):
+        # 本机有输入时调用（可能很快引起画面变化），退出空闲模式；可从任意线程调用
+        self.last_change = time.time()
+        self.wake_event.set()
+
+    def stop(self):
+        with self.lock:
+            self.subscriptions.clear()
+            self.running = False
+            thread = self.thread
+        self.wake_event.set()
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout=1)
+
+    def source_size(self):
+        return self.source.size()
+
+    def run(self):
+        opened = False
+        scale_stage = Stage('scale', self.publish)
+        scale_stage.start()
+        try:
+            self.source.open()
+            opened = True
+            logger.info("屏幕捕获线程启动")
+            while True:
+                with self.lock:
+                    if not self.running or not self.subscriptions:
+                        self.running = False
+                        self.thread = None
+                        break
+                    subscriptions = list(self.subscriptions)
+
+                now = time.time()
+                next_due = min(s.next_due() for s in subscriptions)
+                self.update_idle(now)
+                if self.idle:
+                    next_due = max(next_due, self.last_grab + 1 / self.idle_fps)
+                if next_due > now:
+                    # wake()可提前结束等待
+                    if self.wake_event.wait(min(next_due - now, 0.1)):
+                        self.wake_event.clear()
+                    continue
+
+                due = [s for s in subscriptions if s.next_due() <= now]
+                for subscription in due:
+                    subscription.last_time = now
+                try:
+                    start = time.perf_counter()
+                    cpu_start = time.thread_time()
+                    pixels = self.source.grab()
+                    captured = time.perf_counter()
+                    self.last_grab = now
+                    unchanged = self.compare(pixels)
+                    self.cpu_metric.inc(time.thread_time() - cpu_start)
+                    self.grab_metric.observe(captured - start)
+                    if unchanged and self.unchanged_count > STILL_FRAMES:
+                        self.skip_unchanged(due, captured)
+                    else:
+                        # 刚静止的几帧仍然分发，让AutoScaler有机会用LANCZOS重绘一次
+                        scale_stage.put((pixels, captured, due, unchanged))
+                except Exception as e:
+                    logger.error(f"屏幕捕获循环错误: {str(e)}")
+                    time.sleep(1)  # 发生错误时等待一秒再继续
+        except Exception as e:
+            logger.error(f"屏幕捕获线程错误: {str(e)}")
+        finally:
+            scale_stage.stop()
+            with self.lock:
+                if self.thread is threading.current_thread():
+                    self.running = False
+                    self.thread = None
+            if opened:
+                self.source.close()
+            logger.info("屏幕捕获线程已停止")
+
+    def compare(self, pixels):
+        # 逐字节比较（约为crc32耗时的一半，且不会有哈希碰撞）；返回是否与上一次抓取相同
+        previous = self.last_frame
+        self.last_frame = pixels
+        unchanged = False
+        if previous is not None and previous.shape == pixels.shape:
+            if self.equal_buffer is None or self.equal_buffer.shape != pixels.shape:
+                self.equal_buffer = np.empty(pixels.shape, dtype=bool)
+            unchanged = bool(np.equal(previous, pixels, out=self.equal_buffer).all())
+        if unchanged:
+            self.unchanged_count += 1
+        else:
+            self.unchanged_count = 0
+            self.last_change = time.time()
+        return unchanged
+
+    def update_idle(self, now):
+        idle = now - self.last_change >= self.idle_after
+        if idle != self.idle:
+            self.idle = idle
+            if idle:
+                logger.info(f"画面静止，抓取降至 {self.idle_fps} FPS")
+            else:
+                logger.info("画面变化或有本机输入，恢复正常抓取")
+
+    def skip_unchanged(self, due, captured):
+        self.unchanged_metric.inc()
+        for subscription in due:
+            if subscription.on_unchanged:
+                try:
+                    subscription.on_unchanged(captured)
+                except Exception as e:
+                    logger.error(f"屏幕订阅者处理错误 ({subscription.name}): {str(e)}")
+
+    def publish(self, item):
+        # 相同尺寸和格式的订阅者共用一次缩放/转换结果（缩放时释放GIL，可与抓取并行）
+        # 缩放方式按帧间隔预算自动选择；分发的是只读数组，订阅者不得修改
+        pixels, captured, due, unchanged = item
+        height, width = pixels.shape[:2]
+        sizes = {subscription.size or (width, height) for subscription in due}
+        budget = self.scale_budget / max(s.fps for s in due) / len(sizes)
+        scaled = {}
+        for subscription in due:
+            size = subscription.size or (width, height)
+            key = (size, subscription.pixel_format)
+            if key not in scaled:
+                start = time.perf_counter()
+                if (size, PIXEL_BGRX32) not in scaled:
+                    scaled[size, PIXEL_BGRX32] = self.scale(pixels, size, budget, unchanged)
+                scaled[key] = convert(scaled[size, PIXEL_BGRX32], subscription.pixel_format)
+                self.scale_metric.observe(time.perf_counter() - start)
+            try:
+                subscription.callback((scaled[key], captured))
+            except Exception as e:
+                logger.error(f"屏幕订阅者处理错误 ({subscription.name}): {str(e)}")
+
+    def scale(self, pixels, size, budget, unchanged):
+        if size == (pixels.shape[1], pixels.shape[0]):
+            return pixels
+        if size not in self.scalers:
+            if len(self.scalers) >= 8:
+                self.scalers.clear()  # 拥塞控制会不断改变尺寸，避免无限增长
+            self.scalers[size] = AutoScaler(self.scale_preset)
+        return self.scalers[size].scale(pixels, size, budget, unchanged)
@@ -1,285 +1,73 @@
 import sys
-import socket
-import json
 import logging
-import threading
-import time
-from datetime import datetime
-from PIL import Image, ImageTk
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QLabel, QVBoxLayout, 
                             QWidget, QLineEdit, QPushButton, QMessageBox,
-                            QHBoxLayout, QScrollArea)
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QTimer
+                            QHBoxLayout, QComboBox, QSpinBox)
+from PyQt6.QtCore import Qt, QObject, QThread, pyqtSignal
 from PyQt6.QtGui import QImage, QPixmap
-from pynput import mouse, keyboard
-from mss import mss
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('client.log'),
-        logging.StreamHandler()
-    ]
-)
+from capture import CaptureHub
+from codec import DEFAULT_QUALITY, available_codecs
+from display import framebuffer_to_qimage
+from metrics import MetricsServer
+from client_core import RemoteClient
+from log_config import setup_logging
+
+# 配置日志（后台线程写入，文件按大小轮转）
+setup_logging('client.log')
 logger = logging.getLogger(__name__)
 
-class ScreenCaptureThread(QThread):
+class PreviewSubscriber(QObject):
+    # 订阅共享的屏幕抓取，只用于本地预览，不发送到服务器
     frame_ready = pyqtSignal(QImage)
-    error_signal = pyqtSignal(str)
 
-    def __init__(self, socket):
+    def __init__(self, capture_hub):
         super().__init__()
-        self.socket = socket
-        self.running = True
-        self.sct = None  # 将在run方法中初始化
-        self.last_send_time = 0
-        self.frame_interval = 1/30  # 30 FPS
-        self.is_local_preview = socket is None  # 是否是本地预览模式
-
-    def run(self):
-        try:
-            # 在线程中初始化mss
-            self.sct = mss()
-            logger.info("屏幕捕获线程启动")
-            
-            while self.running:
-                try:
-                    current_time = time.time()
-                    if current_time - self.last_send_time >= self.frame_interval:
-                        # 捕获屏幕
-                        monitor = self.sct.monitors[1]  # 主显示器
-                        screenshot = self.sct.grab(monitor)
-                        
-                        # 转换为PIL Image
-                        img = Image.frombytes('RGB', screenshot.size, screenshot.rgb)
-                        
-                        # 压缩图像
-                        img = img.resize((800, 600), Image.Resampling.LANCZOS)
-                        
-                        # 转换为QImage
-                        qimg = QImage(img.tobytes(), img.width, img.height, img.width * 3, QImage.Format.Format_RGB888)
-                        
-                        # 发送帧到预览窗口
-                        self.frame_ready.emit(qimg)
-                        
-                        # 如果不是本地预览模式，则发送到服务器
-                        if not self.is_local_preview:
-                            self.send_frame(img)
-                        
-                        self.last_send_time = current_time
-                    
-                    # 添加睡眠时间，减少CPU使用
-                    time.sleep(self.sleep_time)
-                    
-                except Exception as e:
-                    logger.error(f"屏幕捕获循环错误: {str(e)}")
-                    time.sleep(1)  # 发生错误时等待一秒再继续
-                    continue
-                    
-        except Exception as e:
-            error_msg = f"屏幕捕获线程错误: {str(e)}"
-            logger.error(error_msg)
-            self.error_signal.emit(error_msg)
-        finally:
-            self.stop()
+        self.capture_hub = capture_hub
+        self.subscription = None
 
-    def send_frame(self, img):
-        try:
-            # 将图像转换为字节
-            img_bytes = img.tobytes()
-            # 发送帧类型标识
-            self.socket.send(b'F')
-            # 发送图像大小
-            self.socket.send(len(img_bytes).to_bytes(4, 'big'))
-            # 发送图像数据
-            self.socket.send(img_bytes)
-        except Exception as e:
-            logger.error(f"发送帧错误: {str(e)}")
-            raise
+    def start(self):
+        self.subscription = self.capture_hub.subscribe(self.emit_preview, name="本地预览")
 
     def stop(self):
-        self.running = False
-        if self.sct:
-            self.sct.close()
-        logger.info("屏幕捕获线程已停止")
+        if self.subscription:
+            self.capture_hub.unsubscribe(self.subscription)
+            self.subscription = None
+
+    def emit_preview(self, frame):
+        # QImage直接引用抓取数组并持有其引用，不拷贝像素；信号跨线程排队到界面线程
+        pixels, _ = frame
+        self.frame_ready.emit(framebuffer_to_qimage(pixels))
 
 class ClientThread(QThread):
+    # 在后台线程运行无界面的RemoteClient，把回调转为Qt信号
     status_signal = pyqtSignal(str)
     error_signal = pyqtSignal(str)
-    frame_ready = pyqtSignal(QPixmap)
+    frame_ready = pyqtSignal(QImage)
     connection_lost = pyqtSignal()  # 添加连接丢失信号
 
-    def __init__(self, host, port):
+    def __init__(self, host, port, capture_hub, codec='raw', quality=DEFAULT_QUALITY, input_window=0.01,
+                 target_size=(800, 600)):
         super().__init__()
-        self.host = host
-        self.port = port
-        self.running = True
-        self.socket = None
-        self.mouse_listener = None
-        self.keyboard_listener = None
-        self.screen_capture = None
-        self.connected = False
-        self.reconnect_attempts = 0
-        self.max_reconnect_attempts = 3
-        self.reconnect_delay = 2  # 重连延迟（秒）
+        self.client = RemoteClient(host, port, capture_hub, codec, quality, input_window,
+                                   target_size=target_size,
+                                   on_status=self.status_signal.emit,
+                                   on_connection_lost=self.connection_lost.emit,
+                                   on_frame=self.handle_frame)
 
     def run(self):
-        while self.running:
-            try:
-                if not self.connected:
-                    self.connect_to_server()
-                
-                if self.connected:
-                    # 保持连接活跃
-                    self.socket.send(b'P')  # 发送心跳包
-                    time.sleep(1)
-                
-            except Exception as e:
-                error_msg = f"连接错误: {str(e)}"
-                logger.error(error_msg)
-                self.handle_connection_error()
-                time.sleep(self.reconnect_delay)
-
-    def connect_to_server(self):
         try:
-            logger.info(f"正在连接到服务器 {self.host}:{self.port}")
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.settimeout(5)  # 设置连接超时
-            self.socket.connect((self.host, self.port))
-            self.socket.settimeout(None)  # 取消超时设置
-            
-            self.connected = True
-            self.reconnect_attempts = 0
-            self.status_signal.emit("已连接到服务器")
-            logger.info("成功连接到服务器")
-
-            # 设置鼠标监听器
-            if not self.mouse_listener or not self.mouse_listener.is_alive():
-                self.mouse_listener = mouse.Listener(
-                    on_click=self.on_click,
-                    on_move=self.on_move)
-                self.mouse_listener.start()
-                logger.info("鼠标监听器已启动")
-
-            # 设置键盘监听器
-            if not self.keyboard_listener or not self.keyboard_listener.is_alive():
-                self.keyboard_listener = keyboard.Listener(
-                    on_press=self.on_press,
-                    on_release=self.on_release)
-                self.keyboard_listener.start()
-                logger.info("键盘监听器已启动")
-
-            # 启动屏幕捕获
-            if not self.screen_capture or not self.screen_capture.isRunning():
-                self.screen_capture = ScreenCaptureThread(self.socket)
-                self.screen_capture.frame_ready.connect(self.handle_frame)
-                self.screen_capture.error_signal.connect(self.handle_screen_capture_error)
-                self.screen_capture.start()
-                logger.info("屏幕捕获已启动")
-
+            self.client.run()
         except Exception as e:
-            self.handle_connection_error()
-            raise
-
-    def handle_connection_error(self):
-        self.connected = False
-        self.reconnect_attempts += 1
-        
-        if self.reconnect_attempts >= self.max_reconnect_attempts:
-            self.status_signal.emit("连接失败，已达到最大重试次数")
-            self.connection_lost.emit()
-            self.stop()
-            return
-            
-        self.status_signal.emit(f"连接断开，正在尝试重连 ({self.reconnect_attempts}/{self.max_reconnect_attempts})")
-        logger.warning(f"连接断开，尝试重连 ({self.reconnect_attempts}/{self.max_reconnect_attempts})")
-
-    def handle_screen_capture_error(self, error_msg):
-        logger.error(f"屏幕捕获错误: {error_msg}")
-        self.handle_connection_error()
-
-    def handle_frame(self, qimg):
-        # 更新预览窗口
-        pixmap = QPixmap.fromImage(qimg)
-        self.frame_ready.emit(pixmap)
-
-    def on_click(self, x, y, button, pressed):
-        if pressed:
-            command = {
-                'type': 'mouse_click',
-                'x': x,
-                'y': y
-            }
-            self.send_command(command)
-            logger.debug(f"发送鼠标点击事件: x={x}, y={y}")
-
-    def on_move(self, x, y):
-        command = {
-            'type': 'mouse_move',
-            'x': x,
-            'y': y
-        }
-        self.send_command(command)
-        logger.debug(f"发送鼠标移动事件: x={x}, y={y}")
-
-    def on_press(self, key):
-        try:
-            key_char = key.char
-            command = {
-                'type': 'key_press',
-                'key': key_char
-            }
-            self.send_command(command)
-            logger.debug(f"发送按键按下事件: {key_char}")
-        except AttributeError:
-            pass
-
-    def on_release(self, key):
-        try:
-            key_char = key.char
-            command = {
-                'type': 'key_release',
-                'key': key_char
-            }
-            self.send_command(command)
-            logger.debug(f"发送按键释放事件: {key_char}")
-        except AttributeError:
-            pass
-
-    def send_command(self, command):
-        if not self.connected:
-            logger.warning("未连接到服务器，无法发送命令")
-            return
-            
-        try:
-            if self.socket:
-                # 发送命令类型标识
-                self.socket.send(b'C')
-                # 发送命令数据
-                self.socket.send(json.dumps(command).encode('utf-8'))
-        except Exception as e:
-            error_msg = f"发送命令错误: {str(e)}"
+            error_msg = f"客户端错误: {str(e)}"
             logger.error(error_msg)
-            self.handle_connection_error()
+            self.error_signal.emit(error_msg)
+
+    def handle_frame(self, pixels):
+        # 在编码线程中调用；QPixmap只能在界面线程创建，这里只发出QImage
+        self.frame_ready.emit(framebuffer_to_qimage(pixels))
 
     def stop(self):
-        self.running = False
-        self.connected = False
-        
-        if self.mouse_listener:
-            self.mouse_listener.stop()
-        if self.keyboard_listener:
-            self.keyboard_listener.stop()
-        if self.screen_capture:
-            self.screen_capture.stop()
-        if self.socket:
-            try:
-                self.socket.close()
-            except:
-                pass
-        logger.info("客户端已停止")
+        self.client.stop()
 
 class ClientWindow(QMainWindow):
     def __init__(self):
@@ -300,6 +88,25 @@ class ClientWindow(QMainWindow):
         self.host_input.setPlaceholderText("服务器IP地址")
         self.host_input.setText("localhost")
         control_layout.addWidget(self.host_input)
+
+        # 编码方式和质量
+        self.codec_input = QComboBox()
+        self.codec_input.addItems(available_codecs())
+        control_layout.addWidget(self.codec_input)
+
+        self.quality_input = QSpinBox()
+        self.quality_input.setRange(1, 100)
+        self.quality_input.setValue(DEFAULT_QUALITY)
+        self.quality_input.setPrefix("质量 ")
+        control_layout.addWidget(self.quality_input)
+
+        # 传输分辨率，原始分辨率时抓取数据不经缩放直接编码
+        self.size_input = QComboBox()
+        self.size_input.addItem("原始分辨率", None)
+        for size in ((1920, 1080), (1280, 720), (800, 600)):
+            self.size_input.addItem(f"{size[0]}x{size[1]}", size)
+        self.size_input.setCurrentIndex(self.size_input.count() - 1)
+        control_layout.addWidget(self.size_input)
         
         # 连接按钮
         self.connect_button = QPushButton("连接到服务器")
@@ -366,13 +173,19 @@ class ClientWindow(QMainWindow):
         
         self.client_thread = None
         self.local_capture = None
+        self.capture_hub = CaptureHub()  # 本地预览和网络发送共用一次屏幕抓取
+        self.metrics_server = MetricsServer(port=9101)  # 本机Prometheus指标
+        self.metrics_server.start()
         logger.info("客户端界面初始化完成")
 
     def toggle_connection(self):
         if self.client_thread is None:
             # 连接到服务器
             host = self.host_input.text()
-            self.client_thread = ClientThread(host, 5000)
+            self.client_thread = ClientThread(host, 5000, self.capture_hub,
+                                              self.codec_input.currentText(),
+                                              self.quality_input.value(),
+                                              target_size=self.size_input.currentData())
             self.client_thread.status_signal.connect(self.update_status)
             self.client_thread.error_signal.connect(self.show_error)
             self.client_thread.frame_ready.connect(self.update_remote_screen)
@@ -396,8 +209,8 @@ class ClientWindow(QMainWindow):
 
     def start_local_preview(self):
         if not self.local_capture:
-            # 创建一个新的 ScreenCaptureThread 实例，但不会发送到服务器
-            self.local_capture = ScreenCaptureThread(None)
+            # 与网络发送共用同一个抓取源，只订阅画面，不发送到服务器
+            self.local_capture = PreviewSubscriber(self.capture_hub)
             self.local_capture.frame_ready.connect(self.update_local_screen)
             self.local_capture.start()
             logger.info("本地预览已启动")
@@ -413,9 +226,9 @@ class ClientWindow(QMainWindow):
         pixmap = QPixmap.fromImage(qimg)
         self.local_screen.setPixmap(pixmap)
 
-    def update_remote_screen(self, pixmap):
+    def update_remote_screen(self, qimg):
         # 更新远程预览窗口，显示被控端(客户端)的屏幕内容
-        self.remote_screen.setPixmap(pixmap)
+        self.remote_screen.setPixmap(QPixmap.fromImage(qimg))
 
     def handle_connection_lost(self):
         self.connect_button.setText("连接到服务器")
@@ -436,6 +249,8 @@ class ClientWindow(QMainWindow):
         if self.client_thread:
             self.client_thread.stop()
         self.stop_local_preview()
+        self.capture_hub.stop()
+        self.metrics_server.stop()
         logger.info("应用程序关闭")
         event.accept()
 
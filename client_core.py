@@ -0,0 +1,484 @@
+import os
+import json
+import sys
+import time
+import socket
+import select
+import logging
+import argparse
+from capture import CaptureHub
+from pipeline import Pipeline, Stage
+from protocol import (MessageReader, MessageWriter, handshake, MSG_FRAME, MSG_PING, MSG_REFRESH,
+                      MSG_INPUT, FLAG_KEYFRAME, FLAG_UNCHANGED, FLAG_SHARED, ROLE_SOURCE, TRANSPORT_TCP,
+                      TRANSPORT_UDP, TRANSPORT_SHM, TRANSPORT_AUTO)
+from datagram import open_sender
+from shared_frames import SharedFrameWriter, is_local_host
+from tiles import TileEncoder, stamp_frame
+from buffer_pool import BufferPool
+from codec import DEFAULT_QUALITY, available_codecs, get_codec
+from pixel_format import DEFAULT_PIXEL_FORMAT, FORMAT_IDS, frame_format
+from congestion import AdaptiveController, PING, queued_bytes
+from metrics import REGISTRY, SIZE_BUCKETS, MetricsServer
+from log_config import setup_logging
+from input_events import (InputBatcher, MOUSE_BUTTONS, EV_MOUSE_CLICK, EV_KEY_PRESS,
+                          EV_KEY_RELEASE)
+
+logger = logging.getLogger(__name__)
+
+
+def _ignore(*args):
+    pass
+
+
+class FrameSender:
+    # 订阅共享的屏幕抓取，编码 -> 发送 两级流水线，不依赖Qt
+    # 编码阶段的输入队列满时丢弃旧帧；发送阶段不能丢（增量帧依赖前一帧），满时阻塞编码
+    # adaptive=False时固定帧率和质量（benchmark需要可复现的结果）
+    # 画面无变化时抓取端不分发，这里每隔keepalive_interval秒发送一次空的保活帧
+    # datagram: DatagramSender，画面帧改经UDP发送（按块拆分，不检测滚动）；保活帧仍走TCP
+    # shared: SharedFrameWriter，只比较不编码，变化区域写入共享内存，TCP上只发通知
+    def __init__(self, send, sock, capture_hub, session, fps=30, adaptive=True, workers=None, on_frame=None,
+                 keepalive_interval=2.0, datagram=None, shared=None):
+        self.send = send  # send(消息类型, 负载, 标志)
+        self.socket = sock  # 只用于查询发送缓冲区排队字节数
+        self.capture_hub = capture_hub
+        self.size = tuple(session['size'])  # 与服务器协商的传输分辨率
+        self.pixel_format = session['pixel_format']
+        self.fps = fps
+        self.adaptive = adaptive
+        self.on_frame = on_frame or _ignore  # 编码前的画面，供界面预览
+        self.datagram = datagram
+        self.shared = shared
+        self.subscription = None
+        # 只发送与上一帧相比变化的块，多个块并行编码
+        # UDP传输时每个块单独成为一个单元，复制指令依赖前一帧完整到达，不能使用
+        self.encoder = TileEncoder(codec=get_codec(session['codec']), quality=session['quality'],
+                                   workers=workers or os.cpu_count() or 1, detect_scroll=datagram is None,
+                                   max_rect_tiles=1 if datagram else None, pool=BufferPool(),
+                                   pixel_format=self.pixel_format)
+        # 根据发送耗时、排队字节数和往返时延调整帧率、质量和分辨率
+        self.controller = AdaptiveController(max_fps=fps, max_quality=session['quality'],
+                                             lossy=self.encoder.codec.lossy)
+        self.pipeline = Pipeline([Stage('encode', self.encode_frame),
+                                  Stage('send', self.send_frame, maxsize=2, drop_oldest=False)])
+        self.seq = 0
+        self.keepalive_interval = keepalive_interval
+        self.last_sent = 0  # 最近一次发送的时刻（perf_counter）
+        # 各阶段相对抓取时刻的延迟
+        self.encode_latency = REGISTRY.histogram('frame_latency_seconds', "抓取到各阶段完成的延迟", stage='encode')
+        self.send_latency = REGISTRY.histogram('frame_latency_seconds', "抓取到各阶段完成的延迟", stage='send')
+        self.frame_bytes = REGISTRY.histogram('frame_sent_bytes', "发送的每帧负载字节数", buckets=SIZE_BUCKETS)
+        self.frames_sent = REGISTRY.counter('frames_sent_total', "已发送帧数")
+        self.keepalives_sent = REGISTRY.counter('idle_keepalives_sent_total', "画面无变化时发送的保活帧数")
+        self.refresh_metric = REGISTRY.counter('refresh_requests_received_total', "服务器请求重发的次数")
+
+    def start(self):
+        self.pipeline.start()
+        self.subscription = self.capture_hub.subscribe(self.pipeline.put, fps=self.fps, size=self.size,
+                                                       name="网络发送", pixel_format=frame_format(self.pixel_format),
+                                                       on_unchanged=self.on_unchanged)
+        logger.info("屏幕发送已启动")
+
+    def stop(self):
+        if self.subscription:
+            self.capture_hub.unsubscribe(self.subscription)
+            self.subscription = None
+        self.pipeline.stop()
+        self.encoder.close()
+        if self.datagram:
+            self.datagram.close()
+        if self.shared:
+            self.shared.close()
+        logger.info("屏幕发送已停止")
+
+    def refresh(self, request):
+        # 服务器报告UDP丢包: 重发对应区域的当前内容，找不到对应的帧时发送关键帧
+        rects = None
+        if not request.get('keyframe'):
+            rects = self.datagram.lookup(request.get('seq'), request.get('units'))
+        if rects is None:
+            self.encoder.request_keyframe()
+        else:
+            self.encoder.refresh(rects)
+        self.refresh_metric.inc()
+        # 画面静止时抓取端处于低频模式，唤醒以尽快发出
+        self.capture_hub.wake()
+
+    def on_unchanged(self, captured):
+        # 在抓取线程中调用；保活帧也经过流水线，保证与画面帧按顺序从同一线程发出
+        # 有待重发的区域时同样经此路径，编码上一帧的内容
+        if self.encoder.needs_update() or captured - self.last_sent >= self.keepalive_interval:
+            self.last_sent = captured
+            self.pipeline.put((None, captured))
+
+    def encode_frame(self, frame):
+        pixels, captured = frame
+        if pixels is None:
+            if not self.encoder.needs_update() or self.encoder.previous is None:
+                parts = self.encoder.keepalive()
+                return None if parts is None else (None, parts, captured)
+            pixels = self.encoder.previous
+        else:
+            self.on_frame(pixels)
+        if self.shared:
+            # 在编码线程写入共享内存: 槽按顺序轮流使用，写入和发送通知的顺序一致
+            keyframe, copies, rects = self.encoder.diff(pixels)
+            if rects is None:
+                return None
+            try:
+                parts = self.shared.write(pixels, copies, rects)
+            except Exception:
+                # diff已把这些区域计入上一帧，却没能写给服务器；下一帧改为关键帧，否则服务器一直缺这些区域
+                self.encoder.request_keyframe()
+                raise
+            if parts is None:
+                return None  # 发送已停止
+            self.encode_latency.observe(time.perf_counter() - captured)
+            return keyframe, parts, captured
+        keyframe, parts = self.encoder.encode(pixels)
+        if parts is None:
+            return None  # 画面无变化
+        self.encode_latency.observe(time.perf_counter() - captured)
+        return keyframe, parts, captured
+
+    def send_frame(self, encoded):
+        keyframe, parts, captured = encoded
+        try:
+            if keyframe is None:
+                # 保活帧沿用当前帧序号，不计入拥塞控制
+                stamp_frame(parts, self.seq, 0)
+                self.send(MSG_FRAME, parts, FLAG_UNCHANGED)
+                self.keepalives_sent.inc()
+                return
+            flags = FLAG_KEYFRAME if keyframe else 0
+            if self.shared:
+                flags |= FLAG_SHARED
+            self.seq += 1
+            stamp_frame(parts, self.seq, (time.perf_counter() - captured) * 1e6)
+            nbytes = sum(len(part) for part in parts)
+            start = time.perf_counter()
+            if self.datagram:
+                self.datagram.send_frame(self.seq, parts)
+            else:
+                # 分段直接发送（sendmsg），不拼接整帧
+                self.send(MSG_FRAME, parts, flags)
+            sent = time.perf_counter()
+            self.last_sent = sent
+            self.send_latency.observe(sent - captured)
+            self.frame_bytes.observe(nbytes)
+            self.frames_sent.inc()
+            if not self.adaptive:
+                return
+            self.controller.record_send(nbytes, sent - start, queued_bytes(self.socket))
+            if self.encoder.codec.lossy:
+                self.encoder.quality = self.controller.quality
+            # 按拥塞情况调整订阅的帧率和尺寸
+            scale = self.controller.scale
+            self.subscription.fps = self.controller.fps
+            self.subscription.size = (int(self.size[0] * scale), int(self.size[1] * scale))
+        except Exception as e:
+            logger.error(f"发送帧错误: {str(e)}")
+            raise
+        finally:
+            # 发送完成（数据已进入内核）后归还编码缓冲区
+            self.encoder.pool.release(parts)
+
+
+class InputCapture:
+    # 监听本机鼠标键盘（pynput，需要图形桌面），事件交给InputBatcher合批发送
+    # on_activity: 每个本机输入事件都调用（如唤醒空闲的屏幕抓取）
+    def __init__(self, batcher, on_activity=None):
+        self.batcher = batcher
+        self.on_activity = on_activity or _ignore
+        self.mouse_listener = None
+        self.keyboard_listener = None
+
+    def start(self):
+        from pynput import mouse, keyboard
+        if not self.mouse_listener or not self.mouse_listener.is_alive():
+            self.mouse_listener = mouse.Listener(on_click=self.on_click, on_move=self.on_move)
+            self.mouse_listener.start()
+            logger.info("鼠标监听器已启动")
+        if not self.keyboard_listener or not self.keyboard_listener.is_alive():
+            self.keyboard_listener = keyboard.Listener(on_press=self.on_press, on_release=self.on_release)
+            self.keyboard_listener.start()
+            logger.info("键盘监听器已启动")
+
+    def stop(self):
+        if self.mouse_listener:
+            self.mouse_listener.stop()
+        if self.keyboard_listener:
+            self.keyboard_listener.stop()
+
+    def on_click(self, x, y, button, pressed):
+        self.on_activity()
+        if pressed:
+            detail = MOUSE_BUTTONS.index(button.name) if button.name in MOUSE_BUTTONS else 0
+            self.batcher.push(EV_MOUSE_CLICK, x, y, detail)
+            logger.debug(f"发送鼠标点击事件: x={x}, y={y}")
+
+    def on_move(self, x, y):
+        # 高频回调，不记录日志；合并窗口内只保留最后位置
+        self.on_activity()
+        self.batcher.push_move(x, y)
+
+    def on_press(self, key):
+        self.on_activity()
+        key_char = getattr(key, 'char', None)
+        if key_char:
+            self.batcher.push(EV_KEY_PRESS, ord(key_char))
+            logger.debug(f"发送按键按下事件: {key_char}")
+
+    def on_release(self, key):
+        key_char = getattr(key, 'char', None)
+        if key_char:
+            self.batcher.push(EV_KEY_RELEASE, ord(key_char))
+            logger.debug(f"发送按键释放事件: {key_char}")
+
+
+class RemoteClient:
+    # 画面来源端: 连接服务器、握手、心跳与重连、发送画面和本机输入，不依赖Qt
+    # run()阻塞直到stop()或重连次数用尽；界面通过回调接收状态
+    # transport='udp'时画面经UDP发送（服务器不支持时仍用TCP）；udp_loss/udp_delay/udp_jitter在本机模拟丢包和延迟
+    # transport='auto'（默认）时，服务器在本机则经共享内存传输画面，否则用TCP
+    def __init__(self, host, port, capture_hub, codec='raw', quality=DEFAULT_QUALITY, input_window=0.01,
+                 target_size=(800, 600), pixel_format=DEFAULT_PIXEL_FORMAT, fps=30, adaptive=True,
+                 workers=None, capture_input=True, on_status=None, on_connection_lost=None, on_frame=None,
+                 transport=TRANSPORT_AUTO, udp_loss=0.0, udp_delay=0.0, udp_jitter=0.0):
+        self.host = host
+        self.port = port
+        self.capture_hub = capture_hub
+        self.codec = codec
+        self.quality = quality
+        self.target_size = target_size  # None表示按原始分辨率传输
+        self.pixel_format = pixel_format
+        self.fps = fps
+        self.adaptive = adaptive
+        self.workers = workers
+        self.transport = transport
+        self.impairment = (udp_loss, udp_delay, udp_jitter)
+        self.on_status = on_status or _ignore
+        self.on_connection_lost = on_connection_lost or _ignore
+        self.on_frame = on_frame
+        self.session = None  # 服务器确认的会话参数
+        self.running = True
+        self.socket = None
+        self.sender = None
+        self.connected = False
+        self.reconnect_attempts = 0
+        self.max_reconnect_attempts = 3
+        self.reconnect_delay = 2  # 重连延迟（秒）
+        self.shared = None  # 共享内存传输时在握手前创建
+        self.reader = None  # 接收服务器消息（握手应答、心跳回包）
+        self.writer = None  # 连接建立后创建
+        self.heartbeat_interval = 1
+        self.last_ping_time = 0
+        self.rtt_metric = REGISTRY.histogram('network_rtt_seconds', "心跳往返时延")
+        # 鼠标键盘事件按二进制格式合批发送
+        self.input_batcher = InputBatcher(self.send_input, input_window)
+        # 本机有输入时唤醒空闲的屏幕抓取，不等下一次低频抓取
+        self.input_capture = InputCapture(self.input_batcher, capture_hub.wake) if capture_input else None
+
+    def run(self):
+        while self.running:
+            try:
+                if not self.connected:
+                    self.connect_to_server()
+
+                if self.connected:
+                    # 保持连接活跃，心跳包携带发送时刻用于测量往返时延
+                    now = time.monotonic()
+                    if now - self.last_ping_time >= self.heartbeat_interval:
+                        self.writer.send_urgent(MSG_PING, PING.pack(now))
+                        self.last_ping_time = now
+                    self.poll_server(self.last_ping_time + self.heartbeat_interval - now)
+
+            except Exception as e:
+                if not self.running:
+                    break
+                logger.error(f"连接错误: {str(e)}")
+                self.handle_connection_error()
+                time.sleep(self.reconnect_delay)
+
+    def connect_to_server(self):
+        logger.info(f"正在连接到服务器 {self.host}:{self.port}")
+        self.close_socket()
+        self.socket = socket.create_connection((self.host, self.port), timeout=5)
+        self.session = self.handshake()
+        self.socket.settimeout(None)  # 取消超时设置
+        # 画面、输入和心跳由不同线程发送，经同一个writer串行化；输入和心跳优先
+        self.writer = MessageWriter(self.socket)
+
+        self.connected = True
+        self.reconnect_attempts = 0
+        self.on_status("已连接到服务器")
+        logger.info("成功连接到服务器")
+
+        if not self.input_batcher.running:
+            self.input_batcher.start()
+        if self.input_capture:
+            self.input_capture.start()
+
+        # 重连后换用新的socket，旧的发送流水线不能再用
+        if self.sender:
+            self.sender.stop()
+        datagram = None
+        if self.session.get('transport') == TRANSPORT_UDP:
+            datagram = open_sender(self.host, self.session['udp_port'], self.session['udp_token'],
+                                   *self.impairment)
+        elif self.transport == TRANSPORT_UDP:
+            logger.warning("服务器不支持UDP画面传输，改用TCP")
+        shared, self.shared = self.shared, None
+        if shared and self.session.get('transport') != TRANSPORT_SHM:
+            logger.warning("服务器无法使用共享内存，改用TCP")
+            shared.close()
+            shared = None
+        self.sender = FrameSender(self.send, self.socket, self.capture_hub, self.session,
+                                  fps=self.fps, adaptive=self.adaptive, workers=self.workers,
+                                  on_frame=self.on_frame, datagram=datagram, shared=shared)
+        self.sender.start()
+
+    def handshake(self):
+        # 发送本端支持的编解码器、像素格式、原始和期望分辨率，等待服务器确认
+        hello = {'role': ROLE_SOURCE, 'codecs': available_codecs(),
+                 'codec': self.codec, 'quality': self.quality,
+                 'formats': list(FORMAT_IDS), 'pixel_format': self.pixel_format,
+                 'source_size': self.capture_hub.source_size(), 'target_size': self.target_size,
+                 'transport': self.transport}
+        if self.transport == TRANSPORT_SHM or (self.transport == TRANSPORT_AUTO and is_local_host(self.host)):
+            self.shared = self.create_shared()
+            hello.update(transport=TRANSPORT_SHM, shm_name=self.shared.name, shm_nonce=self.shared.nonce.hex())
+        elif self.transport == TRANSPORT_AUTO:
+            hello['transport'] = TRANSPORT_TCP
+        self.reader = MessageReader(capacity=64 * 1024)
+        session = handshake(self.socket, hello, self.reader)
+        width, height = session['size']
+        logger.info(f"会话参数: 编解码器={session['codec']}, 质量={session['quality']}, "
+                    f"分辨率={width}x{height}, 像素格式={session['pixel_format']}, "
+                    f"画面传输={session.get('transport', TRANSPORT_TCP)}")
+        return session
+
+    def create_shared(self):
+        # 按原始和期望分辨率中较大者、每像素4字节分配，之后的缩放只会更小
+        if self.shared:
+            self.shared.close()
+        sizes = [self.capture_hub.source_size(), self.target_size or (0, 0)]
+        return SharedFrameWriter(max(width * height for width, height in sizes) * 4)
+
+    def poll_server(self, timeout):
+        # 用select等待，避免给共享的socket设置超时而影响帧发送
+        readable, _, _ = select.select([self.socket], [], [], max(0, timeout))
+        if not readable:
+            return
+        if self.reader.recv_from(self.socket) == 0:
+            raise ConnectionError("连接已断开")
+        for msg_type, flags, payload in self.reader.messages():
+            if msg_type == MSG_PING and len(payload) == PING.size:
+                rtt = time.monotonic() - PING.unpack(payload)[0]
+                self.rtt_metric.observe(rtt)
+                if self.sender:
+                    self.sender.controller.record_rtt(rtt)
+            elif msg_type == MSG_REFRESH and self.sender and self.sender.datagram:
+                self.sender.refresh(json.loads(bytes(payload)))
+
+    def handle_connection_error(self):
+        self.connected = False
+        self.reconnect_attempts += 1
+
+        if self.reconnect_attempts >= self.max_reconnect_attempts:
+            self.on_status("连接失败，已达到最大重试次数")
+            self.on_connection_lost()
+            self.stop()
+            return
+
+        self.on_status(f"连接断开，正在尝试重连 ({self.reconnect_attempts}/{self.max_reconnect_attempts})")
+        logger.warning(f"连接断开，尝试重连 ({self.reconnect_attempts}/{self.max_reconnect_attempts})")
+
+    def send(self, msg_type, payload=b'', flags=0):
+        # 画面等大消息（可以是分段列表），分块发送
+        self.writer.send(msg_type, payload, flags)
+
+    def send_input(self, batch):
+        if not self.connected:
+            logger.warning("未连接到服务器，无法发送输入事件")
+            return
+
+        try:
+            if self.socket:
+                self.writer.send_urgent(MSG_INPUT, batch)
+        except Exception as e:
+            logger.error(f"发送输入事件错误: {str(e)}")
+            self.handle_connection_error()
+
+    def close_socket(self):
+        if self.socket:
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+            self.socket = None
+
+    def stop(self):
+        self.running = False
+        self.connected = False
+        if self.input_capture:
+            self.input_capture.stop()
+        self.input_batcher.stop()
+        if self.sender:
+            self.sender.stop()
+        if self.shared:
+            self.shared.close()
+            self.shared = None
+        self.close_socket()
+        logger.info("客户端已停止")
+
+
+def main(argv=None):
+    from server_core import parse_size
+
+    parser = argparse.ArgumentParser(description="无界面远程控制客户端（画面来源端）")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--codec', choices=available_codecs(), default='raw')
+    parser.add_argument('--quality', type=int, default=DEFAULT_QUALITY)
+    parser.add_argument('--pixel-format', choices=list(FORMAT_IDS), default=DEFAULT_PIXEL_FORMAT,
+                        help="传输的像素格式，yuv420只用于raw和zlib编码")
+    parser.add_argument('--size', type=parse_size, default=(800, 600), help="传输分辨率，如 1280x720")
+    parser.add_argument('--native-size', action='store_true', help="按原始分辨率传输")
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--monitor', type=int, default=1, help="抓取的显示器编号")
+    parser.add_argument('--transport', choices=(TRANSPORT_AUTO, TRANSPORT_TCP, TRANSPORT_UDP, TRANSPORT_SHM),
+                        default=TRANSPORT_AUTO,
+                        help="画面传输方式，auto表示服务器在本机时用共享内存；udp时输入和控制消息仍走TCP")
+    parser.add_argument('--udp-loss', type=float, default=0.0, help="测试用: UDP丢包比例，如 0.02")
+    parser.add_argument('--udp-delay', type=float, default=0.0, help="测试用: UDP附加延迟（秒）")
+    parser.add_argument('--udp-jitter', type=float, default=0.0, help="测试用: UDP延迟抖动（秒），会造成乱序")
+    parser.add_argument('--no-input', action='store_true', help="不监听和发送本机鼠标键盘")
+    parser.add_argument('--metrics-port', type=int, default=9101, help="本机Prometheus指标端口，0表示关闭")
+    parser.add_argument('--log-file', help="日志文件（按大小轮转），默认只输出到控制台")
+    parser.add_argument('--log-json', action='store_true', help="每条日志输出一行JSON")
+    parser.add_argument('--loki-url', help="批量推送日志到Loki，如 http://localhost:3100")
+    args = parser.parse_args(argv)
+
+    setup_logging(args.log_file, json_format=args.log_json or None, loki_url=args.loki_url)
+    metrics_server = MetricsServer(args.metrics_port) if args.metrics_port else None
+    if metrics_server:
+        metrics_server.start()
+    capture_hub = CaptureHub(args.monitor)
+    client = RemoteClient(args.host, args.port, capture_hub, args.codec, args.quality,
+                          target_size=None if args.native_size else args.size, pixel_format=args.pixel_format,
+                          fps=args.fps, capture_input=not args.no_input, transport=args.transport, udp_loss=args.udp_loss,
+                          udp_delay=args.udp_delay, udp_jitter=args.udp_jitter)
+    try:
+        client.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.stop()
+        capture_hub.stop()
+        if metrics_server:
+            metrics_server.stop()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+import io
+import zlib
+import numpy as np
+from PIL import Image, features
+
+DEFAULT_QUALITY = 75
+
+
+class Codec:
+    codec_id = None
+    name = None
+    lossy = False
+    planar = False  # 能否编码yuv420平面数据（一维uint8数组，不含图像结构）
+
+    def available(self):
+        return True
+
+    def encode(self, pixels, quality):
+        # pixels: (高, 宽, 通道) 的uint8数组（rgb24为3通道，bgrx32为4通道），返回可直接发送的字节对象
+        raise NotImplementedError
+
+    def decode(self, data, width, height, channels=3):
+        # 返回 (高, 宽, 通道) 的uint8数组
+        raise NotImplementedError
+
+
+class RawCodec(Codec):
+    codec_id = 0
+    name = 'raw'
+    planar = True
+
+    def encode(self, pixels, quality, pool=None):
+        # 连续的区域（整行宽度）直接引用原数组；否则拷贝到pool的缓冲区（没有pool时新分配）
+        if pool is None or pixels.flags.c_contiguous:
+            return np.ascontiguousarray(pixels).reshape(-1).data
+        out = pool.acquire(pixels.nbytes)
+        np.copyto(np.frombuffer(out, dtype=np.uint8).reshape(pixels.shape), pixels)
+        return out
+
+    def decode(self, data, width, height, channels=3):
+        return np.frombuffer(data, dtype=np.uint8, count=width * height * channels).reshape(height, width, channels)
+
+
+class ZlibCodec(Codec):
+    codec_id = 1
+    name = 'zlib'
+    level = 1  # 实时场景优先压缩速度
+    planar = True
+
+    def encode(self, pixels, quality):
+        return zlib.compress(np.ascontiguousarray(pixels), self.level)
+
+    def decode(self, data, width, height, channels=3):
+        raw = zlib.decompress(data)
+        return np.frombuffer(raw, dtype=np.uint8).reshape(height, width, channels)
+
+
+class PillowCodec(Codec):
+    format = None
+    feature = None  # 需要检测的Pillow编译特性
+
+    def available(self):
+        return self.feature is None or features.check(self.feature)
+
+    def save_options(self, quality):
+        return {}
+
+    def encode(self, pixels, quality):
+        height, width, channels = pixels.shape
+        if channels == 4:
+            # bgrx32由Pillow的解包器直接读取，不需要先转换通道顺序
+            img = Image.frombuffer('RGB', (width, height), np.ascontiguousarray(pixels), 'raw', 'BGRX', 0, 1)
+        else:
+            img = Image.fromarray(pixels)
+        out = io.BytesIO()
+        img.save(out, self.format, **self.save_options(quality))
+        return out.getbuffer()
+
+    def decode(self, data, width, height, channels=3):
+        img = Image.open(io.BytesIO(data))
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        if img.size != (width, height):
+            raise ValueError(f"解码尺寸不匹配: {img.size}")
+        if channels == 4:
+            return np.frombuffer(img.tobytes('raw', 'BGRX'), dtype=np.uint8).reshape(height, width, 4)
+        return np.asarray(img)
+
+
+class PngCodec(PillowCodec):
+    codec_id = 2
+    name = 'png'
+    format = 'PNG'
+    feature = 'zlib'
+
+    def save_options(self, quality):
+        return {'compress_level': 1}
+
+
+class JpegCodec(PillowCodec):
+    codec_id = 3
+    name = 'jpeg'
+    format = 'JPEG'
+    feature = 'jpg'
+    lossy = True
+
+    def save_options(self, quality):
+        return {'quality': quality}
+
+
+class WebpCodec(PillowCodec):
+    codec_id = 4
+    name = 'webp'
+    format = 'WEBP'
+    feature = 'webp'
+    lossy = True
+
+    def save_options(self, quality):
+        return {'quality': quality, 'method': 0}
+
+
+# 编解码器注册表，按编号和名称索引
+CODECS = {}
+CODECS_BY_NAME = {}
+
+
+def register_codec(codec):
+    CODECS[codec.codec_id] = codec
+    CODECS_BY_NAME[codec.name] = codec
+
+
+def get_codec(key):
+    codec = CODECS.get(key) if isinstance(key, int) else CODECS_BY_NAME.get(key)
+    if codec is None:
+        raise KeyError(f"未知的编解码器: {key}")
+    return codec
+
+
+def available_codecs():
+    return [codec.name for codec in CODECS.values() if codec.available()]
+
+
+def negotiate_codec(offered, preferred=None):
+    # 优先使用对端首选的编解码器，否则取对端列表中第一个本地可用的
+    local = available_codecs()
+    if preferred in local:
+        return preferred
+    for name in offered:
+        if name in local:
+            return name
+    return RawCodec.name
+
+
+def clamp_quality(quality):
+    return max(1, min(100, int(quality)))
+
+
+for _codec in (RawCodec(), ZlibCodec(), PngCodec(), JpegCodec(), WebpCodec()):
+    register_codec(_codec)
@@ -0,0 +1,119 @@
+import struct
+import time
+
+# 心跳负载: 发送时刻（发送方单调时钟，秒）
+PING = struct.Struct('!d')
+
+try:
+    import fcntl
+    import termios
+    _TIOCOUTQ = termios.TIOCOUTQ
+except (ImportError, AttributeError):
+    fcntl = None
+    _TIOCOUTQ = None
+
+
+def queued_bytes(sock):
+    # 发送缓冲区中尚未发出的字节数，平台不支持时返回0
+    if fcntl is None or sock is None:
+        return 0
+    try:
+        return struct.unpack('i', fcntl.ioctl(sock.fileno(), _TIOCOUTQ, b'\0\0\0\0'))[0]
+    except (OSError, ValueError):
+        return 0
+
+
+# 分辨率只在这几档之间切换: 尺寸每变一次接收端都要收一个完整的关键帧，不能随拥塞连续微调
+SCALE_LEVELS = (1.0, 0.75, 0.5)
+SCALE_HOLD = 5.0  # 两次改变分辨率之间的最短间隔（秒），避免在两档之间来回切换
+
+
+class AdaptiveController:
+    # lossy=False时编码器没有质量参数（raw/zlib/png），跳过调整质量这一步
+    def __init__(self, target_latency=0.15, max_fps=30, min_fps=5,
+                 max_quality=85, min_quality=30, min_scale=0.5, lossy=True, scale_hold=SCALE_HOLD):
+        self.target_latency = target_latency
+        self.max_fps = max_fps
+        self.min_fps = min_fps
+        self.max_quality = max_quality
+        self.min_quality = min_quality
+        self.min_scale = min_scale
+        self.lossy = lossy
+        self.scale_levels = [level for level in SCALE_LEVELS if level >= min_scale]
+        self.scale_hold = scale_hold
+
+        self.fps = max_fps
+        self.quality = max_quality
+        self.scale = 1.0
+        self.scale_changed = 0  # 上次改变分辨率的时刻
+        self.last_congested = 0  # 上次时延超出目标的时刻
+
+        self.rtt = None  # 平滑后的往返时延
+        self.throughput = None  # 平滑后的发送吞吐量（字节/秒）
+        self.send_duration = 0.0
+        self.queued = 0
+        self.adjust_interval = 0.5  # 两次调整之间的最小间隔
+        self.last_adjust = 0
+        self.alpha = 0.2  # EWMA平滑系数
+
+    @property
+    def frame_interval(self):
+        return 1 / self.fps
+
+    def record_rtt(self, rtt):
+        self.rtt = rtt if self.rtt is None else self._smooth(self.rtt, rtt)
+
+    def record_send(self, nbytes, duration, queued=0):
+        self.send_duration = self._smooth(self.send_duration, duration)
+        self.queued = queued
+        if duration > 0 and nbytes > 0:
+            rate = nbytes / duration
+            self.throughput = rate if self.throughput is None else self._smooth(self.throughput, rate)
+        self.adjust()
+
+    def estimated_latency(self):
+        # 单程时延 + 排队中的数据按当前吞吐量发完所需时间 + 本帧写入耗时
+        latency = (self.rtt or 0) / 2 + self.send_duration
+        if self.queued and self.throughput:
+            latency += self.queued / self.throughput
+        return latency
+
+    def adjust(self):
+        now = time.monotonic()
+        if now - self.last_adjust < self.adjust_interval:
+            return
+        self.last_adjust = now
+
+        latency = self.estimated_latency()
+        if latency > self.target_latency:
+            # 乘性减：先降质量，再降帧率，最后降分辨率
+            self.last_congested = now
+            if self.lossy and self.quality > self.min_quality:
+                self.quality = max(self.min_quality, int(self.quality * 0.8))
+            elif self.fps > self.min_fps:
+                self.fps = max(self.min_fps, self.fps * 0.75)
+            else:
+                self.step_scale(1, now)
+        elif latency < self.target_latency / 2:
+            # 加性增：按相反顺序逐步恢复；分辨率还在保持期内时先恢复帧率
+            if not self.step_scale(-1, now):
+                if self.fps < self.max_fps:
+                    self.fps = min(self.max_fps, self.fps + 2)
+                elif self.lossy:
+                    self.quality = min(self.max_quality, self.quality + 5)
+
+    def step_scale(self, direction, now):
+        # 分辨率降一档（direction=1）或升一档（-1），返回是否改变
+        # 距上次改变不足scale_hold秒时不变；升档还要求时延已持续scale_hold秒低于目标
+        levels = self.scale_levels
+        index = levels.index(self.scale) + direction
+        if not 0 <= index < len(levels) or now - self.scale_changed < self.scale_hold:
+            return False
+        if direction < 0 and now - self.last_congested < self.scale_hold:
+            return False
+        self.scale = levels[index]
+        self.scale_changed = now
+        return True
+
+    def _smooth(self, old, new):
+        return old + self.alpha * (new - old)
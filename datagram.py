@@ -0,0 +1,257 @@
+import heapq
+import random
+import struct
+import socket
+import threading
+import time
+from collections import OrderedDict
+from metrics import REGISTRY
+from protocol import as_views, split_chunks
+from tiles import FRAME_HEADER, RECT_HEADER
+
+# 画面的UDP传输: 编码后的帧按矩形拆成独立的单元（每个单元本身是只含一个矩形的帧负载，可单独解码），
+# 单元再按MTU分片；任一分片丢失只影响该单元对应的矩形，接收端经TCP连接请求重发这些区域
+# 输入、心跳、保活帧和重发请求仍走TCP连接
+
+# 数据报头: 会话令牌 帧序号 单元序号 单元数 分片序号 分片数
+PACKET_HEADER = struct.Struct('!IIHHHH')
+DATAGRAM_SIZE = 1400  # 单个数据报的最大长度（含头部），低于以太网MTU，避免IP分片
+HISTORY_FRAMES = 128  # 发送端保留最近多少帧的矩形，用于按 (帧序号, 单元序号) 找回重发区域
+LOSS_TIMEOUT = 0.05  # 未完成的帧超过此时间没有收到新的分片即认为有丢失（秒）
+MAX_PENDING_FRAMES = 64  # 同时未完成的帧数上限，序号跳跃更大时直接请求关键帧
+RECV_BUFFER = 8 * 1024 * 1024  # 接收端socket缓冲区，容纳突发的整帧数据
+
+
+def split_units(parts):
+    # 把encode_rects的负载分段拆为单元: 每个矩形一个，帧头中的矩形数改为1
+    # 返回 [(矩形, 单元分段列表)]；复制指令依赖前一帧的完整内容，不能经数据报发送
+    fields = FRAME_HEADER.unpack(parts[0])
+    if fields[4]:
+        raise ValueError("数据报传输不支持复制指令")
+    header = FRAME_HEADER.pack(*fields[:4], 0, 1, *fields[6:])
+    units = []
+    for i in range(1, len(parts), 2):
+        rect = RECT_HEADER.unpack(parts[i])[:4]
+        units.append((rect, [header, parts[i], parts[i + 1]]))
+    return units
+
+
+def unit_rect(unit):
+    # 单元中唯一矩形的 (x, y, 宽, 高)
+    return RECT_HEADER.unpack_from(unit, FRAME_HEADER.size)[:4]
+
+
+class DatagramSender:
+    # 发送端: 单元按DATAGRAM_SIZE分片，逐个发出；记录最近的帧，收到重发请求时换算成区域
+    # sock可以是LossInjector，用于本机测试丢包和延迟
+    def __init__(self, sock, address, token, datagram_size=DATAGRAM_SIZE):
+        self.socket = sock
+        self.address = address
+        self.token = token
+        self.fragment_size = datagram_size - PACKET_HEADER.size
+        self.lock = threading.Lock()
+        self.history = OrderedDict()  # 帧序号 -> 各单元的矩形
+        self.packets_metric = REGISTRY.counter('datagrams_sent_total', "发送的画面数据报数")
+
+    def send_frame(self, seq, parts):
+        units = split_units(parts)
+        with self.lock:
+            self.history[seq] = [rect for rect, _ in units]
+            while len(self.history) > HISTORY_FRAMES:
+                self.history.popitem(last=False)
+        for index, (_, unit) in enumerate(units):
+            # 分片是单元各分段的memoryview，与数据报头一起以sendmsg发出，不拼接
+            chunks = split_chunks(as_views(unit), self.fragment_size)
+            for fragment, chunk in enumerate(chunks):
+                header = PACKET_HEADER.pack(self.token, seq, index, len(units), fragment, len(chunks))
+                self.send_datagram([header] + chunk)
+            self.packets_metric.inc(len(chunks))
+
+    def send_datagram(self, buffers):
+        if hasattr(self.socket, 'sendmsg'):
+            self.socket.sendmsg(buffers, (), 0, self.address)
+        else:
+            self.socket.sendto(b''.join(buffers), self.address)
+
+    def lookup(self, seq, units=None):
+        # 重发请求对应的区域；units为None表示整帧；帧已不在记录中时返回None（需要关键帧）
+        with self.lock:
+            rects = self.history.get(seq)
+        if rects is None:
+            return None
+        if units is None:
+            return list(rects)
+        return [rects[i] for i in units if i < len(rects)]
+
+    def close(self):
+        self.socket.close()
+
+
+class PendingFrame:
+    # 接收中的一帧；单元数在收到该帧的第一个分片前未知
+    def __init__(self, seq, now):
+        self.seq = seq
+        self.unit_count = None
+        self.fragments = {}  # 单元序号 -> [分片列表, 已收到的分片数]
+        self.done = set()  # 已完成的单元序号
+        self.rects = []  # 已应用到帧缓冲的矩形
+        self.nbytes = 0
+        self.received = time.perf_counter()  # 第一个分片的到达时刻
+        self.latency_us = 0
+        self.last_seen = now
+
+    def complete(self):
+        return self.unit_count is not None and len(self.done) == self.unit_count
+
+    def missing(self):
+        # 未完成的单元序号，什么都没收到时返回None（整帧丢失）
+        if self.unit_count is None:
+            return None
+        return [i for i in range(self.unit_count) if i not in self.done]
+
+
+class FrameAssembler:
+    # 接收端: 按 (帧序号, 单元序号) 拼接分片，完成的单元立即交出；
+    # 已结束（完成或判定丢失）的帧的迟到分片直接丢弃
+    def __init__(self, loss_timeout=LOSS_TIMEOUT, max_pending=MAX_PENDING_FRAMES):
+        self.loss_timeout = loss_timeout
+        self.max_pending = max_pending
+        self.frames = {}  # 帧序号 -> PendingFrame
+        self.next_seq = None  # 尚未见过的最小帧序号
+        self.closed_before = 0  # 小于此序号的帧都已结束
+        self.closed = set()  # 不小于closed_before但已结束的帧序号
+        self.keyframe_needed = False  # 序号跳跃过大，已放弃中间的帧
+
+    def add(self, packet, now):
+        # packet: 完整数据报（含头部）；返回 (完成的单元负载或None, 所属的PendingFrame或None)
+        _, seq, index, unit_count, fragment, count = PACKET_HEADER.unpack_from(packet, 0)
+        if seq < self.closed_before or seq in self.closed or fragment >= count or index >= unit_count:
+            return None, None
+        frame = self.frames.get(seq)
+        if frame is None:
+            frame = self.open(seq, now)
+            if frame is None:
+                return None, None
+        frame.unit_count = unit_count
+        frame.last_seen = now
+        if index in frame.done:
+            return None, frame
+        entry = frame.fragments.get(index)
+        if entry is None:
+            entry = frame.fragments[index] = [[None] * count, 0]
+        chunks = entry[0]
+        if len(chunks) != count or chunks[fragment] is not None:
+            return None, frame
+        chunks[fragment] = packet[PACKET_HEADER.size:]
+        entry[1] += 1
+        if entry[1] < count:
+            return None, frame
+        del frame.fragments[index]
+        frame.done.add(index)
+        unit = b''.join(chunks)
+        frame.nbytes += len(unit)
+        return unit, frame
+
+    def open(self, seq, now):
+        # 首次见到的帧序号；中间跳过的序号先登记为空帧，超时后按整帧丢失处理
+        if self.next_seq is None:
+            self.next_seq = self.closed_before = seq
+        if seq < self.next_seq:
+            # 已登记的空帧之外不会有更早的序号
+            return None
+        if seq - self.next_seq >= self.max_pending:
+            self.keyframe_needed = True
+            for pending in list(self.frames):
+                self.close(pending)
+            self.closed_before = seq
+            self.closed.clear()
+            self.next_seq = seq
+        for skipped in range(self.next_seq, seq + 1):
+            self.frames[skipped] = PendingFrame(skipped, now)
+        self.next_seq = seq + 1
+        return self.frames[seq]
+
+    def close(self, seq):
+        self.frames.pop(seq, None)
+        self.closed.add(seq)
+        while self.closed_before in self.closed:
+            self.closed.discard(self.closed_before)
+            self.closed_before += 1
+
+    def finish(self, frame):
+        self.close(frame.seq)
+
+    def expire(self, now):
+        # 返回超时未完成的帧 [(PendingFrame, 缺失的单元序号或None)]，这些帧随即结束
+        lost = []
+        for frame in list(self.frames.values()):
+            if now - frame.last_seen > self.loss_timeout:
+                lost.append((frame, frame.missing()))
+                self.close(frame.seq)
+        return lost
+
+
+class LossInjector:
+    # 本机测试用: 代替UDP socket的sendto/sendmsg，按比例丢包，按延迟和抖动推迟发送（抖动会造成乱序）
+    def __init__(self, sock, loss=0.0, delay=0.0, jitter=0.0, seed=None):
+        self.socket = sock
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.queue = []  # 堆: (发送时刻, 序号, 数据, 地址)
+        self.counter = 0
+        self.condition = threading.Condition()
+        self.running = True
+        self.dropped_metric = REGISTRY.counter('datagrams_injected_loss_total', "测试时主动丢弃的数据报数")
+        self.thread = None
+        if delay or jitter:
+            self.thread = threading.Thread(target=self.run, name="LossInjector", daemon=True)
+            self.thread.start()
+
+    def sendto(self, data, address):
+        if self.random.random() < self.loss:
+            self.dropped_metric.inc()
+            return len(data)
+        if self.thread is None:
+            return self.socket.sendto(data, address)
+        due = time.monotonic() + max(0.0, self.delay + self.random.uniform(-self.jitter, self.jitter))
+        with self.condition:
+            self.counter += 1
+            heapq.heappush(self.queue, (due, self.counter, data, address))
+            self.condition.notify()
+        return len(data)
+
+    def sendmsg(self, buffers, ancdata=(), flags=0, address=None):
+        return self.sendto(b''.join(buffers), address)
+
+    def run(self):
+        with self.condition:
+            while self.running:
+                if not self.queue:
+                    self.condition.wait()
+                    continue
+                wait = self.queue[0][0] - time.monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+                _, _, data, address = heapq.heappop(self.queue)
+                try:
+                    self.socket.sendto(data, address)
+                except OSError:
+                    pass
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.socket.close()
+
+
+def open_sender(host, port, token, loss=0.0, delay=0.0, jitter=0.0):
+    # 创建发往服务器UDP端口的DatagramSender；设置了丢包或延迟时经LossInjector发送
+    address = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0][4]
+    sock = socket.socket(socket.AF_INET6 if len(address) == 4 else socket.AF_INET, socket.SOCK_DGRAM)
+    if loss or delay or jitter:
+        sock = LossInjector(sock, loss, delay, jitter)
+    return DatagramSender(sock, address, token)
@@ -0,0 +1,128 @@
+import threading
+from PyQt6.QtWidgets import QWidget
+from PyQt6.QtCore import Qt, QRect, QRectF, pyqtSignal
+from PyQt6.QtGui import QImage, QPainter
+from metrics import REGISTRY
+
+MAX_PENDING_RECTS = 64  # 积压的变化矩形超过此数量时改为整帧刷新
+
+
+def framebuffer_to_qimage(framebuffer):
+    # 以帧缓冲内存构造QImage（不拷贝）；bgrx32与Format_RGB32内存布局一致，无需转换通道
+    height, width, channels = framebuffer.shape
+    image_format = QImage.Format.Format_RGB32 if channels == 4 else QImage.Format.Format_RGB888
+    return QImage(framebuffer.data, width, height, width * channels, image_format)
+
+
+class FrameView(QWidget):
+    # 最新帧优先的画面控件: 网络线程调用submit()只记录变化区域，界面线程处理时把变化区域
+    # 从帧缓冲拷贝到自己的后备缓冲并只重绘这些区域；界面来不及处理时多帧合并为一次，
+    # 任何时刻最多一个待处理的通知，信号不会积压，界面卡顿也不会阻塞网络线程
+    # 画面按比例缩放到控件大小（最近邻，不需要GPU）
+    frame_pending = pyqtSignal()
+    frame_shown = pyqtSignal(float, float)  # 来源端延迟, 收到时刻
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.lock = threading.Lock()
+        # 以下由lock保护
+        self.source = None  # 网络线程的帧缓冲，只读
+        self.dirty = []
+        self.timing = None
+        self.pending = False
+        # 以下只在界面线程使用
+        self.backing = None  # 后备缓冲，与QImage共用内存
+        self.image = None
+        self.target = QRect()  # 画面在控件中的位置
+        self.merged_metric = REGISTRY.counter('display_merged_frames_total', "界面来不及显示而合并的帧数")
+        self.frame_pending.connect(self.take_frame, Qt.ConnectionType.QueuedConnection)
+        self.setAttribute(Qt.WidgetAttribute.WA_OpaquePaintEvent)
+
+    def submit(self, framebuffer, rects, timing):
+        # 可从任意线程调用；rects为本帧变化区域 (x, y, 宽, 高)
+        with self.lock:
+            if framebuffer is not self.source:
+                self.source = framebuffer
+                self.dirty = None  # 新的帧缓冲，整帧刷新
+            elif self.dirty is not None:
+                self.dirty.extend(rects)
+                if len(self.dirty) > MAX_PENDING_RECTS:
+                    self.dirty = None
+            self.timing = timing
+            if self.pending:
+                self.merged_metric.inc()
+                return
+            self.pending = True
+        self.frame_pending.emit()
+
+    def clear(self):
+        with self.lock:
+            self.source = None
+            self.dirty = []
+        self.backing = None
+        self.image = None
+        self.update()
+
+    def take_frame(self):
+        with self.lock:
+            source, rects, timing = self.source, self.dirty, self.timing
+            self.dirty = []
+            self.pending = False
+        if source is None:
+            return
+        # 拷贝时网络线程可能正在写入下一帧；写入的区域随后会再次提交，下一次处理时得到最终内容
+        if rects is None or self.backing is None or self.backing.shape != source.shape:
+            if self.backing is None or self.backing.shape != source.shape:
+                self.backing = source.copy()
+                self.image = framebuffer_to_qimage(self.backing)
+                self.update_target()
+            else:
+                self.backing[:] = source
+            self.update()
+        else:
+            for x, y, w, h in rects:
+                self.backing[y:y + h, x:x + w] = source[y:y + h, x:x + w]
+                self.update(self.to_widget_rect(x, y, w, h))
+        _, source_latency, received = timing
+        self.frame_shown.emit(source_latency, received)
+
+    def update_target(self):
+        # 保持宽高比居中显示
+        if self.image is None:
+            return
+        width, height = self.image.width(), self.image.height()
+        scale = min(self.width() / width, self.height() / height)
+        w, h = max(1, int(width * scale)), max(1, int(height * scale))
+        self.target = QRect((self.width() - w) // 2, (self.height() - h) // 2, w, h)
+
+    def to_widget_rect(self, x, y, w, h):
+        # 图像坐标转为控件坐标，向外取整并多留1像素，避免缩放后边缘残留
+        sx = self.target.width() / self.image.width()
+        sy = self.target.height() / self.image.height()
+        left = self.target.x() + int(x * sx) - 1
+        top = self.target.y() + int(y * sy) - 1
+        right = self.target.x() + int((x + w) * sx) + 2
+        bottom = self.target.y() + int((y + h) * sy) + 2
+        return QRect(left, top, right - left, bottom - top)
+
+    def resizeEvent(self, event):
+        self.update_target()
+        super().resizeEvent(event)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        area = event.rect()
+        if self.image is None:
+            painter.fillRect(area, Qt.GlobalColor.black)
+            return
+        if not self.target.contains(area):
+            painter.fillRect(area, Qt.GlobalColor.black)
+        area = area.intersected(self.target)
+        if area.isEmpty():
+            return
+        # 只绘制需要重绘的部分: 把控件区域换算回图像区域
+        sx = self.image.width() / self.target.width()
+        sy = self.image.height() / self.target.height()
+        source = QRectF((area.x() - self.target.x()) * sx, (area.y() - self.target.y()) * sy,
+                        area.width() * sx, area.height() * sy)
+        painter.drawImage(QRectF(area), self.image, source)
@@ -0,0 +1,155 @@
+import time
+import logging
+import threading
+from collections import deque
+from metrics import LatencyStats, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+class PyAutoGUIBackend:
+    name = 'pyautogui'
+
+    def __init__(self):
+        import pyautogui
+        # 默认每次调用后暂停100ms，连续移动会被严重拖慢
+        pyautogui.PAUSE = 0
+        pyautogui.MINIMUM_DURATION = 0
+        self.pyautogui = pyautogui
+
+    def move(self, x, y):
+        self.pyautogui.moveTo(x=x, y=y)
+
+    def click(self, x, y, button):
+        self.pyautogui.click(x=x, y=y, button=button)
+
+    def key_press(self, key):
+        self.pyautogui.press(key)
+
+    def key_release(self, key):
+        self.pyautogui.keyUp(key)
+
+
+class PynputBackend:
+    # 直接使用系统输入接口，没有pyautogui的参数检查和失效保护开销
+    name = 'pynput'
+
+    def __init__(self):
+        from pynput import mouse, keyboard
+        self.mouse = mouse.Controller()
+        self.keyboard = keyboard.Controller()
+        self.buttons = {'left': mouse.Button.left, 'right': mouse.Button.right,
+                        'middle': mouse.Button.middle}
+
+    def move(self, x, y):
+        self.mouse.position = (x, y)
+
+    def click(self, x, y, button):
+        self.mouse.position = (x, y)
+        self.mouse.click(self.buttons.get(button, self.buttons['left']))
+
+    def key_press(self, key):
+        # 与pyautogui.press一致：按下并释放
+        self.keyboard.tap(key)
+
+    def key_release(self, key):
+        self.keyboard.release(key)
+
+
+BACKENDS = {
+    PyAutoGUIBackend.name: PyAutoGUIBackend,
+    PynputBackend.name: PynputBackend,
+}
+
+
+class InputInjector:
+    # 独立线程执行输入注入，网络接收线程只负责入队
+    # 连续的鼠标移动只执行最后一个；点击和按键按顺序全部执行
+    def __init__(self, backend, report_interval=10):
+        self.backend = backend
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.queue_stats = LatencyStats()  # 入队到开始执行
+        self.exec_stats = LatencyStats()  # 执行耗时
+        self.collapsed_moves = 0
+        self.report_interval = report_interval
+        self.last_report = time.monotonic()
+        self.delay_metric = REGISTRY.histogram('input_injection_delay_seconds', "输入事件收到到开始注入的延迟")
+        self.exec_metric = REGISTRY.histogram('input_exec_seconds', "输入事件注入耗时")
+        self.collapsed_metric = REGISTRY.counter('input_collapsed_moves_total', "被后续移动覆盖而跳过的鼠标移动数")
+        REGISTRY.gauge('input_queue_depth', "待注入的输入事件数", func=lambda: len(self.queue))
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="InputInjector", daemon=True)
+        self.thread.start()
+        logger.info(f"输入注入线程启动，后端: {self.backend.name}")
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread:
+            self.thread.join(timeout=1)
+
+    def submit(self, command):
+        # 可从任意线程调用，不阻塞；格式不对的命令在这里丢弃，不能让注入线程因此退出
+        if not isinstance(command, dict) or not isinstance(command.get('type'), str):
+            logger.warning(f"输入命令格式错误，已忽略: {command!r}")
+            return
+        with self.condition:
+            self.queue.append((time.perf_counter_ns(), command))
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                enqueued, command = self.queue.popleft()
+                if command['type'] == 'mouse_move' and self.queue \
+                        and self.queue[0][1]['type'] == 'mouse_move':
+                    # 后面还有移动，当前位置已过时
+                    self.collapsed_moves += 1
+                    self.collapsed_metric.inc()
+                    continue
+
+            start = time.perf_counter_ns()
+            self.queue_stats.record(start - enqueued)
+            self.delay_metric.observe((start - enqueued) / 1e9)
+            self.execute(command)
+            elapsed = time.perf_counter_ns() - start
+            self.exec_stats.record(elapsed)
+            self.exec_metric.observe(elapsed / 1e9)
+            self.report()
+
+    def execute(self, command):
+        try:
+            if command['type'] == 'mouse_click':
+                self.backend.click(command['x'], command['y'], command.get('button', 'left'))
+                logger.debug(f"执行鼠标点击: x={command['x']}, y={command['y']}")
+            elif command['type'] == 'mouse_move':
+                self.backend.move(command['x'], command['y'])
+            elif command['type'] == 'key_press':
+                self.backend.key_press(command['key'])
+                logger.debug(f"执行按键按下: {command['key']}")
+            elif command['type'] == 'key_release':
+                self.backend.key_release(command['key'])
+                logger.debug(f"执行按键释放: {command['key']}")
+        except Exception as e:
+            logger.error(f"执行命令时出错: {str(e)}")
+
+    def report(self):
+        now = time.monotonic()
+        if now - self.last_report < self.report_interval:
+            return
+        self.last_report = now
+        logger.info(f"输入排队延迟: {self.queue_stats.summary()}; 执行耗时: {self.exec_stats.summary()}; "
+                    f"合并移动: {self.collapsed_moves}")
+        self.queue_stats.reset()
+        self.exec_stats.reset()
+        self.collapsed_moves = 0
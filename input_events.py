@@ -0,0 +1,115 @@
+import time
+import struct
+import logging
+import threading
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# 输入事件: 类型(1B) 细节(1B，鼠标按键编号) 保留(2B) 参数a(4B) 参数b(4B)
+# 鼠标事件的a/b为坐标，键盘事件的a为字符码点
+EVENT = struct.Struct('!BBxxii')
+
+EV_MOUSE_MOVE = 1
+EV_MOUSE_CLICK = 2
+EV_KEY_PRESS = 3
+EV_KEY_RELEASE = 4
+
+MOUSE_BUTTONS = ('left', 'right', 'middle')
+
+MAX_CODEPOINT = 0x10FFFF
+
+
+def encode_event(event_type, a=0, b=0, detail=0):
+    return EVENT.pack(event_type, detail, a, b)
+
+
+def decode_events(payload):
+    # 将一批二进制事件转换为命令字典，格式与JSON命令一致
+    for event_type, detail, a, b in EVENT.iter_unpack(payload):
+        if event_type == EV_MOUSE_MOVE:
+            yield {'type': 'mouse_move', 'x': a, 'y': b}
+        elif event_type == EV_MOUSE_CLICK:
+            button = MOUSE_BUTTONS[detail] if detail < len(MOUSE_BUTTONS) else MOUSE_BUTTONS[0]
+            yield {'type': 'mouse_click', 'x': a, 'y': b, 'button': button}
+        elif event_type in (EV_KEY_PRESS, EV_KEY_RELEASE):
+            if not 0 <= a <= MAX_CODEPOINT:
+                # 单个事件的码点无效时只丢弃该事件，批次中的其他事件照常处理
+                logger.warning(f"按键码点无效，已忽略: {a}")
+                continue
+            key_type = 'key_press' if event_type == EV_KEY_PRESS else 'key_release'
+            yield {'type': key_type, 'key': chr(a)}
+
+
+class InputBatcher:
+    # 输入事件合批发送
+    # 鼠标移动在合并窗口内只保留最后位置；点击和按键保持原有顺序，到达后立即发送
+    def __init__(self, send, window=0.01):
+        self.send = send  # send(bytes)，发送一批编码后的事件
+        self.window = window
+        self.events = []
+        self.urgent = False
+        self.running = False
+        self.condition = threading.Condition()
+        self.thread = None
+        self.sent_batches = 0
+        self.coalesced_moves = 0
+        self.first_pushed = None  # 当前批次第一个事件的入队时刻
+        self.delay_metric = REGISTRY.histogram('input_batch_delay_seconds', "输入事件入队到发出的延迟")
+        self.events_metric = REGISTRY.counter('input_events_sent_total', "已发送的输入事件数")
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="InputBatcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread:
+            self.thread.join(timeout=1)
+
+    def push_move(self, x, y):
+        with self.condition:
+            if not self.events:
+                self.first_pushed = time.perf_counter()
+            if self.events and self.events[-1][0] == EV_MOUSE_MOVE:
+                # 上一个待发送事件也是移动，直接覆盖（不会越过点击或按键）
+                self.events[-1] = (EV_MOUSE_MOVE, x, y, 0)
+                self.coalesced_moves += 1
+            else:
+                self.events.append((EV_MOUSE_MOVE, x, y, 0))
+            self.condition.notify()
+
+    def push(self, event_type, a=0, b=0, detail=0):
+        with self.condition:
+            if not self.events:
+                self.first_pushed = time.perf_counter()
+            self.events.append((event_type, a, b, detail))
+            self.urgent = True
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.events:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                if not self.urgent:
+                    # 只有移动事件时等待合并窗口结束，期间的移动会被覆盖
+                    self.condition.wait_for(lambda: self.urgent or not self.running, self.window)
+                events = self.events
+                first_pushed = self.first_pushed
+                self.events = []
+                self.urgent = False
+            batch = b''.join(EVENT.pack(event_type, detail, a, b)
+                             for event_type, a, b, detail in events)
+            try:
+                self.send(batch)
+                self.sent_batches += 1
+                self.delay_metric.observe(time.perf_counter() - first_pushed)
+                self.events_metric.inc(len(events))
+            except Exception as e:
+                logger.error(f"发送输入事件错误: {str(e)}")
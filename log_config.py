@@ -0,0 +1,207 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import urllib.request
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, RotatingFileHandler
+from metrics import REGISTRY
+
+# 日志经队列交给后台线程写文件/控制台/Loki，接收、抓取和输入线程只做入队
+# 未显式传入的参数从环境变量读取: LOG_LEVEL、LOG_JSON=1、LOKI_URL
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+MAX_BYTES = 10 * 1024 * 1024  # 单个日志文件上限，超过后轮转
+BACKUP_COUNT = 5
+QUEUE_SIZE = 10000  # 队列满时丢弃新记录，不阻塞调用线程
+FLUSH_INTERVAL = 1.0  # 批量输出（Loki）的最长等待时间（秒）
+
+_writer = None
+
+
+class JsonFormatter(logging.Formatter):
+    # 每条记录一行JSON，便于日志系统解析
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    # 按调用位置（模块+行号）限流的令牌桶: 每秒rate条，最多积攒burst条
+    # 只限制max_level及以下级别（默认DEBUG，即逐事件日志），放行时附上期间省略的条数
+    def __init__(self, rate=10, burst=20, max_level=logging.DEBUG):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.max_level = max_level
+        self.buckets = {}  # (模块, 行号) -> [令牌数, 上次补充时刻, 省略条数]
+        self.lock = threading.Lock()
+        self.suppressed_metric = REGISTRY.counter('log_records_suppressed_total', "限流省略的日志条数")
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        key = (record.name, record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self.suppressed_metric.inc()
+                return False
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.msg = f"{record.msg} (此前省略 {suppressed} 条)"
+        return True
+
+
+class DropQueueHandler(QueueHandler):
+    # 队列满时丢弃记录并计数，日志不能拖慢帧处理
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped_metric = REGISTRY.counter('log_records_dropped_total', "日志队列满时丢弃的条数")
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_metric.inc()
+
+
+class LokiHandler(logging.Handler):
+    # 本地缓冲，按条数或时间批量推送到Loki（/loki/api/v1/push），一次HTTP请求发送一批
+    # 在日志写入线程中执行，推送失败只丢弃本批，不影响其他输出
+    def __init__(self, url, labels=None, batch_size=100, timeout=5):
+        super().__init__()
+        self.url = url.rstrip('/') + '/loki/api/v1/push'
+        self.labels = labels or {'application': 'remote-desktop'}
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.batch = []  # (纳秒时间戳, 级别, 文本)
+
+    def emit(self, record):
+        self.batch.append((str(int(record.created * 1e9)), record.levelname.lower(), self.format(record)))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        streams = {}
+        for timestamp, level, line in batch:
+            streams.setdefault(level, []).append([timestamp, line])
+        body = {'streams': [{'stream': dict(self.labels, level=level), 'values': values}
+                            for level, values in streams.items()]}
+        request = urllib.request.Request(self.url, json.dumps(body).encode('utf-8'),
+                                         {'Content-Type': 'application/json'})
+        try:
+            urllib.request.urlopen(request, timeout=self.timeout).close()
+        except Exception as e:
+            # 不能再经logging记录，否则推送失败的日志又会进入Loki批次
+            # 写到stderr（同logging.Handler.handleError），stdout留给无界面程序输出结果
+            print(f"推送日志到Loki失败 ({len(batch)} 条): {e}", file=sys.stderr)
+
+
+class LogWriter:
+    # 后台写入线程: 从队列取记录交给各输出；空闲flush_interval秒后刷新批量输出
+    def __init__(self, log_queue, handlers, flush_interval=FLUSH_INTERVAL):
+        self.queue = log_queue
+        self.handlers = handlers
+        self.flush_interval = flush_interval
+        self.thread = threading.Thread(target=self.run, name="LogWriter", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                record = False
+            if record is None:
+                break
+            if record:
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+            now = time.monotonic()
+            if record is False or now - last_flush >= self.flush_interval:
+                last_flush = now
+                for handler in self.handlers:
+                    handler.flush()
+        for handler in self.handlers:
+            handler.flush()
+            handler.close()
+
+    def stop(self):
+        # 写完队列中剩余的记录后退出
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+
+
+def setup_logging(log_file=None, level=None, json_format=None, loki_url=None, console=True,
+                  max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT, debug_rate=10):
+    # 替代logging.basicConfig；重复调用时先停止之前的写入线程
+    global _writer
+    if level is None:
+        level = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    if json_format is None:
+        json_format = os.environ.get('LOG_JSON', '') not in ('', '0')
+    if loki_url is None:
+        loki_url = os.environ.get('LOKI_URL')
+
+    formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+    handlers = []
+    if log_file:
+        handlers.append(RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count,
+                                            encoding='utf-8'))
+    if console:
+        handlers.append(logging.StreamHandler())
+    if loki_url:
+        handlers.append(LokiHandler(loki_url))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    if _writer:
+        _writer.stop()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    log_queue = queue.Queue(QUEUE_SIZE)
+    queue_handler = DropQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(rate=debug_rate, burst=debug_rate * 2))
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _writer = LogWriter(log_queue, handlers)
+    _writer.start()
+    return _writer
+
+
+def shutdown_logging():
+    global _writer
+    if _writer:
+        _writer.stop()
+        _writer = None
+
+
+atexit.register(shutdown_logging)
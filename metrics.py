@@ -0,0 +1,214 @@
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyStats:
+    # 耗时统计（微秒）: 次数、平均、最大
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    def record(self, elapsed_ns):
+        elapsed_us = elapsed_ns // 1000
+        self.count += 1
+        self.total_us += elapsed_us
+        if elapsed_us > self.max_us:
+            self.max_us = elapsed_us
+
+    def summary(self):
+        mean_us = self.total_us / self.count if self.count else 0
+        return f"次数={self.count}, 平均={mean_us:.1f}us, 最大={self.max_us}us"
+
+
+# 直方图桶上限: 延迟（秒）和大小（字节）
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class Counter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class Gauge:
+    # 可直接设置，也可传入函数在导出时取值（如队列长度）
+    def __init__(self, func=None):
+        self.func = func
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        if self.func is None:
+            return self.value
+        try:
+            return self.func()
+        except Exception:
+            return 0
+
+    def samples(self, name, labels):
+        yield name, labels, self.get()
+
+
+class Histogram:
+    # 固定分桶的直方图，分位数按桶内线性插值估计（与Prometheus的histogram_quantile一致）
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个桶为+Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q, since=None):
+        # since: 之前的snapshot()，只统计此后的样本（用于界面上的近期分位数）
+        counts, _, count = self.snapshot()
+        if since is not None:
+            counts = [a - b for a, b in zip(counts, since[0])]
+            count -= since[2]
+        if count <= 0:
+            return 0.0
+        rank = q * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+    def samples(self, name, labels):
+        counts, total, count = self.snapshot()
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            yield name + '_bucket', labels + (('le', le),), cumulative
+        yield name + '_sum', labels, total
+        yield name + '_count', labels, count
+
+
+class MetricsRegistry:
+    # 同名同标签的指标只创建一次，各模块可在任意位置获取
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}  # 名称 -> (类型, 说明, {标签元组: 指标})
+
+    def get(self, kind, factory, name, help_text, labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            if name not in self.metrics or (help_text and not self.metrics[name][1]):
+                # 只取值不注册的调用可能先于带说明的注册
+                children = self.metrics[name][2] if name in self.metrics else {}
+                self.metrics[name] = (kind, help_text, children)
+            children = self.metrics[name][2]
+            if key not in children:
+                children[key] = factory()
+            return children[key]
+
+    def counter(self, name, help_text='', **labels):
+        return self.get('counter', Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text='', func=None, **labels):
+        gauge = self.get('gauge', Gauge, name, help_text, labels)
+        if func is not None:
+            gauge.func = func
+        return gauge
+
+    def histogram(self, name, help_text='', buckets=LATENCY_BUCKETS, **labels):
+        return self.get('histogram', lambda: Histogram(buckets), name, help_text, labels)
+
+    def render(self):
+        # Prometheus文本格式
+        lines = []
+        with self.lock:
+            metrics = [(name, kind, help_text, list(children.items()))
+                       for name, (kind, help_text, children) in sorted(self.metrics.items())]
+        for name, kind, help_text, children in metrics:
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in children:
+                for sample_name, sample_labels, value in metric.samples(name, labels):
+                    if sample_labels:
+                        label_text = ','.join(f'{key}="{value_}"' for key, value_ in sample_labels)
+                        sample_name = f"{sample_name}{{{label_text}}}"
+                    lines.append(f"{sample_name} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+class MetricsServer:
+    # 在本机地址上以Prometheus文本格式导出指标: GET /metrics
+    def __init__(self, port=9100, host='127.0.0.1', registry=REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.httpd = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # 抓取请求很频繁，不写日志
+
+        try:
+            self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            logger.error(f"指标服务启动失败 {self.host}:{self.port}: {str(e)}")
+            return False
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, name="MetricsServer", daemon=True).start()
+        logger.info(f"指标服务已启动: http://{self.host}:{self.port}/metrics")
+        return True
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
@@ -0,0 +1,118 @@
+import time
+import logging
+import threading
+from collections import deque
+from metrics import LatencyStats, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    # 流水线阶段: 独立线程 + 有界输入队列
+    # drop_oldest=True 时队列满则丢弃最旧的数据（最新帧优先）；否则阻塞上游，保证数据不丢
+    def __init__(self, name, func, maxsize=1, drop_oldest=True, report_interval=10):
+        self.name = name
+        self.func = func  # 返回值交给下一阶段，返回None表示到此为止
+        self.maxsize = maxsize
+        self.drop_oldest = drop_oldest
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.next = None
+        self.running = False
+        self.thread = None
+        self.stats = LatencyStats()
+        self.dropped = 0
+        self.report_interval = report_interval
+        self.last_report = time.monotonic()
+        self.duration_metric = REGISTRY.histogram('pipeline_stage_seconds', "流水线阶段处理耗时", stage=name)
+        self.cpu_metric = REGISTRY.counter('pipeline_stage_cpu_seconds_total', "流水线阶段占用的CPU时间", stage=name)
+        self.dropped_metric = REGISTRY.counter('pipeline_dropped_frames_total', "流水线队列满时丢弃的帧数", stage=name)
+        REGISTRY.gauge('pipeline_queue_depth', "流水线阶段输入队列长度", func=lambda: len(self.queue), stage=name)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=f"Stage-{self.name}", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def join(self, timeout=None):
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    def put(self, item):
+        with self.condition:
+            if len(self.queue) >= self.maxsize:
+                if self.drop_oldest:
+                    self.queue.popleft()
+                    self.dropped += 1
+                    self.dropped_metric.inc()
+                else:
+                    self.condition.wait_for(lambda: len(self.queue) < self.maxsize or not self.running)
+            if not self.running:
+                return
+            self.queue.append(item)
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.queue or not self.running)
+                if not self.running:
+                    return
+                item = self.queue.popleft()
+                self.condition.notify_all()  # 唤醒因队列满而阻塞的上游
+
+            start = time.perf_counter_ns()
+            cpu_start = time.thread_time()
+            try:
+                result = self.func(item)
+            except Exception as e:
+                logger.error(f"流水线阶段 {self.name} 处理错误: {str(e)}")
+                result = None
+            elapsed = time.perf_counter_ns() - start
+            self.cpu_metric.inc(time.thread_time() - cpu_start)
+            self.stats.record(elapsed)
+            self.duration_metric.observe(elapsed / 1e9)
+            if result is not None and self.next:
+                self.next.put(result)
+            self.report()
+
+    def report(self):
+        now = time.monotonic()
+        if now - self.last_report < self.report_interval:
+            return
+        self.last_report = now
+        logger.info(f"流水线阶段 {self.name}: {self.stats.summary()}, 丢弃={self.dropped}, 队列={len(self.queue)}")
+        self.stats.reset()
+        self.dropped = 0
+
+
+class Pipeline:
+    # 按顺序串联各阶段，每个阶段在自己的线程中运行
+    def __init__(self, stages):
+        self.stages = stages
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.next = next_stage
+        self.stopped = threading.Event()
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def put(self, item):
+        self.stages[0].put(item)
+
+    def stop(self):
+        for stage in self.stages:
+            stage.stop()
+        self.stopped.set()
+
+    def wait(self):
+        # 阻塞直到stop()被调用且各阶段线程退出
+        self.stopped.wait()
+        for stage in self.stages:
+            stage.join(timeout=1)
@@ -0,0 +1,124 @@
+import numpy as np
+
+# 像素格式: bgrx32与mss抓取的原始数据和QImage.Format_RGB32内存布局一致，可直接透传
+# yuv420只用于传输: 来源端仍以bgrx32画面比较和分块，编码每个矩形时转为YUV 4:2:0平面数据
+# （亮度全分辨率，两个色度平面各为1/4，每像素1.5字节），接收端解码时还原到bgrx32帧缓冲
+PIXEL_RGB24 = 'rgb24'
+PIXEL_BGRX32 = 'bgrx32'
+PIXEL_YUV420 = 'yuv420'
+
+FORMAT_IDS = {PIXEL_RGB24: 0, PIXEL_BGRX32: 1, PIXEL_YUV420: 2}
+FORMAT_NAMES = {format_id: name for name, format_id in FORMAT_IDS.items()}
+# 帧缓冲（接收端解码后）每像素的字节数
+BYTES_PER_PIXEL = {PIXEL_RGB24: 3, PIXEL_BGRX32: 4, PIXEL_YUV420: 4}
+# 传输格式 -> 来源端内存中的画面格式
+FRAME_FORMATS = {PIXEL_YUV420: PIXEL_BGRX32}
+
+DEFAULT_PIXEL_FORMAT = PIXEL_BGRX32
+
+
+def format_of(pixels):
+    # 根据数组通道数判断像素格式
+    return PIXEL_BGRX32 if pixels.shape[2] == 4 else PIXEL_RGB24
+
+
+def bgrx_to_rgb(pixels):
+    return np.ascontiguousarray(pixels[..., 2::-1])
+
+
+def rgb_to_bgrx(pixels):
+    height, width = pixels.shape[:2]
+    out = np.empty((height, width, 4), dtype=np.uint8)
+    out[..., :3] = pixels[..., ::-1]
+    out[..., 3] = 255
+    return out
+
+
+def frame_format(pixel_format):
+    # 以该格式传输时，来源端抓取和比较使用的画面格式
+    return FRAME_FORMATS.get(pixel_format, pixel_format)
+
+
+def yuv420_size(width, height):
+    # 平面数据的字节数；宽高为奇数时色度平面向上取整
+    return width * height + 2 * (-(-width // 2)) * (-(-height // 2))
+
+
+def to_yuv420(pixels, out=None):
+    # (高, 宽, 通道) 的rgb24或bgrx32数组转为YUV 4:2:0平面数据（BT.601全范围，与JPEG相同），
+    # 依次为Y、U、V平面；out为长度yuv420_size的uint8数组时直接写入
+    # 全程整数运算；色度先对2x2像素求和再变换，只在1/4分辨率上计算
+    height, width = pixels.shape[:2]
+    if out is None:
+        out = np.empty(yuv420_size(width, height), dtype=np.uint8)
+    if pixels.shape[2] == 4:
+        b, g, r = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+    else:
+        r, g, b = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+    luma = np.multiply(r, 77, dtype=np.uint16)
+    luma += np.multiply(g, 150, dtype=np.uint16)
+    luma += np.multiply(b, 29, dtype=np.uint16)
+    luma += 128
+    luma >>= 8
+    out[:width * height].reshape(height, width)[...] = luma
+
+    chroma_width, chroma_height = -(-width // 2), -(-height // 2)
+    if width % 2 or height % 2:
+        # 只有画面边缘的矩形可能是奇数尺寸，复制边缘像素补齐
+        pad = ((0, height % 2), (0, width % 2))
+        r, g, b = (np.pad(channel, pad, mode='edge') for channel in (r, g, b))
+    sums = [np.add(c[0::2, 0::2], c[1::2, 0::2], dtype=np.int32) + c[0::2, 1::2] + c[1::2, 1::2]
+            for c in (r, g, b)]
+    r, g, b = sums
+    size = chroma_width * chroma_height
+    offset = width * height
+    for coefficients in ((-43, -85, 128), (128, -107, -21)):
+        value = r * coefficients[0] + g * coefficients[1] + b * coefficients[2]
+        value += 512
+        value >>= 10  # 四个像素之和再除以256
+        value += 128
+        np.clip(value, 0, 255, out=value)
+        out[offset:offset + size].reshape(chroma_height, chroma_width)[...] = value
+        offset += size
+    return out
+
+
+def yuv420_to_bgrx(planes, width, height, out=None):
+    # to_yuv420的逆变换，结果写入out（(高, 宽, 4) 的数组，可以是帧缓冲的切片）
+    # 色度项在1/4分辨率上计算，按2x2广播到亮度，不展开成全分辨率的色度平面
+    if out is None:
+        out = np.empty((height, width, 4), dtype=np.uint8)
+    chroma_width, chroma_height = -(-width // 2), -(-height // 2)
+    size = chroma_width * chroma_height
+    luma = planes[:width * height].reshape(height, width)
+    if width % 2 or height % 2:
+        luma = np.pad(luma, ((0, height % 2), (0, width % 2)), mode='edge')
+    luma = luma.reshape(chroma_height, 2, chroma_width, 2).astype(np.int16)
+    offset = width * height
+    u, v = (planes[start:start + size].reshape(chroma_height, chroma_width).astype(np.int32) - 128
+            for start in (offset, offset + size))
+    terms = ((454 * u + 128) >> 8, (-88 * u - 183 * v + 128) >> 8, (359 * v + 128) >> 8)  # B G R
+    for channel, term in enumerate(terms):
+        value = luma + term.astype(np.int16)[:, None, :, None]
+        np.clip(value, 0, 255, out=value)
+        out[..., channel] = value.reshape(2 * chroma_height, 2 * chroma_width)[:height, :width]
+    out[..., 3] = 255
+    return out
+
+
+def convert(pixels, pixel_format):
+    pixel_format = frame_format(pixel_format)
+    if format_of(pixels) == pixel_format:
+        return pixels
+    if pixel_format == PIXEL_RGB24:
+        return bgrx_to_rgb(pixels)
+    return rgb_to_bgrx(pixels)
+
+
+def negotiate_pixel_format(offered, preferred=None):
+    if preferred in FORMAT_IDS:
+        return preferred
+    for name in offered:
+        if name in FORMAT_IDS:
+            return name
+    return PIXEL_RGB24
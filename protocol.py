@@ -0,0 +1,294 @@
+import sys
+import json
+import socket
+import struct
+import threading
+from collections import deque
+
+# 协议版本号，头部格式变化时递增
+PROTOCOL_VERSION = 1
+
+# 消息头: 版本(1B) 类型(1B) 标志(1B) 保留(1B) 负载长度(4B)
+HEADER = struct.Struct('!BBBxI')
+HEADER_SIZE = HEADER.size
+
+# 消息类型
+MSG_COMMAND = ord('C')
+MSG_FRAME = ord('F')
+MSG_PING = ord('P')
+MSG_HELLO = ord('H')  # 连接建立时协商会话参数
+MSG_INPUT = ord('I')  # 一批定长二进制输入事件
+MSG_REFRESH = ord('R')  # 服务器请求重发UDP传输中丢失的区域（JSON）
+
+# 连接角色: 画面来源（发送屏幕和输入）、可操作的观看者、只读观看者
+ROLE_SOURCE = 'source'
+ROLE_OPERATOR = 'operator'
+ROLE_VIEWER = 'viewer'
+INPUT_ROLES = (ROLE_SOURCE, ROLE_OPERATOR)
+
+# 来源端画面的传输方式: 与控制消息共用TCP连接，经UDP数据报发送（datagram.py），
+# 或同机时经共享内存（shared_frames.py）；auto表示连接本机时用共享内存，否则用TCP
+TRANSPORT_TCP = 'tcp'
+TRANSPORT_UDP = 'udp'
+TRANSPORT_SHM = 'shm'
+TRANSPORT_AUTO = 'auto'
+
+# 标志位
+FLAG_KEYFRAME = 0x01  # 帧消息: 完整画面，可独立解码
+FLAG_UNCHANGED = 0x02  # 帧消息: 画面无变化的保活帧（0个矩形），来源端空闲时定期发送
+FLAG_MORE = 0x04  # 大消息分块发送，后面还有同一消息的块；最后一块不带此标志
+FLAG_SHARED = 0x08  # 帧消息: 像素在共享内存中，负载只是通知（矩形不带数据）
+
+CHUNK_SIZE = 64 * 1024  # 大消息的分块大小，两块之间可插入输入和心跳
+
+DEFAULT_CAPACITY = 4 * 1024 * 1024  # 接收缓冲区初始大小
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024  # 单条消息上限，防止异常长度耗尽内存
+RECV_CHUNK = 256 * 1024  # 单次recv_into的最大读取量
+IOV_MAX = 1024  # 单次sendmsg的最大分段数（Linux的IOV_MAX）
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def pack_header(msg_type, length, flags=0):
+    return HEADER.pack(PROTOCOL_VERSION, msg_type, flags, length)
+
+
+def pack_message(msg_type, payload=b'', flags=0):
+    return pack_header(msg_type, len(payload), flags) + bytes(payload)
+
+
+def as_views(payload):
+    # 负载可以是单个字节对象或分段列表（如encode_rects的结果），统一为字节memoryview列表
+    if not isinstance(payload, (list, tuple)):
+        payload = [payload]
+    return [memoryview(part).cast('B') for part in payload]
+
+
+def split_chunks(views, chunk_size):
+    # 把分段按chunk_size切块，每块是原数据的memoryview列表，不拷贝；空负载返回一个空块
+    total = sum(len(view) for view in views)
+    if not total:
+        return [[]]
+    chunks = []
+    chunk, size = [], 0
+    for view in views:
+        while len(view):
+            take = min(len(view), chunk_size - size)
+            chunk.append(view[:take])
+            size += take
+            view = view[take:]
+            if size == chunk_size:
+                chunks.append(chunk)
+                chunk, size = [], 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def send_buffers(sock, buffers):
+    # 多段数据以一次sendmsg发出（scatter-gather），不拼接；只发出一部分时从断点继续
+    # 没有sendmsg的平台（Windows）拼接后sendall
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(b''.join(buffers))
+        return
+    views = [view for view in map(memoryview, buffers) if len(view)]
+    index = 0
+    while index < len(views):
+        sent = sock.sendmsg(views[index:index + IOV_MAX])
+        while index < len(views) and sent >= len(views[index]):
+            sent -= len(views[index])
+            index += 1
+        if sent:
+            views[index] = views[index][sent:]
+
+
+def send_message(sock, msg_type, payload=b'', flags=0):
+    # payload可以是分段列表，与头部一次系统调用发出
+    views = as_views(payload)
+    send_buffers(sock, [pack_header(msg_type, sum(len(view) for view in views), flags)] + views)
+
+
+class MessageWriter:
+    # 线程安全的发送端，多个线程共用一个socket时每条消息完整写出，不会交错
+    # send()用于画面等大消息（可以是分段列表）: 按chunk_size分块，每块之前先发出排队的紧急消息
+    # send_urgent()用于输入和心跳: 没有其他线程在写时立即发送，否则排队到下一块之前
+    # Linux上限制内核中未发出的数据量（TCP_NOTSENT_LOWAT），否则紧急消息仍要排在内核缓冲的整帧数据之后
+    def __init__(self, sock, chunk_size=CHUNK_SIZE):
+        self.sock = sock
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()  # 保护socket写入
+        self.bulk_lock = threading.Lock()  # 同一时刻只有一条大消息在分块发送
+        self.urgent = deque()
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if sys.platform.startswith('linux'):
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, 'TCP_NOTSENT_LOWAT', 25), 2 * chunk_size)
+            except OSError:
+                pass
+
+    def send(self, msg_type, payload=b'', flags=0):
+        chunks = split_chunks(as_views(payload), self.chunk_size)
+        with self.bulk_lock:
+            for index, chunk in enumerate(chunks):
+                more = FLAG_MORE if index < len(chunks) - 1 else 0
+                with self.lock:
+                    self.flush_urgent()
+                    send_message(self.sock, msg_type, chunk, flags | more)
+                self.drain()
+
+    def send_urgent(self, msg_type, payload=b'', flags=0):
+        self.urgent.append(pack_message(msg_type, payload, flags))
+        self.drain()
+
+    def flush_urgent(self):
+        # 持有lock时调用
+        while self.urgent:
+            self.sock.sendall(self.urgent.popleft())
+
+    def drain(self):
+        # 入队的线程和释放锁的线程都会再检查一次，紧急消息不会滞留在队列中
+        while self.urgent and self.lock.acquire(blocking=False):
+            try:
+                self.flush_urgent()
+            finally:
+                self.lock.release()
+
+
+class ChunkAssembler:
+    # 接收端: 把带FLAG_MORE的分块拼回完整消息；未分块的消息（包括插在分块之间的输入和心跳）原样返回，不拷贝
+    # 分块按偏移写入每个连接复用的缓冲区，只在容量不够时翻倍扩容；拼好的消息以memoryview切片交出，只在下一次feed之前有效
+    def __init__(self, max_message_size=MAX_MESSAGE_SIZE, capacity=CHUNK_SIZE * 16):
+        self.max_message_size = max_message_size
+        self.msg_type = None  # 正在拼接的消息类型
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._length = 0  # 已拼接的字节数
+
+    def feed(self, msg_type, flags, payload):
+        # 返回 (标志, 完整负载)；消息还不完整时返回None
+        if flags & FLAG_MORE:
+            if self.msg_type not in (None, msg_type):
+                raise ProtocolError(f"分块消息被其他类型的分块打断: {msg_type}")
+            self.msg_type = msg_type
+            self._append(payload)
+            return None
+        if msg_type != self.msg_type:
+            return flags, payload
+        self._append(payload)
+        length = self._length
+        self.msg_type = None
+        self._length = 0
+        return flags, self._view[:length]
+
+    def _append(self, payload):
+        n = len(payload)
+        end = self._length + n
+        if end > self.max_message_size:
+            raise ProtocolError(f"消息长度超出限制: {end}")
+        if end > len(self._buf):
+            # 换用新缓冲区而不是原地扩容，之前交出的切片仍可能被引用
+            new_buf = bytearray(min(max(len(self._buf) * 2, end), self.max_message_size))
+            new_buf[:self._length] = self._view[:self._length]
+            self._buf = new_buf
+            self._view = memoryview(new_buf)
+        self._view[self._length:end] = payload
+        self._length = end
+
+
+def handshake(sock, hello, reader):
+    # 发送HELLO并等待服务器确认，返回协商后的会话参数
+    send_message(sock, MSG_HELLO, json.dumps(hello).encode('utf-8'))
+    while True:
+        if reader.recv_from(sock) == 0:
+            raise ConnectionError("握手期间连接已断开")
+        for msg_type, flags, payload in reader.messages():
+            if msg_type == MSG_HELLO:
+                session = json.loads(bytes(payload))
+                if 'error' in session:
+                    raise ConnectionError(f"服务器拒绝连接: {session['error']}")
+                return session
+
+
+# 预分配缓冲区上的增量消息解析器
+# 数据通过recv_into直接写入缓冲区，完整消息以memoryview切片交出，不产生中间拷贝
+# 注意：交出的切片只在下一次读取之前有效
+class MessageReader:
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, max_message_size=MAX_MESSAGE_SIZE):
+        self.max_message_size = max_message_size
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._read_pos = 0
+        self._write_pos = 0
+        self._needed = HEADER_SIZE  # 凑齐下一条消息所需的总字节数
+
+    def pending(self):
+        return self._write_pos - self._read_pos
+
+    def clear(self):
+        self._read_pos = 0
+        self._write_pos = 0
+        self._needed = HEADER_SIZE
+
+    def get_buffer(self):
+        # 返回可直接写入的空闲区域，写入后调用buffer_updated
+        self._reserve(max(1, self._needed - self.pending()))
+        size = min(len(self._buf) - self._write_pos, RECV_CHUNK)
+        return self._view[self._write_pos:self._write_pos + size]
+
+    def buffer_updated(self, n):
+        self._write_pos += n
+
+    def recv_from(self, sock):
+        n = sock.recv_into(self.get_buffer())
+        self.buffer_updated(n)
+        return n
+
+    def feed(self, data):
+        n = len(data)
+        self._reserve(n)
+        self._view[self._write_pos:self._write_pos + n] = data
+        self._write_pos += n
+
+    def messages(self):
+        # 逐条取出完整消息: (类型, 标志, 负载memoryview)
+        while True:
+            available = self._write_pos - self._read_pos
+            if available < HEADER_SIZE:
+                return
+            version, msg_type, flags, length = HEADER.unpack_from(self._buf, self._read_pos)
+            if version != PROTOCOL_VERSION:
+                raise ProtocolError(f"不支持的协议版本: {version}")
+            if length > self.max_message_size:
+                raise ProtocolError(f"消息长度超出限制: {length}")
+            if available < HEADER_SIZE + length:
+                # 消息不完整，记录所需长度，下次读取前为整条消息预留空间
+                self._needed = HEADER_SIZE + length
+                return
+            self._needed = HEADER_SIZE
+            start = self._read_pos + HEADER_SIZE
+            self._read_pos = start + length
+            if self._read_pos == self._write_pos:
+                # 缓冲区已读空，下次从头写入
+                self._read_pos = self._write_pos = 0
+            yield msg_type, flags, self._view[start:start + length]
+
+    def _reserve(self, n):
+        # 保证写指针之后至少有n字节可用空间
+        if len(self._buf) - self._write_pos >= n:
+            return
+        pending = self._write_pos - self._read_pos
+        if pending + n <= len(self._buf):
+            # 只移动未解析的尾部数据（至多一条不完整消息）
+            self._view[:pending] = self._view[self._read_pos:self._write_pos]
+        else:
+            # 单条消息超过当前容量，换用更大的缓冲区
+            capacity = max(len(self._buf) * 2, pending + n)
+            new_buf = bytearray(capacity)
+            new_buf[:pending] = self._view[self._read_pos:self._write_pos]
+            self._buf = new_buf
+            self._view = memoryview(new_buf)
+        self._read_pos = 0
+        self._write_pos = pending
@@ -0,0 +1,374 @@
+import os
+import sys
+import mmap
+import time
+import queue
+import bisect
+import struct
+import logging
+import argparse
+import threading
+import numpy as np
+from codec import RawCodec, get_codec
+from metrics import REGISTRY
+from log_config import setup_logging
+from scroll import apply_copy
+from pixel_format import BYTES_PER_PIXEL
+from protocol import MSG_FRAME, MSG_INPUT, MSG_COMMAND, FLAG_KEYFRAME
+from tiles import apply_frame, encode_rects, parse_frame_header, parse_frame_timing
+
+logger = logging.getLogger(__name__)
+
+# 会话录制文件（只追加）:
+#   文件头 | 记录 ... | 索引记录 | 尾部
+# 记录负载与网络消息负载相同（帧为tiles帧格式，输入为二进制事件或JSON命令），可直接重放
+# 每隔keyframe_interval秒写入一个由帧缓冲重新编码的关键帧，索引记录关键帧的时间和偏移
+# 进程异常退出时没有索引和尾部，播放时顺序扫描重建
+MAGIC = b'RDREC\x00\x00\x01'
+INDEX_MAGIC = b'RDINDEX1'
+FILE_HEADER = struct.Struct('!8sd')  # 魔数 开始时刻（Unix时间）
+RECORD_HEADER = struct.Struct('!BBxxdI')  # 类型 标志 相对开始的时间（秒） 负载长度
+INDEX_ENTRY = struct.Struct('!dQ')  # 关键帧时间 记录偏移
+TRAILER = struct.Struct('!Q8s')  # 索引记录偏移 魔数
+
+REC_FRAME = MSG_FRAME
+REC_INPUT = MSG_INPUT
+REC_COMMAND = MSG_COMMAND
+REC_INDEX = ord('X')
+REC_SNAPSHOT = ord('S')  # 只在录制队列中使用: 帧缓冲副本，写入时编码为关键帧
+REC_RECTS = ord('U')  # 只在录制队列中使用: 变化区域的像素副本（共享内存传输），写入时按原始格式编码
+
+KEYFRAME_INTERVAL = 5.0
+KEYFRAME_CODEC = 'zlib'  # 重新编码的关键帧无损，与来源端编解码器无关
+STOP_POLL = 0.5  # 录制线程检查停止标志的间隔（秒）
+
+
+class RecordingWriter:
+    def __init__(self, path, start_time=None):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.start_time = start_time or time.time()
+        self.file.write(FILE_HEADER.pack(MAGIC, self.start_time))
+        self.offset = FILE_HEADER.size
+        self.index = []  # (时间, 偏移)
+
+    def write(self, rec_type, timestamp, payload, flags=0):
+        if rec_type == REC_FRAME and flags & FLAG_KEYFRAME:
+            self.index.append((timestamp, self.offset))
+        self.file.write(RECORD_HEADER.pack(rec_type, flags, timestamp, len(payload)))
+        self.file.write(payload)
+        self.offset += RECORD_HEADER.size + len(payload)
+
+    def close(self):
+        index_offset = self.offset
+        self.write(REC_INDEX, 0.0, b''.join(INDEX_ENTRY.pack(*entry) for entry in self.index))
+        self.file.write(TRAILER.pack(index_offset, INDEX_MAGIC))
+        self.file.close()
+
+
+class SessionRecorder:
+    # 录制在独立线程中进行: 网络线程只拷贝负载并入队，解码、重新编码关键帧和写盘都不在关键路径上
+    # 队列满时丢弃；丢了增量帧后下一次改为入队帧缓冲副本，保证录制内容仍然可解码
+    def __init__(self, path, keyframe_interval=KEYFRAME_INTERVAL, max_queue=256):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.queue = queue.Queue(max_queue)
+        self.resync = False
+        self.stopped = False
+        self.start_time = time.monotonic()
+        self.writer = None
+        self.thread = None
+        self.framebuffer = None
+        self.last_keyframe = None
+        self.codec = get_codec(KEYFRAME_CODEC)
+        self.raw_codec = RawCodec()
+        self.bytes_metric = REGISTRY.counter('recording_bytes_total', "写入录制文件的字节数")
+        self.dropped_metric = REGISTRY.counter('recording_dropped_total', "录制队列满时丢弃的记录数")
+        REGISTRY.gauge('recording_queue_depth', "录制队列长度", func=self.queue.qsize)
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.writer = RecordingWriter(self.path)
+        self.thread = threading.Thread(target=self.run, name="SessionRecorder")
+        self.thread.start()
+        logger.info(f"开始录制会话: {self.path}")
+
+    def stop(self):
+        # 在网络线程中调用，不能阻塞: 队列满时唤醒信号放不进去，录制线程靠stopped标志在队列取空后退出
+        # 不等待写完，剩余记录由录制线程写完后关闭文件
+        self.stopped = True
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def timestamp(self):
+        return time.monotonic() - self.start_time
+
+    def record_frame(self, framebuffer, payload, flags):
+        # 在网络线程中调用；payload只在本次回调内有效，必须拷贝
+        if not self.snapshot(framebuffer) and not self.put((REC_FRAME, self.timestamp(), bytes(payload), flags)):
+            self.resync = True
+
+    def record_rects(self, framebuffer, pixel_format, copies, rects, seq, latency_us, flags):
+        # 共享内存传输没有可录制的负载: 网络线程只拷贝变化区域的像素，编码在录制线程中进行
+        if self.snapshot(framebuffer):
+            return
+        height, width = framebuffer.shape[:2]
+        blocks = [framebuffer[y:y + h, x:x + w].copy() for x, y, w, h in rects]
+        frame = ((width, height, pixel_format), copies, rects, blocks, seq, latency_us)
+        if not self.put((REC_RECTS, self.timestamp(), frame, flags)):
+            self.resync = True
+
+    def snapshot(self, framebuffer):
+        # 丢过记录后用帧缓冲副本代替本帧，返回True表示本帧不再单独入队
+        if not self.resync:
+            return False
+        if self.put((REC_SNAPSHOT, self.timestamp(), framebuffer.copy(), FLAG_KEYFRAME)):
+            self.resync = False
+        return True
+
+    def record_input(self, rec_type, payload):
+        self.put((rec_type, self.timestamp(), bytes(payload), 0))
+
+    def put(self, item):
+        if self.stopped:
+            return False
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.dropped_metric.inc()
+            return False
+
+    def run(self):
+        try:
+            while True:
+                try:
+                    item = self.queue.get(timeout=STOP_POLL)
+                except queue.Empty:
+                    if self.stopped:
+                        break
+                    continue
+                if item is None:
+                    break
+                try:
+                    self.write(*item)
+                except Exception as e:
+                    logger.error(f"录制写入错误: {str(e)}")
+        finally:
+            self.writer.close()
+            logger.info(f"录制已结束: {self.path} ({self.writer.offset} 字节)")
+
+    def write(self, rec_type, timestamp, data, flags):
+        start = self.writer.offset
+        if rec_type == REC_SNAPSHOT:
+            self.framebuffer = data
+            self.write_keyframe(timestamp, 0)
+        elif rec_type == REC_FRAME:
+            if not self.prepare(*parse_frame_header(data), flags):
+                return
+            apply_frame(self.framebuffer, data)
+            if self.keyframe_due(timestamp, flags):
+                self.write_keyframe(timestamp, parse_frame_timing(data)[0])
+            else:
+                self.write_frame(timestamp, data, flags)
+        elif rec_type == REC_RECTS:
+            frame_format, copies, rects, blocks, seq, latency_us = data
+            if not self.prepare(*frame_format, flags):
+                return
+            for copy in copies:
+                apply_copy(self.framebuffer, copy)
+            for (x, y, w, h), block in zip(rects, blocks):
+                self.framebuffer[y:y + h, x:x + w] = block
+            if self.keyframe_due(timestamp, flags):
+                self.write_keyframe(timestamp, seq)
+            else:
+                parts = encode_rects(self.framebuffer, rects, self.raw_codec, 0, seq=seq, latency_us=latency_us,
+                                     copies=copies)
+                self.write_frame(timestamp, b''.join(parts), flags)
+        else:
+            self.writer.write(rec_type, timestamp, data)
+        self.bytes_metric.inc(self.writer.offset - start)
+
+    def prepare(self, width, height, pixel_format, flags):
+        # 画面尺寸或像素格式变化后须从关键帧开始，之前的增量帧无法解码
+        shape = (height, width, BYTES_PER_PIXEL[pixel_format])
+        if self.framebuffer is None or self.framebuffer.shape != shape:
+            if not flags & FLAG_KEYFRAME:
+                return False
+            self.framebuffer = np.zeros(shape, dtype=np.uint8)
+        return True
+
+    def keyframe_due(self, timestamp, flags):
+        # 定期用当前画面的关键帧代替增量帧，播放时可从最近的关键帧开始
+        return not flags & FLAG_KEYFRAME and timestamp - self.last_keyframe >= self.keyframe_interval
+
+    def write_frame(self, timestamp, data, flags):
+        self.writer.write(REC_FRAME, timestamp, data, flags)
+        if flags & FLAG_KEYFRAME:
+            self.last_keyframe = timestamp
+
+    def write_keyframe(self, timestamp, seq):
+        height, width = self.framebuffer.shape[:2]
+        parts = encode_rects(self.framebuffer, [(0, 0, width, height)], self.codec, 0, seq=seq)
+        self.writer.write(REC_FRAME, timestamp, b''.join(parts), FLAG_KEYFRAME)
+        self.last_keyframe = timestamp
+
+
+class RecordingPlayer:
+    # 以mmap打开录制文件，按索引定位到目标时刻之前最近的关键帧，只解码其后的少量增量帧
+    # 记录负载是mmap上的memoryview切片，close()之前须释放
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.start_time = FILE_HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"不是会话录制文件: {path}")
+        self.index = self.read_index()
+        if self.index is None:
+            logger.warning(f"录制文件没有索引（可能未正常结束），扫描重建: {path}")
+            self.index = [(timestamp, offset) for offset, rec_type, flags, timestamp, _ in self.records()
+                          if rec_type == REC_FRAME and flags & FLAG_KEYFRAME]
+        self.index_times = [timestamp for timestamp, _ in self.index]
+
+    def close(self):
+        try:
+            self.data.close()
+        except BufferError:
+            pass  # 调用方仍持有记录负载的切片，mmap在切片释放后由垃圾回收关闭
+        self.file.close()
+
+    def read_index(self):
+        if len(self.data) < FILE_HEADER.size + TRAILER.size:
+            return None
+        index_offset, magic = TRAILER.unpack_from(self.data, len(self.data) - TRAILER.size)
+        if magic != INDEX_MAGIC:
+            return None
+        length = RECORD_HEADER.unpack_from(self.data, index_offset)[3]
+        start = index_offset + RECORD_HEADER.size
+        return [INDEX_ENTRY.unpack_from(self.data, offset)
+                for offset in range(start, start + length, INDEX_ENTRY.size)]
+
+    def records(self, offset=FILE_HEADER.size):
+        # 逐条返回 (偏移, 类型, 标志, 时间, 负载)，到索引记录或不完整的末尾为止
+        view = memoryview(self.data)
+        size = len(self.data)
+        while offset + RECORD_HEADER.size <= size:
+            rec_type, flags, timestamp, length = RECORD_HEADER.unpack_from(self.data, offset)
+            start = offset + RECORD_HEADER.size
+            if rec_type == REC_INDEX or start + length > size:
+                return
+            yield offset, rec_type, flags, timestamp, view[start:start + length]
+            offset = start + length
+
+    @property
+    def duration(self):
+        last = 0.0
+        for _, _, _, timestamp, _ in self.records(self.index[-1][1] if self.index else FILE_HEADER.size):
+            last = timestamp
+        return last
+
+    def seek(self, timestamp):
+        # 返回目标时刻的画面 (帧缓冲, 之后第一条记录的偏移)；目标时刻之前没有画面时帧缓冲为None
+        position = bisect.bisect_right(self.index_times, timestamp) - 1
+        if position < 0:
+            return None, self.index[0][1] if self.index else FILE_HEADER.size
+        framebuffer = None
+        for offset, rec_type, flags, record_time, payload in self.records(self.index[position][1]):
+            if record_time > timestamp:
+                return framebuffer, offset
+            if rec_type == REC_FRAME:
+                framebuffer = self.apply(framebuffer, payload, flags)
+        return framebuffer, len(self.data)
+
+    def apply(self, framebuffer, payload, flags):
+        width, height, pixel_format = parse_frame_header(payload)
+        shape = (height, width, BYTES_PER_PIXEL[pixel_format])
+        if framebuffer is None or framebuffer.shape != shape:
+            if not flags & FLAG_KEYFRAME:
+                return framebuffer
+            framebuffer = np.zeros(shape, dtype=np.uint8)
+        apply_frame(framebuffer, payload)
+        return framebuffer
+
+    def frames(self, start=0.0, end=None):
+        # 从start开始按顺序返回 (时间, 帧缓冲)；帧缓冲原地更新，需要保留时自行拷贝
+        framebuffer, offset = self.seek(start)
+        if framebuffer is not None:
+            yield start, framebuffer
+        for _, rec_type, flags, timestamp, payload in self.records(offset):
+            if end is not None and timestamp > end:
+                return
+            if rec_type == REC_FRAME:
+                framebuffer = self.apply(framebuffer, payload, flags)
+                if framebuffer is not None:
+                    yield timestamp, framebuffer
+
+    def export(self, path, start=0.0, end=None):
+        # 导出时间段为新的录制文件: 开头写入start时刻画面的关键帧，其后的记录原样拷贝，时间从0开始
+        framebuffer, offset = self.seek(start)
+        writer = RecordingWriter(path, self.start_time + start)
+        try:
+            if framebuffer is not None:
+                height, width = framebuffer.shape[:2]
+                parts = encode_rects(framebuffer, [(0, 0, width, height)], get_codec(KEYFRAME_CODEC), 0)
+                writer.write(REC_FRAME, 0.0, b''.join(parts), FLAG_KEYFRAME)
+            for _, rec_type, flags, timestamp, payload in self.records(offset):
+                if end is not None and timestamp > end:
+                    break
+                writer.write(rec_type, timestamp - start, payload, flags)
+        finally:
+            writer.close()
+        return writer.offset
+
+
+def save_image(framebuffer, path):
+    from PIL import Image
+    from pixel_format import PIXEL_RGB24, convert
+    Image.fromarray(convert(framebuffer, PIXEL_RGB24)).save(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="会话录制文件: 查看信息、导出截图或时间段")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    info = subparsers.add_parser('info', help="录制时长、记录数和关键帧数")
+    info.add_argument('path')
+    snapshot = subparsers.add_parser('snapshot', help="导出某一时刻的画面")
+    snapshot.add_argument('path')
+    snapshot.add_argument('--at', type=float, required=True, help="相对录制开始的秒数")
+    snapshot.add_argument('--output', required=True, help="图片文件，如 frame.png")
+    export = subparsers.add_parser('export', help="导出时间段为新的录制文件")
+    export.add_argument('path')
+    export.add_argument('output')
+    export.add_argument('--start', type=float, default=0.0)
+    export.add_argument('--end', type=float)
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    player = RecordingPlayer(args.path)
+    try:
+        if args.command == 'info':
+            counts = {}
+            for _, rec_type, _, _, _ in player.records():
+                counts[chr(rec_type)] = counts.get(chr(rec_type), 0) + 1
+            started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(player.start_time))
+            print(f"开始时间: {started}")
+            print(f"时长: {player.duration:.1f} 秒")
+            print(f"帧: {counts.get(chr(REC_FRAME), 0)}, 关键帧: {len(player.index)}, "
+                  f"输入: {counts.get(chr(REC_INPUT), 0) + counts.get(chr(REC_COMMAND), 0)}")
+        elif args.command == 'snapshot':
+            framebuffer, _ = player.seek(args.at)
+            if framebuffer is None:
+                print("该时刻之前没有画面")
+                return 1
+            save_image(framebuffer, args.output)
+        else:
+            size = player.export(args.output, args.start, args.end)
+            print(f"已导出 {args.output} ({size} 字节)")
+    finally:
+        player.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
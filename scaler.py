@@ -0,0 +1,191 @@
+import time
+import logging
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# 缩放预设，由快到慢、由低到高质量排列
+# fast: 长宽都正好缩小一半时做精确的2x2面积平均；其他比例在每个输出像素的覆盖范围内取2x2个采样点求平均，
+# 只按输出尺寸计算。缩小3倍以上时大部分源像素不参与计算，细线和小字会有混叠（移动时闪烁），对画质敏感时用balanced
+PRESET_FAST = 'fast'
+PRESET_BALANCED = 'balanced'  # Pillow reduce()整数倍缩小 + BILINEAR
+PRESET_QUALITY = 'quality'  # LANCZOS，只适合静止画面或小分辨率
+PRESETS = (PRESET_FAST, PRESET_BALANCED, PRESET_QUALITY)
+PRESET_AUTO = 'auto'
+STILL_FRAMES = 3  # 连续多少帧不变视为静止画面
+
+# 4字节像素打包成uint32后按字节求平均（向下取整），各通道互不进位
+BYTE_LSB_MASK = 0xFEFEFEFE
+
+
+def average(a, b):
+    # 结果写入a并返回（a须是可写的临时数组）
+    diff = a ^ b
+    a &= b
+    diff &= BYTE_LSB_MASK
+    diff >>= 1
+    a += diff
+    return a
+
+
+def sample_points(source, target):
+    # 每个输出像素在源图中覆盖范围的1/4和3/4处的坐标（2:1时即相邻两个像素）
+    index = np.arange(target) * 4
+    return (index + 1) * source // (4 * target), (index + 3) * source // (4 * target)
+
+
+def select(packed, index, axis):
+    # 按坐标取出行（axis=0）或列；整数倍缩小时坐标等间距，用切片（比take快数倍）
+    step = index[1] - index[0] if len(index) > 1 else 1
+    if step > 0 and (np.diff(index) == step).all():
+        part = slice(index[0], index[-1] + 1, step)
+        return packed[part] if axis == 0 else packed[:, part]
+    return packed.take(index, axis=axis)
+
+
+def pick(packed, rows, cols):
+    # 取出采样点并拷贝成连续数组（跨步视图上的逐元素运算慢得多，且结果会被average改写）
+    part = select(select(packed, rows, 0), cols, 1)
+    return part.copy() if np.may_share_memory(part, packed) else part
+
+
+def halve(packed, axis):
+    # 相邻两行（axis=0）或两列求平均，2:1时即精确的面积平均
+    if axis == 0:
+        return average(packed[0::2].copy(), packed[1::2])
+    return average(packed[:, 0::2].copy(), packed[:, 1::2])
+
+
+def to_image(pixels):
+    height, width, channels = pixels.shape
+    if channels == 4:
+        return Image.frombuffer('RGBX', (width, height), pixels, 'raw', 'RGBX', 0, 1)
+    return Image.frombuffer('RGB', (width, height), pixels, 'raw', 'RGB', 0, 1)
+
+
+def resize(pixels, size, resample):
+    height, width = pixels.shape[:2]
+    if (width, height) == tuple(size):
+        return pixels
+    return np.asarray(to_image(pixels).resize(size, resample))
+
+
+def scale_fast(pixels, size):
+    # bgrx32: 打包成uint32后按字节求平均
+    # 2:1时先两两合并行、再合并列；其他比例只取出采样点，读写量只与输出尺寸有关
+    # （大倍数缩小时读遍整幅源图的面积平均比Pillow的reduce还慢）
+    height, width, channels = pixels.shape
+    if channels != 4:
+        return scale_balanced(pixels, size)
+    packed = np.ascontiguousarray(pixels).view(np.uint32).reshape(height, width)
+    if (width, height) == (size[0] * 2, size[1] * 2):
+        return halve(halve(packed, 0), 1).view(np.uint8).reshape(size[1], size[0], 4)
+    rows = sample_points(height, size[1])
+    cols = sample_points(width, size[0])
+    first = average(pick(packed, rows[0], cols[0]), pick(packed, rows[1], cols[1]))
+    second = average(pick(packed, rows[0], cols[1]), pick(packed, rows[1], cols[0]))
+    return average(first, second).view(np.uint8).reshape(size[1], size[0], 4)
+
+
+def scale_balanced(pixels, size):
+    height, width = pixels.shape[:2]
+    factor = (max(1, width // size[0]), max(1, height // size[1]))
+    img = to_image(pixels)
+    if factor != (1, 1):
+        img = img.reduce(factor)
+    if img.size != tuple(size):
+        img = img.resize(size, Image.Resampling.BILINEAR)
+    return np.asarray(img)
+
+
+def scale_quality(pixels, size):
+    return resize(pixels, size, Image.Resampling.LANCZOS)
+
+
+SCALERS = {
+    PRESET_FAST: scale_fast,
+    PRESET_BALANCED: scale_balanced,
+    PRESET_QUALITY: scale_quality,
+}
+
+
+def scale(pixels, size, preset=PRESET_BALANCED):
+    height, width = pixels.shape[:2]
+    if (width, height) == tuple(size):
+        return pixels
+    return SCALERS[preset](pixels, tuple(size))
+
+
+class AutoScaler:
+    # 按每帧的时间预算自动选择预设: 运动画面选耗时在预算内的最高质量预设，
+    # 画面静止若干帧后用LANCZOS输出一次并复用结果，直到画面再次变化
+    # 每个预设的耗时用指数平均估计；每隔probe_interval秒让略超预算的更高一级重测一次
+    def __init__(self, preset=PRESET_AUTO, still_frames=STILL_FRAMES, probe_interval=10):
+        self.preset = preset
+        self.still_frames = still_frames
+        self.probe_interval = probe_interval
+        self.cost = {}  # 预设 -> 平均耗时（秒）
+        self.last_probe = time.monotonic()
+        self.last_frame = None  # 抓取每次返回新数组，保留引用即可，不需要拷贝
+        self.still_count = 0
+        self.still_output = None  # (尺寸, 结果)
+        self.current = None
+
+    def is_still(self, pixels, unchanged=None):
+        # 必须逐字节比较: 复用的LANCZOS结果不能漏掉任何变化（如打字时的几个字符）
+        # 调用方已比较过时（CaptureHub）直接传入unchanged，不再重复比较
+        if unchanged is None:
+            unchanged = self.last_frame is not None and self.last_frame.shape == pixels.shape \
+                and np.array_equal(self.last_frame, pixels)
+            self.last_frame = pixels
+        self.still_count = self.still_count + 1 if unchanged else 0
+        return self.still_count >= self.still_frames
+
+    def choose(self, budget):
+        if self.preset != PRESET_AUTO:
+            return self.preset
+        for preset in (PRESET_FAST, PRESET_BALANCED):
+            if preset not in self.cost:
+                return preset  # 先测出两个快速预设的耗时
+
+        now = time.monotonic()
+        if self.current in PRESETS[:-1] and now - self.last_probe >= self.probe_interval:
+            self.last_probe = now
+            higher = PRESETS[PRESETS.index(self.current) + 1]
+            cost = self.cost.get(higher)
+            if cost is None or budget < cost <= 2 * budget:
+                return higher
+
+        for preset in reversed(PRESETS):
+            if self.cost.get(preset, budget + 1) <= budget:
+                return preset
+        return min(self.cost, key=self.cost.get)
+
+    def scale(self, pixels, size, budget, unchanged=None):
+        size = tuple(size)
+        height, width = pixels.shape[:2]
+        if (width, height) == size:
+            return pixels
+
+        if self.preset == PRESET_AUTO and self.is_still(pixels, unchanged):
+            if self.still_output is not None and self.still_output[0] == size:
+                return self.still_output[1]
+            preset = PRESET_QUALITY
+        else:
+            self.still_output = None
+            preset = self.choose(budget)
+
+        start = time.perf_counter()
+        result = SCALERS[preset](pixels, size)
+        elapsed = time.perf_counter() - start
+        previous = self.cost.get(preset)
+        self.cost[preset] = elapsed if previous is None else previous * 0.8 + elapsed * 0.2
+
+        if preset == PRESET_QUALITY and self.still_count >= self.still_frames:
+            self.still_output = (size, result)
+        elif preset != self.current:
+            logger.info(f"缩放方式切换: {self.current} -> {preset} ({width}x{height} -> {size[0]}x{size[1]}, "
+                        f"耗时 {elapsed * 1000:.1f}ms, 预算 {budget * 1000:.1f}ms)")
+            self.current = preset
+        return result
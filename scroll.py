@@ -0,0 +1,94 @@
+import numpy as np
+
+# 滚动和窗口拖动检测: 对变化区域内的每一行（列）求哈希，与上一帧比较找出整体平移量
+# 接收端按复制指令在帧缓冲内移动像素，编码端只需发送新露出的部分
+MIN_SHIFT_LINES = 16  # 平移部分至少的行（列）数，太小不值得用复制指令
+MIN_MATCH_RATIO = 0.25  # 按同一平移量匹配上的行数占变化区域的最小比例
+LINE_SAMPLES = 256  # 每行只取这么多个像素求哈希，只用来估计平移量，最终结果逐像素确认
+
+_weights = {}  # 行长度 -> 哈希系数
+
+
+def pixel_values(block):
+    # (行, 宽, 通道) -> (行, 宽) 每个像素合成一个uint32，不拷贝4通道数据
+    if block.shape[2] == 4:
+        return block.view(np.uint32)[..., 0]
+    values = block[..., 0].astype(np.uint32)
+    values |= block[..., 1].astype(np.uint32) << 8
+    values |= block[..., 2].astype(np.uint32) << 16
+    return values
+
+
+def line_hashes(values):
+    # 每行一个64位哈希: 像素值与固定随机奇数系数的加权和（按2**64取模）
+    length = values.shape[1]
+    weights = _weights.get(length)
+    if weights is None:
+        rng = np.random.default_rng(length)
+        weights = _weights[length] = rng.integers(1, 2 ** 63, length, dtype=np.uint64) | np.uint64(1)
+    return (values * weights).sum(axis=1)
+
+
+def dominant_shift(old_hash, new_hash):
+    # 只用各自只出现一次的行（空白行等重复内容无法确定位置），统计最多的平移量
+    old_unique, old_index, old_counts = np.unique(old_hash, return_index=True, return_counts=True)
+    new_unique, new_index, new_counts = np.unique(new_hash, return_index=True, return_counts=True)
+    old_once = old_counts == 1
+    new_once = new_counts == 1
+    _, oi, ni = np.intersect1d(old_unique[old_once], new_unique[new_once],
+                               assume_unique=True, return_indices=True)
+    shifts = new_index[new_once][ni] - old_index[old_once][oi]
+    shifts = shifts[shifts != 0]
+    if len(shifts) < MIN_SHIFT_LINES:
+        return None
+    values, counts = np.unique(shifts, return_counts=True)
+    best = counts.argmax()
+    if counts[best] < max(MIN_SHIFT_LINES, MIN_MATCH_RATIO * len(new_hash)):
+        return None
+    return int(values[best])
+
+
+def longest_run(matches):
+    # 最长的连续True区间 [起, 止)
+    padded = np.concatenate(([0], matches.view(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(padded))
+    if not len(edges):
+        return 0, 0
+    starts, ends = edges[0::2], edges[1::2]
+    best = (ends - starts).argmax()
+    return int(starts[best]), int(ends[best])
+
+
+def find_copy(previous, frame, box, axis):
+    # box: 变化区域 (x0, y0, x1, y1)；axis=0检测竖直平移（行哈希），axis=1检测水平平移（列哈希）
+    # 返回复制指令 (源x, 源y, 宽, 高, 目标x, 目标y)，没有可用的平移时返回None
+    x0, y0, x1, y1 = box
+    old = pixel_values(previous[y0:y1, x0:x1])
+    new = pixel_values(frame[y0:y1, x0:x1])
+    if axis == 1:
+        old, new = old.T, new.T
+    lines = new.shape[0]
+    if lines < 2 * MIN_SHIFT_LINES:
+        return None
+    step = max(1, new.shape[1] // LINE_SAMPLES)
+    shift = dominant_shift(line_hashes(old[:, ::step]), line_hashes(new[:, ::step]))
+    if shift is None:
+        return None
+
+    # 新的第i行对应旧的第i-shift行，逐像素比较，取平移后连续相同的最长一段
+    # （复制错误会一直留在接收端画面上，不能只看哈希）
+    lo, hi = max(0, shift), min(lines, lines + shift)
+    start, end = longest_run((new[lo:hi] == old[lo - shift:hi - shift]).all(axis=1))
+    start += lo
+    end += lo
+    if end - start < MIN_SHIFT_LINES:
+        return None
+    if axis == 0:
+        return x0, y0 + start - shift, x1 - x0, end - start, x0, y0 + start
+    return x0 + start - shift, y0, end - start, y1 - y0, x0 + start, y0
+
+
+def apply_copy(framebuffer, copy):
+    # 源和目标区域重叠时NumPy会先拷贝源数据，结果与memmove一致
+    sx, sy, w, h, dx, dy = copy
+    framebuffer[dy:dy + h, dx:dx + w] = framebuffer[sy:sy + h, sx:sx + w]
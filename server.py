@@ -1,253 +1,110 @@
 import sys
-import socket
-import json
-import logging
-import threading
 import time
-import pyautogui
-from PyQt6.QtWidgets import QApplication, QMainWindow, QLabel, QVBoxLayout, QWidget
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QTimer
-from PyQt6.QtGui import QImage, QPixmap
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('server.log'),
-        logging.StreamHandler()
-    ]
-)
+import logging
+import asyncio
+from PyQt6.QtWidgets import QApplication, QMainWindow, QLabel, QVBoxLayout, QWidget, QCheckBox
+from PyQt6.QtCore import Qt, QThread, QTimer, pyqtSignal
+from server_core import RemoteDesktopServer
+from injector import InputInjector, PyAutoGUIBackend
+from display import FrameView
+from metrics import REGISTRY, SIZE_BUCKETS, MetricsServer
+from log_config import setup_logging
+
+# 配置日志（后台线程写入，文件按大小轮转）
+setup_logging('server.log')
 logger = logging.getLogger(__name__)
 
+RECORD_DIR = 'recordings'
+
 class ServerThread(QThread):
     status_signal = pyqtSignal(str)
-    frame_ready = pyqtSignal(QImage)
     client_connected = pyqtSignal(str)
     client_disconnected = pyqtSignal()
 
-    def __init__(self):
+    # 画面直接交给frame_sink（FrameView.submit），不经过信号队列
+    def __init__(self, frame_sink):
         super().__init__()
-        self.running = True
-        self.server_socket = None
-        self.client_socket = None
-        self.client_address = None
-        self.last_heartbeat = 0
-        self.heartbeat_timeout = 5
-        self.heartbeat_check_timer = None
-        self.buffer = bytearray()  # 添加缓冲区
-        self.frame_interval = 1/30  # 30 FPS
-        self.last_frame_time = 0
-        self.sleep_time = 0.01  # 添加睡眠时间，减少CPU使用
+        # 输入注入在独立线程执行，不阻塞画面接收
+        self.injector = InputInjector(PyAutoGUIBackend())
+        # 网络处理由asyncio服务器完成，本线程只负责运行事件循环并把结果转发给界面
+        self.server = RemoteDesktopServer(
+            '0.0.0.0', 5000,
+            on_frame=frame_sink,
+            on_command=self.injector.submit,
+            on_status=self.status_signal.emit,
+            on_connected=self.client_connected.emit,
+            on_disconnected=self.client_disconnected.emit)
 
     def run(self):
+        self.injector.start()
         try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind(('0.0.0.0', 5000))
-            self.server_socket.listen(1)
-            self.status_signal.emit("服务器启动，等待连接...")
-            logger.info("服务器启动，等待连接...")
-
-            while self.running:
-                try:
-                    if not self.client_socket:
-                        self.server_socket.settimeout(0.1)  # 设置较短的超时时间
-                        try:
-                            self.client_socket, self.client_address = self.server_socket.accept()
-                            self.client_socket.settimeout(0.1)  # 设置较短的超时时间
-                            self.last_heartbeat = time.time()
-                            self.client_connected.emit(f"{self.client_address[0]}:{self.client_address[1]}")
-                            logger.info(f"客户端已连接: {self.client_address}")
-                            self.start_heartbeat_check()
-                            self.buffer.clear()  # 清空缓冲区
-                        except socket.timeout:
-                            time.sleep(0.01)  # 添加短暂延迟
-                            continue
-
-                    # 接收数据
-                    try:
-                        data = self.client_socket.recv(4096)
-                        if not data:
-                            raise ConnectionError("连接已断开")
-
-                        self.buffer.extend(data)
-                        self.process_buffer()
-
-                    except socket.timeout:
-                        time.sleep(0.01)  # 添加短暂延迟
-                        continue
-                    except Exception as e:
-                        raise
-
-                except Exception as e:
-                    error_msg = f"客户端连接错误: {str(e)}"
-                    logger.error(error_msg)
-                    self.handle_client_error()
-                    time.sleep(0.1)  # 错误后等待较长时间
-
+            asyncio.run(self.server.serve())
         except Exception as e:
             error_msg = f"服务器错误: {str(e)}"
             logger.error(error_msg)
             self.status_signal.emit(error_msg)
-        finally:
-            self.stop()
-
-    def process_buffer(self):
-        while len(self.buffer) > 0:
-            try:
-                # 获取命令类型
-                command_type = self.buffer[0]
-                self.buffer = self.buffer[1:]
-
-                if command_type == ord('C'):  # Command
-                    self.process_command()
-                elif command_type == ord('F'):  # Frame
-                    self.process_frame()
-                elif command_type == ord('P'):  # Heartbeat
-                    self.handle_heartbeat()
-                else:
-                    logger.warning(f"未知的命令类型: {command_type}")
-                    self.buffer.clear()  # 清空缓冲区
-                    break
-
-            except Exception as e:
-                logger.error(f"处理缓冲区数据错误: {str(e)}")
-                self.buffer.clear()
-                break
-
-            time.sleep(0.001)  # 添加短暂延迟，避免CPU占用过高
 
-    def process_command(self):
-        try:
-            # 查找JSON数据的结束位置
-            try:
-                data_str = self.buffer.decode('utf-8')
-                json_end = data_str.find('}') + 1
-                if json_end <= 0:
-                    return  # 数据不完整，等待更多数据
-
-                # 提取并解析JSON数据
-                json_data = data_str[:json_end]
-                command = json.loads(json_data)
-                
-                # 移除已处理的数据
-                self.buffer = self.buffer[json_end:]
-                
-                # 执行命令
-                self.execute_command(command)
-                
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON解析错误: {str(e)}")
-                self.buffer.clear()
-                raise
-            except UnicodeDecodeError as e:
-                logger.error(f"UTF-8解码错误: {str(e)}")
-                self.buffer.clear()
-                raise
-
-        except Exception as e:
-            logger.error(f"处理命令错误: {str(e)}")
-            raise
-
-    def process_frame(self):
-        try:
-            current_time = time.time()
-            if current_time - self.last_frame_time < self.frame_interval:
-                return  # 控制帧率
-
-            if len(self.buffer) < 4:
-                return  # 数据不完整，等待更多数据
-
-            # 获取帧大小
-            frame_size = int.from_bytes(self.buffer[:4], 'big')
-            self.buffer = self.buffer[4:]
-
-            # 检查是否有足够的数据
-            if len(self.buffer) < frame_size:
-                return  # 数据不完整，等待更多数据
-
-            # 提取帧数据
-            frame_data = self.buffer[:frame_size]
-            self.buffer = self.buffer[frame_size:]
-
-            # 创建QImage
-            qimg = QImage(frame_data, 800, 600, 800 * 3, QImage.Format.Format_RGB888)
-            self.frame_ready.emit(qimg)
-            self.last_frame_time = current_time
-
-        except Exception as e:
-            logger.error(f"处理帧错误: {str(e)}")
-            self.buffer.clear()
-            raise
-
-    def handle_heartbeat(self):
-        self.last_heartbeat = time.time()
-        try:
-            self.client_socket.send(b'P')
-        except:
-            pass
-
-    def handle_client_error(self):
-        if self.client_socket:
-            try:
-                self.client_socket.close()
-            except:
-                pass
-            self.client_socket = None
-            self.client_address = None
-            self.client_disconnected.emit()
-            self.status_signal.emit("客户端断开连接")
-            self.buffer.clear()  # 清空缓冲区
-            logger.info("客户端断开连接")
-
-    def execute_command(self, command):
-        try:
-            if command['type'] == 'mouse_click':
-                pyautogui.click(x=command['x'], y=command['y'])
-                logger.debug(f"执行鼠标点击: x={command['x']}, y={command['y']}")
-            elif command['type'] == 'mouse_move':
-                pyautogui.moveTo(x=command['x'], y=command['y'])
-                logger.debug(f"执行鼠标移动: x={command['x']}, y={command['y']}")
-            elif command['type'] == 'key_press':
-                pyautogui.press(command['key'])
-                logger.debug(f"执行按键按下: {command['key']}")
-            elif command['type'] == 'key_release':
-                pyautogui.keyUp(command['key'])
-                logger.debug(f"执行按键释放: {command['key']}")
-        except Exception as e:
-            error_msg = f"执行命令时出错: {str(e)}"
-            logger.error(error_msg)
-            raise
+    def set_recording(self, enabled):
+        # 录制状态由事件循环线程修改
+        if self.server.loop:
+            self.server.loop.call_soon_threadsafe(self.server.set_record_dir, RECORD_DIR if enabled else None)
+        else:
+            self.server.record_dir = RECORD_DIR if enabled else None
 
     def stop(self):
-        self.running = False
-        if self.heartbeat_check_timer:
-            self.heartbeat_check_timer.stop()
-        if self.client_socket:
-            try:
-                self.client_socket.close()
-            except:
-                pass
-        if self.server_socket:
-            try:
-                self.server_socket.close()
-            except:
-                pass
-        self.buffer.clear()  # 清空缓冲区
-        logger.info("服务器已停止")
-
-    def start_heartbeat_check(self):
-        if self.heartbeat_check_timer:
-            self.heartbeat_check_timer.stop()
-        self.heartbeat_check_timer = QTimer()
-        self.heartbeat_check_timer.timeout.connect(self.check_heartbeat)
-        self.heartbeat_check_timer.start(1000)  # 每秒检查一次
-
-    def check_heartbeat(self):
-        if self.client_socket and time.time() - self.last_heartbeat > self.heartbeat_timeout:
-            logger.warning("心跳超时，客户端可能已断开")
-            self.handle_client_error()
+        self.server.stop()
+        self.injector.stop()
+
+class MetricsOverlay(QLabel):
+    # 叠加在预览画面左上角，每秒刷新一次最近一秒的帧率、码率和延迟分位数
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.setStyleSheet("background-color: rgba(0, 0, 0, 160); color: #00ff00; "
+                           "font-family: monospace; padding: 4px;")
+        self.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents)
+        self.frames = REGISTRY.counter('frames_received_total')
+        self.dropped = REGISTRY.counter('viewer_dropped_frames_total')
+        self.histograms = [
+            ("端到端", REGISTRY.histogram('frame_end_to_end_seconds')),
+            ("来源端", REGISTRY.histogram('frame_latency_seconds', stage='source')),
+            ("解码", REGISTRY.histogram('frame_decode_seconds')),
+            ("显示", REGISTRY.histogram('frame_latency_seconds', stage='display')),
+            ("输入注入", REGISTRY.histogram('input_injection_delay_seconds')),
+        ]
+        self.frame_bytes = REGISTRY.histogram('frame_received_bytes', buckets=SIZE_BUCKETS)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.take_snapshot()
+        self.hide()
+
+    def take_snapshot(self):
+        self.last_time = time.monotonic()
+        self.last_frames = self.frames.value
+        self.last_dropped = self.dropped.value
+        self.last_bytes = self.frame_bytes.snapshot()
+        self.last_histograms = [histogram.snapshot() for _, histogram in self.histograms]
+
+    def set_enabled(self, enabled):
+        if enabled:
+            self.take_snapshot()
+            self.timer.start(1000)
+            self.show()
+        else:
+            self.timer.stop()
+            self.hide()
+
+    def refresh(self):
+        elapsed = max(time.monotonic() - self.last_time, 1e-3)
+        fps = (self.frames.value - self.last_frames) / elapsed
+        rate = (self.frame_bytes.snapshot()[1] - self.last_bytes[1]) / elapsed
+        lines = [f"FPS {fps:5.1f}  码率 {rate / 1024:8.1f} KB/s  "
+                 f"丢帧 {self.dropped.value - self.last_dropped}"]
+        for (name, histogram), since in zip(self.histograms, self.last_histograms):
+            p50, p95, p99 = (histogram.quantile(q, since) * 1000 for q in (0.5, 0.95, 0.99))
+            lines.append(f"{name:<4} p50 {p50:6.1f}  p95 {p95:6.1f}  p99 {p99:6.1f} ms")
+        self.setText('\n'.join(lines))
+        self.adjustSize()
+        self.take_snapshot()
 
 class ServerWindow(QMainWindow):
     def __init__(self):
@@ -269,13 +126,22 @@ class ServerWindow(QMainWindow):
         self.client_label = QLabel("等待客户端连接...")
         self.client_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         layout.addWidget(self.client_label)
+
+        self.overlay_toggle = QCheckBox("显示性能指标")
+        layout.addWidget(self.overlay_toggle)
+        self.record_toggle = QCheckBox(f"录制会话（保存到 {RECORD_DIR} 目录）")
+        layout.addWidget(self.record_toggle)
         
-        # 屏幕预览
-        self.screen_preview = QLabel()
-        self.screen_preview.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        # 屏幕预览: 只保留最新一帧，按变化区域重绘
+        self.screen_preview = FrameView()
         self.screen_preview.setMinimumSize(800, 600)
         self.screen_preview.setStyleSheet("border: 1px solid black;")
         layout.addWidget(self.screen_preview)
+        self.overlay = MetricsOverlay(self.screen_preview)
+        self.overlay_toggle.toggled.connect(self.overlay.set_enabled)
+        self.display_metric = REGISTRY.histogram('frame_latency_seconds', "抓取到各阶段完成的延迟", stage='display')
+        self.end_to_end_metric = REGISTRY.histogram('frame_end_to_end_seconds',
+                                                    "抓取到显示的延迟（不含单程网络时延）")
         
         # 添加操作说明
         instruction_label = QLabel("使用说明：\n1. 服务器已启动，等待客户端连接\n2. 客户端连接后，将显示远程屏幕内容\n3. 客户端可以控制本机的鼠标和键盘")
@@ -283,12 +149,17 @@ class ServerWindow(QMainWindow):
         instruction_label.setStyleSheet("background-color: #f0f0f0; padding: 10px; border-radius: 5px;")
         layout.addWidget(instruction_label)
         
+        # 本机Prometheus指标: http://127.0.0.1:9100/metrics
+        self.metrics_server = MetricsServer(port=9100)
+        self.metrics_server.start()
+
         # 启动服务器线程
-        self.server_thread = ServerThread()
+        self.server_thread = ServerThread(self.screen_preview.submit)
         self.server_thread.status_signal.connect(self.update_status)
-        self.server_thread.frame_ready.connect(self.update_screen)
+        self.screen_preview.frame_shown.connect(self.record_display_latency)
         self.server_thread.client_connected.connect(self.handle_client_connected)
         self.server_thread.client_disconnected.connect(self.handle_client_disconnected)
+        self.record_toggle.toggled.connect(self.server_thread.set_recording)
         self.server_thread.start()
         
         logger.info("服务器界面初始化完成")
@@ -306,13 +177,16 @@ class ServerWindow(QMainWindow):
         self.client_label.setStyleSheet("")
         self.screen_preview.clear()
 
-    def update_screen(self, qimg):
-        pixmap = QPixmap.fromImage(qimg)
-        self.screen_preview.setPixmap(pixmap)
+    def record_display_latency(self, source_latency, received):
+        # 收到至显示，以及加上来源端耗时的端到端延迟（合并的帧只统计最新一帧）
+        displayed = time.perf_counter() - received
+        self.display_metric.observe(displayed)
+        self.end_to_end_metric.observe(source_latency + displayed)
 
     def closeEvent(self, event):
         if self.server_thread:
             self.server_thread.stop()
+        self.metrics_server.stop()
         logger.info("应用程序关闭")
         event.accept()
 
@@ -0,0 +1,638 @@
+import os
+import sys
+import json
+import socket
+import secrets
+import time
+import asyncio
+import logging
+import argparse
+import threading
+import numpy as np
+from protocol import (MessageReader, ChunkAssembler, ProtocolError, pack_header, pack_message,
+                      MSG_COMMAND, MSG_FRAME, MSG_PING, MSG_HELLO, MSG_INPUT, MSG_REFRESH, FLAG_KEYFRAME,
+                      FLAG_UNCHANGED, FLAG_SHARED, ROLE_SOURCE, ROLE_OPERATOR, ROLE_VIEWER, INPUT_ROLES,
+                      TRANSPORT_TCP, TRANSPORT_UDP, TRANSPORT_SHM)
+from codec import DEFAULT_QUALITY, negotiate_codec, clamp_quality, get_codec
+from input_events import EVENT, decode_events
+from injector import BACKENDS, InputInjector
+from metrics import LatencyStats, REGISTRY, SIZE_BUCKETS, MetricsServer
+from log_config import setup_logging
+from recording import SessionRecorder
+from pixel_format import BYTES_PER_PIXEL, PIXEL_BGRX32, PIXEL_YUV420, negotiate_pixel_format
+from shared_frames import SharedFrameReader
+from datagram import FrameAssembler, PACKET_HEADER, LOSS_TIMEOUT, RECV_BUFFER, unit_rect
+from tiles import TILE_SIZE, DirtyRegion, apply_frame, encode_rects, parse_frame_header, parse_frame_timing
+
+logger = logging.getLogger(__name__)
+
+VIEWER_ROLES = (ROLE_OPERATOR, ROLE_VIEWER)
+DEFAULT_SIZE = (800, 600)
+
+
+class ClientSession(asyncio.BufferedProtocol):
+    # 单个连接: 数据直接读入预分配缓冲区，逐条分发消息
+    # 握手前角色未定；来源端上传画面，观看者从服务器接收画面
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.address = None
+        self.reader = MessageReader()
+        self.assembler = ChunkAssembler()  # 画面分块发送，输入和心跳可插在块之间
+        self.role = None
+        self.session = None  # 握手协商的会话参数
+        self.codec = None
+        self.last_heartbeat = 0
+        self.heartbeat_task = None
+        # 来源端经UDP发送画面时: 分片拼接、各块最近一次更新的帧序号（乱序到达的旧内容不覆盖新内容）
+        self.token = None
+        self.datagrams = None
+        self.tile_seq = None
+        self.shape_seq = 0  # 帧缓冲按当前尺寸创建时的帧序号
+        self.loss_task = None
+        self.shared = None  # 来源端在本机时经共享内存传输画面
+        # 观看者发送状态
+        self.writable = True
+        self.dirty = DirtyRegion()
+        self.keyframe_pending = True
+        self.dropped_frames = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        peer = transport.get_extra_info('peername')
+        self.address = f"{peer[0]}:{peer[1]}" if peer else "unknown"
+        self.last_heartbeat = time.monotonic()
+        self.heartbeat_task = asyncio.get_running_loop().create_task(self.check_heartbeat())
+        self.server.sessions.add(self)
+        logger.info(f"新连接: {self.address}")
+
+    def connection_lost(self, exc):
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+        if self.loss_task:
+            self.loss_task.cancel()
+        if self.shared:
+            self.shared.close()
+            self.shared = None
+        self.server.detach(self)
+
+    def pause_writing(self):
+        # 发送缓冲区超过上限，之后的帧只累积变化区域
+        self.writable = False
+
+    def resume_writing(self):
+        self.writable = True
+        self.flush_frame()
+
+    def get_buffer(self, sizehint):
+        return self.reader.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        self.reader.buffer_updated(nbytes)
+        try:
+            for msg_type, flags, payload in self.reader.messages():
+                message = self.assembler.feed(msg_type, flags, payload)
+                if message is None:
+                    continue
+                flags, payload = message
+                start = time.perf_counter_ns()
+                self.dispatch(msg_type, flags, payload)
+                elapsed = time.perf_counter_ns() - start
+                self.server.stats.record(elapsed)
+                self.server.handle_metric.observe(elapsed / 1e9)
+        except ProtocolError as e:
+            # 帧边界已无法恢复，只能断开重连
+            logger.error(f"协议错误: {str(e)}")
+            self.transport.close()
+
+    def dispatch(self, msg_type, flags, payload):
+        if msg_type == MSG_INPUT:
+            self.process_input(payload)
+        elif msg_type == MSG_COMMAND:
+            self.process_command(payload)
+        elif msg_type == MSG_FRAME:
+            self.process_frame(payload, flags)
+        elif msg_type == MSG_PING:
+            self.handle_heartbeat(payload)
+        elif msg_type == MSG_HELLO:
+            self.handle_hello(payload)
+        else:
+            logger.warning(f"未知的消息类型: {msg_type}")
+
+    def send(self, msg_type, payload=b'', flags=0):
+        if self.transport and not self.transport.is_closing():
+            self.transport.write(pack_message(msg_type, payload, flags))
+
+    def process_command(self, payload):
+        if self.role not in INPUT_ROLES:
+            logger.warning(f"只读连接发送了输入命令，已忽略: {self.address}")
+            return
+        if self.server.recorder:
+            self.server.recorder.record_input(MSG_COMMAND, payload)
+        try:
+            command = json.loads(bytes(payload))
+            self.server.on_command(command)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            # 消息边界由长度字段确定，单条命令损坏不影响后续数据
+            logger.error(f"命令解析错误: {str(e)}")
+        except Exception as e:
+            logger.error(f"处理命令错误: {str(e)}")
+
+    def process_input(self, payload):
+        if self.role not in INPUT_ROLES:
+            logger.warning(f"只读连接发送了输入事件，已忽略: {self.address}")
+            return
+        if len(payload) % EVENT.size:
+            logger.error(f"输入事件长度错误: {len(payload)}")
+            return
+        self.server.input_metric.inc(len(payload) // EVENT.size)
+        if self.server.recorder:
+            self.server.recorder.record_input(MSG_INPUT, payload)
+        for command in decode_events(payload):
+            try:
+                self.server.on_command(command)
+            except Exception as e:
+                logger.error(f"处理命令错误: {str(e)}")
+
+    def process_frame(self, payload, flags):
+        if self.role != ROLE_SOURCE:
+            logger.warning(f"非来源连接发送了画面，已忽略: {self.address}")
+            return
+        if flags & FLAG_UNCHANGED:
+            # 来源端画面静止，保活帧不含矩形，无需解码和转发
+            self.last_heartbeat = time.monotonic()
+            self.server.keepalive_metric.inc()
+            return
+        try:
+            received = time.perf_counter()
+            width, height, pixel_format = parse_frame_header(payload)
+            shape = (height, width, BYTES_PER_PIXEL[pixel_format])
+            framebuffer = self.server.framebuffer
+            if framebuffer is None or framebuffer.shape != shape:
+                if not flags & FLAG_KEYFRAME:
+                    logger.warning("缺少关键帧，丢弃增量帧")
+                    if flags & FLAG_SHARED and self.shared:
+                        self.shared.release(payload)
+                    return
+                framebuffer = self.server.framebuffer = np.zeros(shape, dtype=np.uint8)
+
+            seq, latency_us = parse_frame_timing(payload)
+            if flags & FLAG_SHARED:
+                if self.shared is None:
+                    raise ValueError("未建立共享内存传输")
+                copies, rects = self.shared.apply(framebuffer, payload)
+            else:
+                copies, rects = apply_frame(framebuffer, payload)
+            if self.server.recorder:
+                if flags & FLAG_SHARED:
+                    # 共享内存的通知不含像素，只拷贝变化区域交给录制线程编码
+                    self.server.recorder.record_rects(framebuffer, pixel_format, copies, rects, seq, latency_us,
+                                                      flags & ~FLAG_SHARED)
+                else:
+                    self.server.recorder.record_frame(framebuffer, payload, flags)
+            timing = self.server.record_frame(len(payload), seq, latency_us / 1e6, received)
+            # 界面只关心变化区域，复制指令的目标区域也算在内
+            moved = [(dx, dy, w, h) for _, _, w, h, dx, dy in copies]
+            self.server.on_frame(framebuffer, moved + rects, timing)
+            self.server.broadcast(framebuffer, rects, copies)
+        except Exception as e:
+            logger.error(f"处理帧错误: {str(e)}")
+
+    def process_datagram(self, packet):
+        unit, frame = self.datagrams.add(packet, time.monotonic())
+        if unit is not None:
+            try:
+                self.apply_unit(unit, frame)
+            except Exception as e:
+                logger.error(f"处理数据报画面错误: {str(e)}")
+        if frame is not None and frame.complete():
+            self.datagrams.finish(frame)
+            self.deliver_frame(frame)
+
+    def apply_unit(self, unit, frame):
+        # 单元是只含一个矩形的帧负载；对应的块已被更新的帧覆盖时丢弃
+        width, height, pixel_format = parse_frame_header(unit)
+        shape = (height, width, BYTES_PER_PIXEL[pixel_format])
+        framebuffer = self.server.framebuffer
+        if framebuffer is None or framebuffer.shape != shape or self.tile_seq is None:
+            if framebuffer is not None and self.tile_seq is not None and frame.seq < self.shape_seq:
+                return  # 尺寸变化之前的帧迟到
+            framebuffer = self.server.framebuffer = np.zeros(shape, dtype=np.uint8)
+            self.tile_seq = np.zeros((-(-height // TILE_SIZE), -(-width // TILE_SIZE)), dtype=np.int64)
+            self.shape_seq = frame.seq
+            if self.server.recorder:
+                # 数据报单元都不是关键帧，新的帧缓冲要先以快照的形式写入录制
+                self.server.recorder.resync = True
+        x, y, w, h = unit_rect(unit)
+        ts = TILE_SIZE
+        area = self.tile_seq[y // ts:-(-(y + h) // ts), x // ts:-(-(x + w) // ts)]
+        if area.max() > frame.seq:
+            return
+        apply_frame(framebuffer, unit)
+        area[:] = frame.seq
+        frame.rects.append((x, y, w, h))
+        if not frame.latency_us:
+            frame.latency_us = parse_frame_timing(unit)[1]
+        if self.server.recorder:
+            self.server.recorder.record_frame(framebuffer, unit, 0)
+
+    def deliver_frame(self, frame):
+        # 一帧收齐或判定丢失后，把已应用的区域交给界面和观看者
+        if not frame.rects:
+            return
+        framebuffer = self.server.framebuffer
+        timing = self.server.record_frame(frame.nbytes, frame.seq, frame.latency_us / 1e6, frame.received)
+        self.server.on_frame(framebuffer, frame.rects, timing)
+        self.server.broadcast(framebuffer, frame.rects)
+
+    def request_refresh(self, request):
+        self.server.refresh_metric.inc()
+        self.send(MSG_REFRESH, json.dumps(request).encode('utf-8'))
+
+    async def check_losses(self):
+        # 超时未收齐的帧: 已收到的部分照常显示，缺失的单元请求来源端重发当前内容
+        while True:
+            await asyncio.sleep(LOSS_TIMEOUT / 2)
+            for frame, missing in self.datagrams.expire(time.monotonic()):
+                self.deliver_frame(frame)
+                self.server.lost_units_metric.inc(len(missing) if missing is not None else 1)
+                self.request_refresh({'seq': frame.seq, 'units': missing})
+            if self.datagrams.keyframe_needed:
+                self.datagrams.keyframe_needed = False
+                logger.warning(f"数据报丢失过多，请求关键帧: {self.address}")
+                self.request_refresh({'keyframe': True})
+
+    def update_frame(self, framebuffer, rects, copies=()):
+        # 观看者: 记录变化区域，可写时立即发送，否则与后续帧合并（只保留最新画面）
+        # 复制指令只在观看者画面与服务器一致（没有积压的变化区域）时转发，否则改为重发目标区域
+        height, width = framebuffer.shape[:2]
+        if self.dirty.size != (width, height):
+            self.dirty.reset(width, height)
+            self.keyframe_pending = True
+            copies = ()
+        else:
+            if copies and (not self.writable or self.dirty.is_dirty()):
+                self.dirty.mark([(dx, dy, w, h) for _, _, w, h, dx, dy in copies])
+                copies = ()
+            self.dirty.mark(rects)
+        if self.writable:
+            self.flush_frame(copies)
+        else:
+            self.dropped_frames += 1
+            self.server.viewer_dropped_metric.inc()
+
+    def flush_frame(self, copies=()):
+        framebuffer = self.server.framebuffer
+        if self.role not in VIEWER_ROLES or framebuffer is None or not (copies or self.dirty.is_dirty()):
+            return
+        rects = self.dirty.take()
+        # 转发来源端的帧序号，延迟加上在服务器上停留的时间
+        seq, source_latency, received = self.server.frame_timing
+        latency_us = (source_latency + time.perf_counter() - received) * 1e6 if received else 0
+        parts = encode_rects(framebuffer, rects, self.codec, self.session['quality'],
+                             seq=seq, latency_us=int(latency_us), copies=copies)
+        flags = FLAG_KEYFRAME if self.keyframe_pending else 0
+        self.keyframe_pending = False
+        length = sum(len(part) for part in parts)
+        self.transport.writelines([pack_header(MSG_FRAME, length, flags)] + parts)
+
+    def handle_hello(self, payload):
+        try:
+            hello, session = self.negotiate(payload)
+        except (ValueError, KeyError, TypeError) as e:
+            # 握手消息格式错误与其他被拒绝的握手一样回复错误并断开，不让异常进入事件循环
+            self.reject(f"握手消息无效: {str(e)}")
+            return
+        role = session['role']
+        codec = session['codec']
+        self.session = session
+
+        error = self.server.attach(self, role)
+        if error:
+            self.reject(error)
+            return
+
+        self.role = role
+        self.codec = get_codec(codec)
+        if role == ROLE_SOURCE and hello.get('transport') == TRANSPORT_UDP:
+            if self.server.datagram_transport:
+                self.token = self.server.register_datagrams(self)
+                self.datagrams = FrameAssembler()
+                self.loss_task = asyncio.get_running_loop().create_task(self.check_losses())
+                self.session.update({'transport': TRANSPORT_UDP, 'udp_port': self.server.port,
+                                     'udp_token': self.token})
+            else:
+                logger.warning(f"服务器未启用UDP，画面改用TCP传输: {self.address}")
+        elif role == ROLE_SOURCE and hello.get('transport') == TRANSPORT_SHM:
+            try:
+                self.shared = SharedFrameReader(hello['shm_name'], bytes.fromhex(hello['shm_nonce']))
+                self.session['transport'] = TRANSPORT_SHM
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning(f"无法使用共享内存，画面改用TCP传输: {self.address}: {str(e)}")
+        self.send(MSG_HELLO, json.dumps(self.session).encode('utf-8'))
+        logger.info(f"会话参数: {self.session}")
+
+        if role in VIEWER_ROLES:
+            self.transport.set_write_buffer_limits(high=self.server.viewer_buffer_limit)
+            if self.server.framebuffer is not None:
+                self.update_frame(self.server.framebuffer, [])
+
+    def negotiate(self, payload):
+        # 解析握手消息并确定会话参数，返回 (握手消息, 会话参数)；消息不完整或类型不对时抛出异常
+        hello = json.loads(bytes(payload))
+        if not isinstance(hello, dict):
+            raise ValueError("不是JSON对象")
+        role = hello.get('role', ROLE_SOURCE)
+        if not isinstance(role, str):
+            raise ValueError(f"角色无效: {role!r}")
+        codec = negotiate_codec(hello.get('codecs', []), hello.get('codec'))
+        quality = clamp_quality(hello.get('quality', DEFAULT_QUALITY))
+        session = {'codec': codec, 'quality': quality, 'role': role}
+        if role == ROLE_SOURCE:
+            # 来源端还需确定像素格式和传输分辨率
+            pixel_format = negotiate_pixel_format(hello.get('formats', []), hello.get('pixel_format'))
+            if pixel_format == PIXEL_YUV420 and not get_codec(codec).planar:
+                # Pillow的有损编码器内部已做色度抽样，不能直接编码平面数据
+                pixel_format = PIXEL_BGRX32
+            size = hello.get('target_size') or hello.get('source_size')
+            if size is not None:
+                width, height = (int(value) for value in size)
+                if not (0 < width <= 0xFFFF and 0 < height <= 0xFFFF):
+                    raise ValueError(f"分辨率无效: {width}x{height}")
+                size = (width, height)
+            width, height = self.server.limit_size(size)
+            session.update({
+                'pixel_format': pixel_format,
+                'size': [width, height],
+                'stride': width * BYTES_PER_PIXEL[pixel_format],
+                'transport': TRANSPORT_TCP,
+            })
+        return hello, session
+
+    def reject(self, error):
+        logger.warning(f"拒绝连接 {self.address}: {error}")
+        self.send(MSG_HELLO, json.dumps({'error': error}).encode('utf-8'))
+        self.transport.close()
+
+    def handle_heartbeat(self, payload):
+        self.last_heartbeat = time.monotonic()
+        # 原样回送心跳负载（客户端时间戳），供客户端计算往返时延
+        self.send(MSG_PING, payload)
+
+    async def check_heartbeat(self):
+        while True:
+            await asyncio.sleep(1)  # 每秒检查一次
+            if time.monotonic() - self.last_heartbeat > self.server.heartbeat_timeout:
+                logger.warning(f"心跳超时，连接可能已断开: {self.address}")
+                self.transport.close()
+                return
+
+
+def _ignore(*args):
+    pass
+
+
+class RemoteDesktopServer:
+    # 基于asyncio的事件驱动服务器，不依赖Qt；界面通过回调接收帧和状态
+    # 一个来源端上传画面，分发给任意数量的观看者，每个观看者有独立的发送缓冲上限
+    def __init__(self, host='0.0.0.0', port=5000, on_frame=None, on_command=None,
+                 on_status=None, on_connected=None, on_disconnected=None, max_viewers=16,
+                 max_size=None, record_dir=None, udp=True):
+        self.host = host
+        self.port = port
+        self.on_frame = on_frame or _ignore
+        self.on_command = on_command or _ignore
+        self.on_status = on_status or _ignore
+        self.on_connected = on_connected or _ignore
+        self.on_disconnected = on_disconnected or _ignore
+        self.heartbeat_timeout = 5
+        self.max_viewers = max_viewers
+        self.viewer_buffer_limit = 2 * 1024 * 1024  # 每个观看者待发送数据上限
+        self.max_size = max_size  # 来源画面的最大传输分辨率 (宽, 高)，None表示不限制
+        self.record_dir = record_dir  # 每个来源连接录制为该目录下的一个文件，None表示不录制
+        self.recorder = None
+        self.udp = udp  # 在同一端口号上接收来源端经UDP发送的画面
+        self.datagram_transport = None
+        self.datagram_sessions = {}  # 会话令牌 -> 来源连接
+        self.source = None
+        self.viewers = set()
+        self.framebuffer = None  # 来源画面的持久帧缓冲
+        self.frame_timing = (0, 0.0, 0.0)  # 最新帧的 (序号, 来源端抓取至发送耗时, 收到时刻)
+        self.stats = LatencyStats()
+        self.handle_metric = REGISTRY.histogram('message_handle_seconds', "单条消息处理耗时")
+        self.frames_metric = REGISTRY.counter('frames_received_total', "收到的来源帧数")
+        self.frame_bytes_metric = REGISTRY.histogram('frame_received_bytes', "收到的每帧负载字节数", buckets=SIZE_BUCKETS)
+        self.decode_metric = REGISTRY.histogram('frame_decode_seconds', "收到到解码完成的耗时")
+        self.source_latency_metric = REGISTRY.histogram('frame_latency_seconds', "抓取到各阶段完成的延迟",
+                                                        stage='source')
+        self.input_metric = REGISTRY.counter('input_events_received_total', "收到的输入事件数")
+        self.keepalive_metric = REGISTRY.counter('idle_keepalives_received_total', "来源端画面静止时的保活帧数")
+        self.datagrams_metric = REGISTRY.counter('datagrams_received_total', "收到的画面数据报数")
+        self.lost_units_metric = REGISTRY.counter('datagram_units_lost_total', "超时未收齐的画面单元数（整帧丢失计为1）")
+        self.refresh_metric = REGISTRY.counter('refresh_requests_sent_total', "请求来源端重发的次数")
+        self.viewer_dropped_metric = REGISTRY.counter('viewer_dropped_frames_total', "观看者发送缓冲满时合并的帧数")
+        REGISTRY.gauge('viewers', "观看者连接数", func=lambda: len(self.viewers))
+        REGISTRY.gauge('viewer_write_buffer_bytes', "观看者待发送字节数之和",
+                       func=lambda: sum(v.transport.get_write_buffer_size() for v in list(self.viewers)))
+        self.sessions = set()  # 所有连接，包括尚未握手的
+        self.loop = None
+        self.stop_event = None
+        self.started = threading.Event()  # 开始监听后置位，port为实际端口（传入0时由系统分配）
+
+    def attach(self, session, role):
+        # 返回错误信息，成功时返回None
+        if role == ROLE_SOURCE:
+            if self.source is not None:
+                return "已有画面来源连接"
+            self.source = session
+            if self.record_dir:
+                self.start_recording()
+            self.on_connected(session.address)
+            self.on_status(f"客户端已连接: {session.address}")
+        elif role in VIEWER_ROLES:
+            if len(self.viewers) >= self.max_viewers:
+                return "观看者数量已达上限"
+            self.viewers.add(session)
+            self.on_status(f"观看者已连接: {session.address} ({len(self.viewers)})")
+        else:
+            return f"未知的角色: {role}"
+        return None
+
+    def detach(self, session):
+        self.sessions.discard(session)
+        self.datagram_sessions.pop(session.token, None)
+        if session is self.source:
+            self.source = None
+            self.stop_recording()
+            self.on_disconnected()
+            self.on_status("客户端断开连接")
+            logger.info("客户端断开连接")
+        elif session in self.viewers:
+            self.viewers.discard(session)
+            self.on_status(f"观看者断开连接: {session.address} ({len(self.viewers)})")
+            logger.info(f"观看者断开连接: {session.address}, 合并丢弃帧数: {session.dropped_frames}")
+
+    def register_datagrams(self, session):
+        # 分配会话令牌，数据报按令牌找到来源连接
+        token = secrets.randbits(32)
+        while token in self.datagram_sessions:
+            token = secrets.randbits(32)
+        self.datagram_sessions[token] = session
+        return token
+
+    def start_recording(self):
+        # 从下一个关键帧开始录制，当前已有画面时立即写入一个关键帧
+        name = time.strftime('session-%Y%m%d-%H%M%S.rec')
+        self.recorder = SessionRecorder(os.path.join(self.record_dir, name))
+        self.recorder.start()
+        if self.framebuffer is not None:
+            self.recorder.resync = True
+
+    def stop_recording(self):
+        if self.recorder:
+            self.recorder.stop()
+            self.recorder = None
+
+    def set_record_dir(self, record_dir):
+        # 在事件循环线程中调用（其他线程用loop.call_soon_threadsafe）
+        self.record_dir = record_dir
+        if record_dir and self.source and not self.recorder:
+            self.start_recording()
+        elif not record_dir:
+            self.stop_recording()
+
+    def limit_size(self, size):
+        # 等比缩小到max_size以内
+        width, height = size or DEFAULT_SIZE
+        if self.max_size:
+            ratio = min(1.0, self.max_size[0] / width, self.max_size[1] / height)
+            width, height = int(width * ratio), int(height * ratio)
+        return width, height
+
+    def record_frame(self, nbytes, seq, source_latency, received):
+        # 返回交给on_frame的 (序号, 来源端延迟, 收到时刻)
+        self.decode_metric.observe(time.perf_counter() - received)
+        self.frames_metric.inc()
+        self.frame_bytes_metric.observe(nbytes)
+        self.source_latency_metric.observe(source_latency)
+        self.frame_timing = (seq, source_latency, received)
+        return self.frame_timing
+
+    def broadcast(self, framebuffer, rects, copies=()):
+        for viewer in self.viewers:
+            viewer.update_frame(framebuffer, rects, copies)
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        server = await self.loop.create_server(
+            lambda: ClientSession(self), self.host, self.port, reuse_address=True)
+        self.port = server.sockets[0].getsockname()[1]
+        if self.udp:
+            self.datagram_transport, _ = await self.loop.create_datagram_endpoint(
+                lambda: FrameDatagramProtocol(self), local_addr=(self.host, self.port))
+            try:
+                self.datagram_transport.get_extra_info('socket').setsockopt(
+                    socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER)
+            except OSError:
+                pass
+        self.started.set()
+        self.on_status("服务器启动，等待连接...")
+        logger.info("服务器启动，等待连接...")
+        try:
+            await self.stop_event.wait()
+        finally:
+            self.stop_recording()
+            server.close()
+            if self.datagram_transport:
+                self.datagram_transport.close()
+                self.datagram_transport = None
+            for session in list(self.sessions):
+                session.transport.close()
+            await server.wait_closed()
+            self.started.clear()
+            logger.info("服务器已停止")
+
+    def stop(self):
+        # 可从任意线程调用
+        if self.loop and self.stop_event:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+
+
+class FrameDatagramProtocol(asyncio.DatagramProtocol):
+    # UDP端点: 按数据报头中的会话令牌交给对应的来源连接，未知令牌直接丢弃
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        if len(data) <= PACKET_HEADER.size:
+            return
+        session = self.server.datagram_sessions.get(PACKET_HEADER.unpack_from(data, 0)[0])
+        if session is None:
+            return
+        self.server.datagrams_metric.inc()
+        session.process_datagram(data)
+
+    def error_received(self, exc):
+        logger.warning(f"UDP接收错误: {str(exc)}")
+
+
+async def report_stats(server, interval):
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f"消息处理耗时: {server.stats.summary()}")
+        server.stats.reset()
+
+
+def parse_size(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+async def run_headless(host, port, stats_interval, inject=None, max_size=None, metrics_port=9100,
+                       record_dir=None, udp=True):
+    metrics_server = MetricsServer(metrics_port) if metrics_port else None
+    if metrics_server:
+        metrics_server.start()
+    injector = None
+    if inject:
+        injector = InputInjector(BACKENDS[inject]())
+        injector.start()
+    server = RemoteDesktopServer(host, port, on_command=injector.submit if injector else None,
+                                 max_size=max_size, record_dir=record_dir, udp=udp)
+    reporter = asyncio.get_running_loop().create_task(report_stats(server, stats_interval))
+    try:
+        await server.serve()
+    finally:
+        reporter.cancel()
+        if injector:
+            injector.stop()
+        if metrics_server:
+            metrics_server.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="无界面远程控制服务器")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--stats-interval', type=float, default=5.0, help="统计输出间隔（秒）")
+    parser.add_argument('--inject', choices=sorted(BACKENDS), help="执行收到的输入事件（需要图形桌面）")
+    parser.add_argument('--max-size', type=parse_size, help="来源画面的最大传输分辨率，如 1280x720")
+    parser.add_argument('--metrics-port', type=int, default=9100, help="本机Prometheus指标端口，0表示关闭")
+    parser.add_argument('--record', metavar='DIR', help="录制会话到该目录（每个来源连接一个文件）")
+    parser.add_argument('--no-udp', action='store_true', help="不接收UDP画面（来源端改用TCP）")
+    parser.add_argument('--log-file', help="日志文件（按大小轮转），默认只输出到控制台")
+    parser.add_argument('--log-json', action='store_true', help="每条日志输出一行JSON")
+    parser.add_argument('--loki-url', help="批量推送日志到Loki，如 http://localhost:3100")
+    args = parser.parse_args(argv)
+
+    setup_logging(args.log_file, json_format=args.log_json or None, loki_url=args.loki_url)
+    try:
+        asyncio.run(run_headless(args.host, args.port, args.stats_interval, args.inject, args.max_size,
+                                 args.metrics_port, args.record, not args.no_udp))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,177 @@
+import os
+import time
+import socket
+import struct
+import threading
+import ipaddress
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from codec import RawCodec
+from pixel_format import BYTES_PER_PIXEL, FORMAT_IDS, FORMAT_NAMES, format_of
+from scroll import apply_copy
+from tiles import FRAME_HEADER, COPY_HEADER, RECT_HEADER, DirtyRegion
+
+# 同机传输: 来源端把画面写入共享内存中的两个槽（双缓冲），经TCP连接只发送一条很短的通知，
+# 服务器直接从槽中读取变化区域，画面数据不经过编码和socket
+# 通知沿用帧负载格式，矩形不带数据（长度为0），末尾附加槽编号
+# 共享内存头: 校验码（随机，握手时核对，防止连到其他机器上同名的共享内存）两个槽的状态 每个槽的字节数
+SHM_HEADER = struct.Struct('!8sBBxxI')
+STATE_OFFSET = 8
+SLOT_OFFSET = 64
+SLOTS = 2
+SLOT_FREE = 0  # 来源端可以写入
+SLOT_READY = 1  # 已写入，等待服务器读取
+SLOT_TRAILER = struct.Struct('!B')
+ACQUIRE_TIMEOUT = 5.0  # 等待服务器释放槽的最长时间（秒）
+
+_created = set()  # 本进程创建的共享内存（benchmark中来源端和服务器在同一进程）
+
+
+def is_local_host(host):
+    # 主机名解析到回环地址时认为与服务器在同一台机器上
+    try:
+        address = socket.getaddrinfo(host, None)[0][4][0]
+        return ipaddress.ip_address(address.split('%')[0]).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+def attach(name):
+    # 附加到来源端创建的共享内存；不登记到resource_tracker，否则本进程退出时会删除对方的共享内存
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # Python 3.12及以前附加时也会登记；同一进程创建的由创建方注销
+        if name not in _created:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class SharedFrameWriter:
+    # 来源端: 创建共享内存并轮流写入两个槽；每个槽记录自己上次写入以来的变化区域，只拷贝这些区域
+    # 槽在服务器读取完成前不会被改写，服务器处理不过来时write()阻塞（与TCP发送缓冲满时相同）
+    # write()和close()互斥: 还有数组引用共享内存时关闭会失败，共享内存就不会被删除
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.closed = False
+        self.nonce = os.urandom(8)
+        self.shm = shared_memory.SharedMemory(create=True, size=SLOT_OFFSET + SLOTS * capacity)
+        _created.add(self.shm.name)
+        SHM_HEADER.pack_into(self.shm.buf, 0, self.nonce, SLOT_FREE, SLOT_FREE, capacity)
+        self.dirty = [DirtyRegion() for _ in range(SLOTS)]
+        self.slot = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, frame, copies, rects):
+        # 返回通知的负载分段（帧序号和耗时由stamp_frame写入）；已关闭时返回None
+        with self.lock:
+            if self.closed:
+                return None
+            return self.write_slot(frame, copies, rects)
+
+    def write_slot(self, frame, copies, rects):
+        height, width, channels = frame.shape
+        if frame.nbytes > self.capacity:
+            raise ValueError(f"画面超出共享内存容量: {width}x{height}")
+        moved = [(dx, dy, w, h) for _, _, w, h, dx, dy in copies]
+        for region in self.dirty:
+            if region.size != (width, height):
+                region.reset(width, height)
+            else:
+                region.mark(moved + rects)
+        slot = self.slot
+        if not self.acquire(slot):
+            return None
+        pixels = np.ndarray(frame.shape, np.uint8, self.shm.buf, SLOT_OFFSET + slot * self.capacity)
+        try:
+            for x, y, w, h in self.dirty[slot].take():
+                pixels[y:y + h, x:x + w] = frame[y:y + h, x:x + w]
+        finally:
+            del pixels
+        self.shm.buf[STATE_OFFSET + slot] = SLOT_READY
+        self.slot = (slot + 1) % SLOTS
+
+        parts = [FRAME_HEADER.pack(width, height, FORMAT_IDS[format_of(frame)], RawCodec.codec_id,
+                                   len(copies), len(rects), 0, 0)]
+        for copy in copies:
+            parts.append(COPY_HEADER.pack(*copy))
+        for x, y, w, h in rects:
+            parts.append(RECT_HEADER.pack(x, y, w, h, 0))
+        parts.append(SLOT_TRAILER.pack(slot))
+        return parts
+
+    def acquire(self, slot):
+        # 等待服务器释放槽；等待中被关闭时返回False
+        deadline = time.monotonic() + ACQUIRE_TIMEOUT
+        while self.shm.buf[STATE_OFFSET + slot] != SLOT_FREE:
+            if self.closed:
+                return False
+            if time.monotonic() > deadline:
+                raise TimeoutError("服务器未释放共享帧缓冲")
+            time.sleep(0.0005)
+        return True
+
+    def close(self):
+        # 可重复调用；先置标志让等待槽的write()尽快返回，再等它释放共享内存
+        self.closed = True
+        with self.lock:
+            try:
+                self.shm.close()
+            finally:
+                try:
+                    self.shm.unlink()
+                except FileNotFoundError:
+                    pass
+                _created.discard(self.shm.name)
+
+
+class SharedFrameReader:
+    # 服务器: 按通知把复制指令和变化区域从槽中读入自己的帧缓冲，随即释放槽
+    def __init__(self, name, nonce):
+        self.shm = attach(name)
+        stored, _, _, self.capacity = SHM_HEADER.unpack_from(self.shm.buf, 0)
+        if stored != nonce:
+            self.shm.close()
+            raise ValueError("共享内存校验码不一致，来源端不在本机")
+
+    def apply(self, framebuffer, payload):
+        # 与tiles.apply_frame相同，返回 (复制指令列表, 更新的矩形列表)
+        _, _, format_id, _, copy_count, count = FRAME_HEADER.unpack_from(payload, 0)[:6]
+        slot = payload[-1]
+        if slot >= SLOTS or framebuffer.nbytes > self.capacity:
+            raise ValueError(f"共享帧通知无效: 槽 {slot}")
+        if framebuffer.shape[2] != BYTES_PER_PIXEL[FORMAT_NAMES[format_id]]:
+            raise ValueError(f"帧缓冲像素格式不匹配: {FORMAT_NAMES[format_id]}")
+        offset = FRAME_HEADER.size
+        copies = []
+        for _ in range(copy_count):
+            copy = COPY_HEADER.unpack_from(payload, offset)
+            offset += COPY_HEADER.size
+            apply_copy(framebuffer, copy)
+            copies.append(copy)
+        pixels = np.ndarray(framebuffer.shape, np.uint8, self.shm.buf, SLOT_OFFSET + slot * self.capacity)
+        rects = []
+        try:
+            for _ in range(count):
+                x, y, w, h, _ = RECT_HEADER.unpack_from(payload, offset)
+                offset += RECT_HEADER.size
+                framebuffer[y:y + h, x:x + w] = pixels[y:y + h, x:x + w]
+                rects.append((x, y, w, h))
+        finally:
+            del pixels
+            self.release(payload)
+        return copies, rects
+
+    def release(self, payload):
+        # 不读取就丢弃的通知也必须释放槽，否则来源端会一直等待
+        slot = payload[-1]
+        if slot < SLOTS:
+            self.shm.buf[STATE_OFFSET + slot] = SLOT_FREE
+
+    def close(self):
+        self.shm.close()
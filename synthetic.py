@@ -0,0 +1,140 @@
+import numpy as np
+
+# 合成画面场景，供benchmark在没有显示器的机器上代替屏幕抓取
+SCENE_STATIC = 'static'  # 静止桌面
+SCENE_TYPING = 'typing'  # 文本编辑器中打字
+SCENE_SCROLLING = 'scrolling'  # 滚动长文档
+SCENE_VIDEO = 'video'  # 窗口内全动态视频
+SCENES = (SCENE_STATIC, SCENE_TYPING, SCENE_SCROLLING, SCENE_VIDEO)
+
+PAPER = (250, 250, 250, 255)
+INK = (32, 32, 32, 255)
+
+GLYPH_WIDTH = 8
+GLYPH_HEIGHT = 16
+LINE_HEIGHT = 20
+
+
+def make_glyphs(rng, count=64):
+    # 随机点阵字形 (数量, 高, 宽)，只用来产生类似文字的高频内容
+    glyphs = rng.random((count, GLYPH_HEIGHT, GLYPH_WIDTH)) < 0.3
+    glyphs[:, :3] = False
+    glyphs[:, -3:] = False
+    glyphs[:, :, -1] = False
+    glyphs[0] = False  # 0号为空格
+    return glyphs
+
+
+def render_text(glyphs, codes, foreground, background):
+    # codes: (行, 列) 字形编号，返回bgrx32像素
+    rows, cols = codes.shape
+    mask = glyphs[codes]  # (行, 列, 字高, 字宽)
+    mask = np.pad(mask, ((0, 0), (0, 0), (0, LINE_HEIGHT - GLYPH_HEIGHT), (0, 0)))
+    mask = mask.transpose(0, 2, 1, 3).reshape(rows * LINE_HEIGHT, cols * GLYPH_WIDTH)
+    pixels = np.empty(mask.shape + (4,), dtype=np.uint8)
+    pixels[:] = background
+    pixels[mask] = foreground
+    return pixels
+
+
+class SyntheticSource:
+    # 与capture.ScreenSource接口一致的合成画面来源，相同参数每次生成的画面序列相同
+    # 每次grab()返回新数组（与mss每次抓取分配新缓冲区一致）
+    def __init__(self, scene=SCENE_STATIC, size=(1920, 1080), seed=0):
+        if scene not in SCENES:
+            raise ValueError(f"未知的场景: {scene}")
+        self.scene = scene
+        self.width, self.height = size
+        self.rng = np.random.default_rng(seed)
+        self.glyphs = make_glyphs(self.rng)
+        self.frame_index = 0
+        self.desktop = self.make_desktop()
+        # 场景窗口: 屏幕中间的一块区域
+        self.window = (self.width // 8, self.height // 8, self.width * 3 // 4, self.height * 3 // 4)
+        x, y, w, h = self.window
+        self.cols = w // GLYPH_WIDTH
+        self.rows = h // LINE_HEIGHT
+        if scene == SCENE_TYPING:
+            self.clear_page()
+        elif scene == SCENE_SCROLLING:
+            codes = self.random_codes(self.rows * 4, self.cols)
+            self.document = render_text(self.glyphs, codes, INK, PAPER)
+        elif scene == SCENE_VIDEO:
+            # 低分辨率噪声放大后平移，既有运动又不是纯噪声（纯噪声无法压缩，不像真实视频）
+            small = self.rng.integers(0, 256, (h // 8 + 2, w // 8 + 2, 4), dtype=np.uint8)
+            self.video = np.repeat(np.repeat(small, 8, axis=0), 8, axis=1)
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def size(self):
+        return self.width, self.height
+
+    def random_codes(self, rows, cols):
+        codes = self.rng.integers(1, len(self.glyphs), (rows, cols))
+        codes[self.rng.random((rows, cols)) < 0.15] = 0  # 单词间的空格
+        return codes
+
+    def clear_page(self):
+        # 打字场景直接在底图上逐字绘制，grab()只需拷贝底图再画光标
+        self.codes = np.zeros((self.rows, self.cols), dtype=np.int64)
+        x, y, w, h = self.window
+        self.base = self.desktop.copy()
+        self.base[y:y + h, x:x + w] = PAPER
+
+    def make_desktop(self):
+        # 渐变背景 + 任务栏 + 几个图标
+        pixels = np.empty((self.height, self.width, 4), dtype=np.uint8)
+        gradient = np.linspace(80, 160, self.height, dtype=np.uint8)
+        pixels[..., 0] = gradient[:, None]
+        pixels[..., 1] = 90
+        pixels[..., 2] = 40
+        pixels[..., 3] = 255
+        pixels[-40:] = (48, 48, 48, 255)
+        for i in range(6):
+            y = 20 + i * 90
+            if y + 64 < self.height - 40:
+                pixels[y:y + 64, 20:84] = self.rng.integers(0, 256, 4, dtype=np.uint8)
+        return pixels
+
+    def grab(self):
+        x, y, w, h = self.window
+        index = self.frame_index
+        self.frame_index += 1
+
+        if self.scene == SCENE_TYPING:
+            # 编辑器窗口，每帧输入两个字符，光标闪烁
+            line, col = divmod(index * 2, self.cols)
+            line %= self.rows
+            if index and line == 0 and col < 2:
+                self.clear_page()  # 写满一页后清空
+            codes = self.random_codes(1, 2)
+            count = min(2, self.cols - col)
+            self.codes[line, col:col + count] = codes[0, :count]
+            top = y + line * LINE_HEIGHT
+            left = x + col * GLYPH_WIDTH
+            self.base[top:top + LINE_HEIGHT, left:left + count * GLYPH_WIDTH] = \
+                render_text(self.glyphs, codes[:, :count], INK, PAPER)
+            frame = self.base.copy()
+            if index % 30 < 15:
+                cx = x + min(col + 2, self.cols - 1) * GLYPH_WIDTH
+                frame[top:top + GLYPH_HEIGHT, cx:cx + 2] = INK
+            return frame
+
+        frame = self.desktop.copy()
+        if self.scene == SCENE_SCROLLING:
+            # 每帧向下滚动4像素，到底后回到开头
+            doc_h, doc_w = self.document.shape[:2]
+            top = (index * 4) % (doc_h - h)
+            frame[y:y + h, x:x + doc_w] = self.document[top:top + h]
+        elif self.scene == SCENE_VIDEO:
+            dx = index % 8
+            dy = (index // 2) % 8
+            region = frame[y:y + h, x:x + w]
+            # 平移的同时亮度随时间变化，每帧所有像素都不同
+            np.add(self.video[dy:dy + h, dx:dx + w], np.uint8(index % 7), out=region)
+        return frame
+
@@ -0,0 +1,38 @@
+import threading
+from injector import InputInjector
+
+
+class RecordingBackend:
+    name = 'recording'
+
+    def __init__(self):
+        self.calls = []
+        self.done = threading.Event()
+
+    def click(self, x, y, button):
+        self.calls.append(('click', x, y, button))
+        self.done.set()
+
+    def move(self, x, y):
+        self.calls.append(('move', x, y))
+
+    def key_press(self, key):
+        self.calls.append(('key_press', key))
+
+    def key_release(self, key):
+        self.calls.append(('key_release', key))
+
+
+def test_malformed_commands_do_not_stop_injector():
+    backend = RecordingBackend()
+    injector = InputInjector(backend)
+    injector.start()
+    try:
+        for command in ({}, [], 'click', None, {'type': 3}, {'type': 'mouse_click'}):
+            injector.submit(command)
+        injector.submit({'type': 'mouse_click', 'x': 1, 'y': 2})
+        assert backend.done.wait(2)
+        assert injector.thread.is_alive()
+        assert backend.calls == [('click', 1, 2, 'left')]
+    finally:
+        injector.stop()
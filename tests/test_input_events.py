@@ -0,0 +1,22 @@
+from input_events import (EV_KEY_PRESS, EV_KEY_RELEASE, EV_MOUSE_CLICK, EV_MOUSE_MOVE,
+                          decode_events, encode_event)
+
+
+def test_decode_round_trip():
+    payload = (encode_event(EV_MOUSE_MOVE, 10, 20)
+               + encode_event(EV_MOUSE_CLICK, 3, 4, detail=1)
+               + encode_event(EV_KEY_PRESS, ord('a'))
+               + encode_event(EV_KEY_RELEASE, ord('a')))
+    assert list(decode_events(payload)) == [
+        {'type': 'mouse_move', 'x': 10, 'y': 20},
+        {'type': 'mouse_click', 'x': 3, 'y': 4, 'button': 'right'},
+        {'type': 'key_press', 'key': 'a'},
+        {'type': 'key_release', 'key': 'a'},
+    ]
+
+
+def test_invalid_codepoint_skips_only_that_event():
+    payload = (encode_event(EV_KEY_PRESS, -5)
+               + encode_event(EV_KEY_RELEASE, 0x110000)
+               + encode_event(EV_KEY_PRESS, ord('b')))
+    assert list(decode_events(payload)) == [{'type': 'key_press', 'key': 'b'}]
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from codec import RawCodec
+from pixel_format import PIXEL_YUV420, bgrx_to_rgb, to_yuv420, yuv420_size, yuv420_to_bgrx
+from tiles import apply_frame, encode_rects
+
+
+def bgrx(height, width, seed=0):
+    pixels = np.random.default_rng(seed).integers(0, 256, (height, width, 4), dtype=np.uint8)
+    pixels[..., 3] = 255
+    return pixels
+
+
+@pytest.mark.parametrize('width, height', [(64, 64), (33, 17), (1, 1), (7, 2)])
+def test_gray_round_trip(width, height):
+    # 黑白灰画面的色度为零，往返后只有取整误差
+    gray = np.random.default_rng(1).integers(0, 256, (height, width), dtype=np.uint8)
+    pixels = np.repeat(gray[..., None], 4, axis=2)
+    pixels[..., 3] = 255
+    planes = to_yuv420(pixels)
+    assert planes.shape == (yuv420_size(width, height),)
+    restored = yuv420_to_bgrx(planes, width, height)
+    assert np.abs(restored.astype(int) - pixels).max() <= 1
+
+
+def test_flat_color_round_trip():
+    pixels = np.empty((16, 16, 4), dtype=np.uint8)
+    pixels[...] = (200, 100, 30, 255)
+    restored = yuv420_to_bgrx(to_yuv420(pixels), 16, 16)
+    assert np.abs(restored.astype(int) - pixels).max() <= 2
+
+
+def test_rgb_and_bgrx_inputs_match():
+    pixels = bgrx(9, 13)
+    assert np.array_equal(to_yuv420(pixels), to_yuv420(bgrx_to_rgb(pixels)))
+
+
+def test_out_arguments():
+    pixels = bgrx(10, 12)
+    out = np.zeros(yuv420_size(12, 10), dtype=np.uint8)
+    assert to_yuv420(pixels, out) is out
+    framebuffer = np.zeros((20, 20, 4), dtype=np.uint8)
+    yuv420_to_bgrx(out, 12, 10, framebuffer[5:15, 3:15])
+    assert np.array_equal(framebuffer[5:15, 3:15], yuv420_to_bgrx(out, 12, 10))
+    assert not framebuffer[:5].any() and not framebuffer[:, :3].any()
+
+
+def test_frame_round_trip():
+    # 矩形按yuv420编码后，接收端还原到bgrx32帧缓冲的对应区域
+    frame = np.zeros((40, 50, 4), dtype=np.uint8)
+    frame[..., 3] = 255
+    frame[5:20, 7:30, :3] = 128
+    rects = [(7, 5, 23, 15), (0, 0, 3, 3)]
+    payload = b''.join(encode_rects(frame, rects, RawCodec(), 0, pixel_format=PIXEL_YUV420))
+    framebuffer = np.zeros_like(frame)
+    _, applied = apply_frame(framebuffer, payload)
+    assert applied == rects
+    for x, y, w, h in rects:
+        assert np.abs(framebuffer[y:y + h, x:x + w].astype(int) - frame[y:y + h, x:x + w]).max() <= 1
@@ -0,0 +1,94 @@
+import pytest
+from protocol import (ChunkAssembler, MessageReader, ProtocolError, FLAG_KEYFRAME, FLAG_MORE, HEADER_SIZE,
+                      MSG_FRAME, MSG_INPUT, MSG_PING, PROTOCOL_VERSION, HEADER, as_views, pack_message,
+                      split_chunks)
+
+
+def read_all(reader):
+    # 交出的切片只在下一次读取之前有效，测试中立即拷贝
+    return [(msg_type, flags, bytes(payload)) for msg_type, flags, payload in reader.messages()]
+
+
+def test_reader_partial_reads():
+    stream = (pack_message(MSG_PING) + pack_message(MSG_FRAME, b'x' * 100, FLAG_KEYFRAME)
+              + pack_message(MSG_INPUT, b'ab'))
+    reader = MessageReader(capacity=64)
+    received = []
+    for i in range(len(stream)):
+        reader.feed(stream[i:i + 1])
+        received += read_all(reader)
+    assert received == [(MSG_PING, 0, b''), (MSG_FRAME, FLAG_KEYFRAME, b'x' * 100), (MSG_INPUT, 0, b'ab')]
+    assert reader.pending() == 0
+
+
+def test_reader_grows_for_large_message():
+    payload = bytes(range(256)) * 64
+    reader = MessageReader(capacity=32)
+    reader.feed(pack_message(MSG_INPUT, b'a'))
+    message = pack_message(MSG_FRAME, payload)
+    reader.feed(message[:HEADER_SIZE + 10])
+    assert read_all(reader) == [(MSG_INPUT, 0, b'a')]
+    # 头部已到达，下一次取缓冲区时为整条消息预留空间
+    buffer = reader.get_buffer()
+    rest = message[HEADER_SIZE + 10:]
+    buffer[:len(rest)] = rest
+    reader.buffer_updated(len(rest))
+    assert read_all(reader) == [(MSG_FRAME, 0, payload)]
+
+
+def test_reader_rejects_oversized_message():
+    reader = MessageReader(capacity=64, max_message_size=1000)
+    reader.feed(HEADER.pack(PROTOCOL_VERSION, MSG_FRAME, 0, 1001))
+    with pytest.raises(ProtocolError):
+        read_all(reader)
+
+
+def test_reader_rejects_unknown_version():
+    reader = MessageReader(capacity=64)
+    reader.feed(HEADER.pack(PROTOCOL_VERSION + 1, MSG_PING, 0, 0))
+    with pytest.raises(ProtocolError):
+        read_all(reader)
+
+
+def feed_chunks(assembler, data, chunk_size, flags=FLAG_KEYFRAME):
+    chunks = [b''.join(chunk) for chunk in split_chunks(as_views(data), chunk_size)]
+    for chunk in chunks[:-1]:
+        assert assembler.feed(MSG_FRAME, flags | FLAG_MORE, chunk) is None
+    return assembler.feed(MSG_FRAME, flags, chunks[-1])
+
+
+def test_chunks_reassemble_with_growth():
+    assembler = ChunkAssembler(capacity=16)
+    data = bytes(range(256)) * 4
+    flags, payload = feed_chunks(assembler, data, 100)
+    assert flags == FLAG_KEYFRAME
+    assert bytes(payload) == data
+
+
+def test_buffer_reused_between_messages():
+    assembler = ChunkAssembler(capacity=64)
+    assert bytes(feed_chunks(assembler, b'a' * 50, 20)[1]) == b'a' * 50
+    assert bytes(feed_chunks(assembler, b'b' * 30, 20)[1]) == b'b' * 30
+
+
+def test_unchunked_messages_pass_through_between_chunks():
+    assembler = ChunkAssembler()
+    assert assembler.feed(MSG_FRAME, FLAG_MORE, b'abc') is None
+    event = b'input'
+    assert assembler.feed(MSG_INPUT, 0, event) == (0, event)
+    flags, payload = assembler.feed(MSG_FRAME, 0, b'def')
+    assert bytes(payload) == b'abcdef'
+
+
+def test_interleaved_chunk_types_rejected():
+    assembler = ChunkAssembler()
+    assembler.feed(MSG_FRAME, FLAG_MORE, b'abc')
+    with pytest.raises(ProtocolError):
+        assembler.feed(MSG_INPUT, FLAG_MORE, b'x')
+
+
+def test_oversized_message_rejected():
+    assembler = ChunkAssembler(max_message_size=10, capacity=4)
+    assembler.feed(MSG_FRAME, FLAG_MORE, b'12345678')
+    with pytest.raises(ProtocolError):
+        assembler.feed(MSG_FRAME, 0, b'abc')
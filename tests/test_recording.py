@@ -0,0 +1,69 @@
+import glob
+import asyncio
+import threading
+import time
+import numpy as np
+import pytest
+from capture import CaptureHub
+from client_core import RemoteClient
+from protocol import FLAG_KEYFRAME
+from recording import REC_FRAME, REC_INPUT, RecordingPlayer, SessionRecorder
+from server_core import RemoteDesktopServer
+from synthetic import SyntheticSource
+
+
+@pytest.mark.parametrize('transport', ['tcp', 'udp', 'shm'])
+def test_recording_has_frames(tmp_path, transport):
+    # 各种画面传输方式下录制文件都以关键帧开始，且最后的画面与服务器一致
+    server = RemoteDesktopServer('127.0.0.1', 0, record_dir=str(tmp_path))
+    server_thread = threading.Thread(target=lambda: asyncio.run(server.serve()))
+    server_thread.start()
+    assert server.started.wait(5)
+    hub = CaptureHub(source=SyntheticSource('typing', (320, 240)))
+    client = RemoteClient('127.0.0.1', server.port, hub, 'zlib', target_size=None, adaptive=False,
+                          capture_input=False, transport=transport)
+    client_thread = threading.Thread(target=client.run)
+    client_thread.start()
+    try:
+        time.sleep(2)
+        assert client.session['transport'] == transport
+    finally:
+        client.stop()
+        client_thread.join()
+        hub.stop()
+        time.sleep(0.5)  # 等服务器处理完已到达的帧
+        last = server.framebuffer.copy()
+        server.stop()
+        server_thread.join()
+
+    player = RecordingPlayer(glob.glob(str(tmp_path / '*.rec'))[0])
+    try:
+        frames = [flags for _, rec_type, flags, _, _ in player.records() if rec_type == REC_FRAME]
+        assert len(frames) > 10
+        assert frames[0] & FLAG_KEYFRAME
+        assert len(player.index) >= 1
+        framebuffer = None
+        for _, framebuffer in player.frames():
+            pass
+        assert np.array_equal(framebuffer, last)
+    finally:
+        player.close()
+
+
+def test_stop_does_not_block_on_full_queue(tmp_path):
+    # 队列满时stop不阻塞，录制线程写完剩余记录后退出
+    recorder = SessionRecorder(str(tmp_path / 'full.rec'), max_queue=2)
+    recorder.record_input(REC_INPUT, b'a')
+    recorder.record_input(REC_INPUT, b'b')
+    assert recorder.queue.full()
+    recorder.stop()
+    recorder.start()
+    recorder.thread.join(5)
+    assert not recorder.thread.is_alive()
+
+    player = RecordingPlayer(recorder.path)
+    try:
+        inputs = [rec_type for _, rec_type, _, _, _ in player.records()]
+        assert inputs == [REC_INPUT, REC_INPUT]
+    finally:
+        player.close()
@@ -0,0 +1,17 @@
+import numpy as np
+from scaler import scale_fast
+
+
+def test_fast_halving_is_area_average():
+    # 2:1时fast为精确的2x2面积平均（逐次向下取整，误差不超过1）
+    pixels = np.random.default_rng(0).integers(0, 256, (16, 24, 4), dtype=np.uint8)
+    result = scale_fast(pixels, (12, 8)).astype(int)
+    mean = pixels.reshape(8, 2, 12, 2, 4).mean(axis=(1, 3))
+    assert np.abs(result - mean).max() <= 1
+
+
+def test_fast_flat_color_preserved():
+    pixels = np.full((2160, 3840, 4), (10, 20, 30, 255), dtype=np.uint8)
+    result = scale_fast(pixels, (800, 600))
+    assert result.shape == (600, 800, 4)
+    assert (result == (10, 20, 30, 255)).all()
@@ -0,0 +1,61 @@
+import numpy as np
+from scroll import apply_copy, find_copy
+
+
+def random_frame(height, width, seed):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 4), dtype=np.uint8)
+
+
+def check_copy(previous, frame, copy):
+    # 复制后的目标区域必须与新画面逐像素一致
+    sx, sy, w, h, dx, dy = copy
+    result = previous.copy()
+    apply_copy(result, copy)
+    assert np.array_equal(result[dy:dy + h, dx:dx + w], frame[dy:dy + h, dx:dx + w])
+
+
+def test_vertical_scroll():
+    previous = random_frame(200, 160, 0)
+    frame = previous.copy()
+    frame[20:150] = previous[50:180]  # 区域内向上滚动30行，底部露出新内容
+    frame[150:180] = random_frame(30, 160, 1)
+    copy = find_copy(previous, frame, (0, 20, 160, 180), 0)
+    assert copy == (0, 50, 160, 130, 0, 20)
+    check_copy(previous, frame, copy)
+
+
+def test_horizontal_scroll():
+    previous = random_frame(120, 240, 2)
+    frame = previous.copy()
+    frame[:, 60:240] = previous[:, 0:180]  # 向右移动60列
+    frame[:, :60] = random_frame(120, 60, 3)
+    copy = find_copy(previous, frame, (0, 0, 240, 120), 1)
+    assert copy == (0, 0, 180, 120, 60, 0)
+    check_copy(previous, frame, copy)
+
+
+def test_rgb_frames():
+    previous = random_frame(100, 50, 4)[..., :3].copy()
+    frame = np.roll(previous, -20, axis=0)
+    copy = find_copy(previous, frame, (0, 0, 50, 100), 0)
+    assert copy == (0, 20, 50, 80, 0, 0)
+    check_copy(previous, frame, copy)
+
+
+def test_unrelated_change_has_no_copy():
+    previous = random_frame(100, 100, 5)
+    assert find_copy(previous, random_frame(100, 100, 6), (0, 0, 100, 100), 0) is None
+
+
+def test_repeated_lines_have_no_copy():
+    # 空白行无法确定位置，不生成复制指令
+    previous = np.zeros((100, 100, 4), dtype=np.uint8)
+    frame = previous.copy()
+    frame[90:] = 255
+    assert find_copy(previous, frame, (0, 0, 100, 100), 0) is None
+
+
+def test_small_region_has_no_copy():
+    previous = random_frame(20, 100, 7)
+    frame = np.roll(previous, -5, axis=0)
+    assert find_copy(previous, frame, (0, 0, 100, 20), 0) is None
@@ -0,0 +1,286 @@
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from codec import RawCodec, DEFAULT_QUALITY, get_codec
+from pixel_format import (BYTES_PER_PIXEL, FORMAT_IDS, FORMAT_NAMES, PIXEL_YUV420, format_of, to_yuv420,
+                          yuv420_size, yuv420_to_bgrx)
+from scroll import find_copy, apply_copy
+
+TILE_SIZE = 64
+SCROLL_MIN_TILES = 8  # 变化的块数不少于此值时才检测滚动
+
+# 帧负载头: 宽 高 像素格式编号 编解码器编号 复制指令数量 矩形数量 帧序号 抓取至发送的耗时（微秒）
+# 之后依次是复制指令（先于矩形执行）和矩形
+FRAME_HEADER = struct.Struct('!HHBBHHII')
+# 复制指令: 源x 源y 宽 高 目标x 目标y（帧缓冲内移动像素，用于滚动和窗口拖动）
+COPY_HEADER = struct.Struct('!HHHHHH')
+# 矩形头: x y 宽 高 数据长度
+RECT_HEADER = struct.Struct('!HHHHI')
+
+
+class TileEncoder:
+    # max_rect_tiles: 每个矩形最多包含的块数（数据报传输时限制单个矩形的大小，丢包只影响少量块）
+    # pool: 原始编码拷贝区域时使用的BufferPool，发送完成后由调用方release(负载分段)
+    # pixel_format: 传输的像素格式，默认与画面相同；为yuv420时画面须为bgrx32或rgb24，编码时逐矩形转换
+    def __init__(self, tile_size=TILE_SIZE, codec=None, quality=DEFAULT_QUALITY, workers=1, detect_scroll=True,
+                 max_rect_tiles=None, pool=None, pixel_format=None):
+        self.tile_size = tile_size
+        self.pixel_format = pixel_format
+        self.detect_scroll = detect_scroll
+        self.max_rect_tiles = max_rect_tiles
+        self.pool = pool
+        self.codec = codec or RawCodec()
+        self.quality = quality
+        # 多个矩形用线程池并行编码，zlib和Pillow编码时会释放GIL
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="TileEncoder") if workers > 1 else None
+        self.previous = None
+        self.changed = None  # 逐字节变化位图和按块补齐后的位图，尺寸不变时每帧复用，不重新分配
+        self.padded = None
+        self.keyframe_requested = True
+        self.refresh_lock = threading.Lock()
+        self.refresh_rects = []  # 接收端要求重发的区域，下一帧无论是否变化都编码
+
+    def request_keyframe(self):
+        self.keyframe_requested = True
+
+    def refresh(self, rects):
+        # 可从其他线程调用
+        with self.refresh_lock:
+            self.refresh_rects.extend(rects)
+
+    def needs_update(self):
+        # 画面无变化时是否仍需编码一帧（关键帧或重发请求）
+        return self.keyframe_requested or bool(self.refresh_rects)
+
+    def take_refresh(self):
+        with self.refresh_lock:
+            rects, self.refresh_rects = self.refresh_rects, []
+        return rects
+
+    def dirty_tiles(self, frame):
+        # 按块比较当前帧与上一帧，返回 (脏块位图, 逐字节变化位图)
+        height, width = frame.shape[:2]
+        ts = self.tile_size
+        rows = -(-height // ts)
+        cols = -(-width // ts)
+
+        # 以字节行比较，避免按像素通道再做一次归约
+        bpp = frame.shape[2]
+        if self.changed is None or self.changed.shape != (height, width * bpp):
+            self.changed = np.empty((height, width * bpp), dtype=bool)
+            self.padded = np.zeros((rows * ts, cols * ts * bpp), dtype=bool)  # 补齐的部分始终为False
+        changed = self.changed
+        np.not_equal(frame.reshape(height, -1), self.previous.reshape(height, -1), out=changed)
+        self.padded[:height, :width * bpp] = changed
+        dirty = self.padded.reshape(rows, ts, cols, ts * bpp).any(axis=(1, 3))
+        return dirty, changed
+
+    def find_copies(self, frame, changed):
+        # 变化区域较大时检测滚动（先竖直后水平），找到后把上一帧按复制指令移动，
+        # 之后只需发送与移动后的上一帧不同的部分（新露出的条带）
+        bpp = frame.shape[2]
+        changed_rows = np.flatnonzero(changed.any(axis=1))
+        changed_cols = np.flatnonzero(changed.any(axis=0)) // bpp
+        box = (changed_cols[0], changed_rows[0], changed_cols[-1] + 1, changed_rows[-1] + 1)
+        for axis in (0, 1):
+            copy = find_copy(self.previous, frame, box, axis)
+            if copy:
+                apply_copy(self.previous, copy)
+                return [copy]
+        return []
+
+    def encode(self, frame):
+        # frame: (高, 宽, 通道) 的uint8数组，通道数决定像素格式
+        # 返回 (是否关键帧, 负载分段列表)；画面无变化时负载为None
+        keyframe, copies, rects = self.diff(frame)
+        if rects is None:
+            return False, None
+        return keyframe, encode_rects(frame, rects, self.codec, self.quality, self.executor, copies=copies,
+                                      pool=self.pool, pixel_format=self.pixel_format)
+
+    def diff(self, frame):
+        # 与上一帧比较并更新上一帧，不编码；返回 (是否关键帧, 复制指令, 变化的矩形)，画面无变化时矩形为None
+        height, width = frame.shape[:2]
+        keyframe = (self.keyframe_requested or self.previous is None
+                    or self.previous.shape != frame.shape)
+        copies = []
+        if keyframe:
+            rects = self.keyframe_rects(width, height)
+            self.previous = frame.copy()
+            self.keyframe_requested = False
+            self.take_refresh()
+        else:
+            dirty, changed = self.dirty_tiles(frame)
+            if self.detect_scroll and np.count_nonzero(dirty) >= SCROLL_MIN_TILES:
+                copies = self.find_copies(frame, changed)
+                if copies:
+                    dirty, changed = self.dirty_tiles(frame)
+            ts = self.tile_size
+            for x, y, w, h in self.take_refresh():
+                dirty[y // ts:-(-(y + h) // ts), x // ts:-(-(x + w) // ts)] = True
+            if not dirty.any():
+                return False, [], None
+            rects = tiles_to_rects(dirty, self.tile_size, width, height, self.max_rect_tiles)
+            np.copyto(self.previous, frame)
+        return keyframe, copies, rects
+
+    def keepalive(self):
+        # 画面无变化时发送的空帧（0个矩形，尺寸和格式与上一帧相同）；尚未编码过画面时返回None
+        if self.previous is None:
+            return None
+        return encode_rects(self.previous, [], self.codec, self.quality, pixel_format=self.pixel_format)
+
+    def keyframe_rects(self, width, height):
+        # 关键帧按线程数切成横条，以便并行编码；限制了矩形大小时按块切分
+        if self.max_rect_tiles:
+            ts = self.tile_size
+            dirty = np.ones((-(-height // ts), -(-width // ts)), dtype=bool)
+            return tiles_to_rects(dirty, ts, width, height, self.max_rect_tiles)
+        if self.executor is None or self.codec.codec_id == RawCodec.codec_id:
+            return [(0, 0, width, height)]
+        tile_rows = -(-height // self.tile_size)
+        band = -(-tile_rows // self.workers) * self.tile_size
+        return [(0, y, width, min(band, height - y)) for y in range(0, height, band)]
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=False)
+
+
+def tiles_to_rects(dirty, tile_size, width, height, max_tiles=None):
+    # 脏块位图 (行, 列) 转为矩形列表，同一行相邻的脏块合并为一个矩形（最多max_tiles块）
+    rows, cols = dirty.shape
+    rects = []
+    for row in np.flatnonzero(dirty.any(axis=1)):
+        y = row * tile_size
+        h = min(tile_size, height - y)
+        line = dirty[row]
+        col = 0
+        while col < cols:
+            if not line[col]:
+                col += 1
+                continue
+            start = col
+            while col < cols and line[col] and (not max_tiles or col - start < max_tiles):
+                col += 1
+            x = start * tile_size
+            rects.append((x, y, min(col * tile_size, width) - x, h))
+    return rects
+
+
+def encode_rects(frame, rects, codec, quality, executor=None, seq=0, latency_us=0, copies=(), pool=None,
+                 pixel_format=None):
+    # 按帧负载格式编码frame中的指定矩形（接收端先执行copies中的复制指令），返回负载分段列表
+    # 分段可能引用frame或pool中的内存，发送前不能修改
+    # pixel_format为yuv420时矩形先转为平面数据再编码（只支持planar的编解码器）
+    height, width = frame.shape[:2]
+    pixel_format = pixel_format or format_of(frame)
+    planar = pixel_format == PIXEL_YUV420
+    if planar and not codec.planar:
+        raise ValueError(f"编解码器 {codec.name} 不支持 {pixel_format}")
+
+    def encode(rect):
+        x, y, w, h = rect
+        if planar:
+            if pool is not None and codec.codec_id == RawCodec.codec_id:
+                # 原始编码直接转换到池中的缓冲区，不再拷贝
+                out = pool.acquire(yuv420_size(w, h))
+                to_yuv420(frame[y:y + h, x:x + w], np.frombuffer(out, dtype=np.uint8))
+                return out
+            return codec.encode(to_yuv420(frame[y:y + h, x:x + w]), quality)
+        if pool is not None and codec.codec_id == RawCodec.codec_id:
+            return codec.encode(frame[y:y + h, x:x + w], quality, pool)
+        return codec.encode(frame[y:y + h, x:x + w], quality)
+
+    if executor is not None and len(rects) > 1 and codec.codec_id != RawCodec.codec_id:
+        encoded = list(executor.map(encode, rects))
+    else:
+        encoded = [encode(rect) for rect in rects]
+
+    format_id = FORMAT_IDS[pixel_format]
+    parts = [FRAME_HEADER.pack(width, height, format_id, codec.codec_id, len(copies), len(rects), seq, latency_us)]
+    for copy in copies:
+        parts.append(COPY_HEADER.pack(*copy))
+    for (x, y, w, h), data in zip(rects, encoded):
+        parts.append(RECT_HEADER.pack(x, y, w, h, len(data)))
+        parts.append(data)
+    return parts
+
+
+class DirtyRegion:
+    # 累积多帧的变化区域（按块记录），用于合并来不及发送的帧
+    def __init__(self, tile_size=TILE_SIZE):
+        self.tile_size = tile_size
+        self.size = None  # (宽, 高)
+        self.tiles = None
+
+    def reset(self, width, height):
+        ts = self.tile_size
+        self.size = (width, height)
+        self.tiles = np.ones((-(-height // ts), -(-width // ts)), dtype=bool)
+
+    def mark(self, rects):
+        ts = self.tile_size
+        for x, y, w, h in rects:
+            self.tiles[y // ts:-(-(y + h) // ts), x // ts:-(-(x + w) // ts)] = True
+
+    def is_dirty(self):
+        return self.tiles is not None and self.tiles.any()
+
+    def take(self):
+        # 取出累积的矩形并清空
+        rects = tiles_to_rects(self.tiles, self.tile_size, *self.size)
+        self.tiles[:] = False
+        return rects
+
+
+def stamp_frame(parts, seq, latency_us):
+    # 发送前写入帧序号和抓取至发送的耗时（编码时还不知道排队和发送耗时）
+    fields = FRAME_HEADER.unpack(parts[0])
+    parts[0] = FRAME_HEADER.pack(*fields[:6], seq & 0xFFFFFFFF, min(int(latency_us), 0xFFFFFFFF))
+    return parts
+
+
+def parse_frame_header(payload):
+    # 返回 (宽, 高, 像素格式)
+    width, height, format_id = FRAME_HEADER.unpack_from(payload, 0)[:3]
+    return width, height, FORMAT_NAMES[format_id]
+
+
+def parse_frame_timing(payload):
+    # 返回 (帧序号, 抓取至发送的耗时（微秒）)
+    return FRAME_HEADER.unpack_from(payload, 0)[6:]
+
+
+def apply_frame(framebuffer, payload):
+    # 将帧负载中的复制指令和矩形依次作用于framebuffer（(高, 宽, 通道) 数组，像素格式须与帧一致）
+    # 返回 (复制指令列表, 更新的矩形列表)
+    _, _, format_id, codec_id, copy_count, count = FRAME_HEADER.unpack_from(payload, 0)[:6]
+    codec = get_codec(codec_id)
+    planar = FORMAT_NAMES[format_id] == PIXEL_YUV420
+    channels = BYTES_PER_PIXEL[FORMAT_NAMES[format_id]]
+    if framebuffer.shape[2] != channels:
+        raise ValueError(f"帧缓冲像素格式不匹配: {FORMAT_NAMES[format_id]}")
+    offset = FRAME_HEADER.size
+    copies = []
+    for _ in range(copy_count):
+        copy = COPY_HEADER.unpack_from(payload, offset)
+        offset += COPY_HEADER.size
+        apply_copy(framebuffer, copy)
+        copies.append(copy)
+    rects = []
+    for _ in range(count):
+        x, y, w, h, length = RECT_HEADER.unpack_from(payload, offset)
+        offset += RECT_HEADER.size
+        data = payload[offset:offset + length]
+        if planar:
+            # 平面数据按一维解码，直接还原到帧缓冲的对应区域
+            planes = codec.decode(data, yuv420_size(w, h), 1, 1).reshape(-1)
+            yuv420_to_bgrx(planes, w, h, framebuffer[y:y + h, x:x + w])
+        else:
+            framebuffer[y:y + h, x:x + w] = codec.decode(data, w, h, channels)
+        offset += length
+        rects.append((x, y, w, h))
+    return copies, rects
@@ -0,0 +1,234 @@
+import sys
+import socket
+import logging
+import select
+import threading
+import time
+import numpy as np
+from PyQt6.QtWidgets import (QApplication, QMainWindow, QLabel, QVBoxLayout,
+                            QWidget, QLineEdit, QPushButton, QMessageBox,
+                            QHBoxLayout, QComboBox)
+from PyQt6.QtCore import Qt, QThread, pyqtSignal
+from PyQt6.QtGui import QImage, QPixmap
+from protocol import (MessageReader, handshake, send_message, MSG_FRAME, MSG_PING,
+                      MSG_INPUT, FLAG_KEYFRAME, ROLE_OPERATOR, ROLE_VIEWER)
+from codec import DEFAULT_QUALITY, available_codecs
+from congestion import PING
+from input_events import encode_event, EV_MOUSE_CLICK, EV_KEY_PRESS
+from pixel_format import BYTES_PER_PIXEL
+from tiles import apply_frame, parse_frame_header
+from display import framebuffer_to_qimage
+from log_config import setup_logging
+
+
+# 配置日志（后台线程写入，文件按大小轮转）
+setup_logging('viewer.log')
+logger = logging.getLogger(__name__)
+
+class ViewerThread(QThread):
+    status_signal = pyqtSignal(str)
+    error_signal = pyqtSignal(str)
+    frame_ready = pyqtSignal(QImage)
+
+    def __init__(self, host, port, role=ROLE_VIEWER, codec='raw', quality=DEFAULT_QUALITY):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.role = role
+        self.codec = codec
+        self.quality = quality
+        self.running = True
+        self.socket = None
+        self.send_lock = threading.Lock()  # 心跳与界面线程的输入命令共用socket
+        self.reader = MessageReader()
+        self.framebuffer = None
+        self.heartbeat_interval = 1
+        self.last_ping_time = 0
+
+    def run(self):
+        try:
+            logger.info(f"正在连接到服务器 {self.host}:{self.port}")
+            self.socket = socket.create_connection((self.host, self.port), timeout=5)
+            hello = {'role': self.role, 'codecs': available_codecs(),
+                     'codec': self.codec, 'quality': self.quality}
+            session = handshake(self.socket, hello, self.reader)
+            self.socket.settimeout(None)
+            self.status_signal.emit(f"已连接到服务器 ({session['role']})")
+            logger.info(f"会话参数: 角色={session['role']}, 编解码器={session['codec']}")
+
+            while self.running:
+                now = time.monotonic()
+                if now - self.last_ping_time >= self.heartbeat_interval:
+                    self.send(MSG_PING, PING.pack(now))
+                    self.last_ping_time = now
+                timeout = self.last_ping_time + self.heartbeat_interval - now
+                readable, _, _ = select.select([self.socket], [], [], max(0, timeout))
+                if not readable:
+                    continue
+                if self.reader.recv_from(self.socket) == 0:
+                    raise ConnectionError("连接已断开")
+                for msg_type, flags, payload in self.reader.messages():
+                    if msg_type == MSG_FRAME:
+                        self.process_frame(payload, flags)
+
+        except Exception as e:
+            if self.running:
+                error_msg = f"观看连接错误: {str(e)}"
+                logger.error(error_msg)
+                self.error_signal.emit(error_msg)
+        finally:
+            self.stop()
+
+    def process_frame(self, payload, flags):
+        width, height, pixel_format = parse_frame_header(payload)
+        shape = (height, width, BYTES_PER_PIXEL[pixel_format])
+        if self.framebuffer is None or self.framebuffer.shape != shape:
+            if not flags & FLAG_KEYFRAME:
+                return  # 等待关键帧
+            self.framebuffer = np.zeros(shape, dtype=np.uint8)
+        apply_frame(self.framebuffer, payload)
+        self.frame_ready.emit(framebuffer_to_qimage(self.framebuffer).copy())
+
+    def send(self, msg_type, payload=b''):
+        with self.send_lock:
+            send_message(self.socket, msg_type, payload)
+
+    def send_input(self, event_type, a=0, b=0):
+        if self.role != ROLE_OPERATOR or not self.socket:
+            return
+        try:
+            self.send(MSG_INPUT, encode_event(event_type, a, b))
+        except Exception as e:
+            logger.error(f"发送命令错误: {str(e)}")
+
+    def stop(self):
+        self.running = False
+        if self.socket:
+            try:
+                self.socket.close()
+            except:
+                pass
+            self.socket = None
+        logger.info("观看连接已停止")
+
+class ScreenLabel(QLabel):
+    # 把点击位置换算为远程画面坐标
+    clicked = pyqtSignal(int, int)
+
+    def __init__(self):
+        super().__init__()
+        self.frame_size = None
+
+    def mousePressEvent(self, event):
+        pixmap = self.pixmap()
+        if pixmap is None or pixmap.isNull() or self.frame_size is None:
+            return
+        offset_x = (self.width() - pixmap.width()) / 2
+        offset_y = (self.height() - pixmap.height()) / 2
+        x = (event.position().x() - offset_x) * self.frame_size[0] / pixmap.width()
+        y = (event.position().y() - offset_y) * self.frame_size[1] / pixmap.height()
+        if 0 <= x < self.frame_size[0] and 0 <= y < self.frame_size[1]:
+            self.clicked.emit(int(x), int(y))
+
+class ViewerWindow(QMainWindow):
+    def __init__(self):
+        super().__init__()
+        self.setWindowTitle("远程画面观看")
+        self.setGeometry(100, 100, 900, 700)
+
+        central_widget = QWidget()
+        self.setCentralWidget(central_widget)
+        layout = QVBoxLayout(central_widget)
+
+        # 连接控制区域
+        control_layout = QHBoxLayout()
+        self.host_input = QLineEdit()
+        self.host_input.setPlaceholderText("服务器IP地址")
+        self.host_input.setText("localhost")
+        control_layout.addWidget(self.host_input)
+
+        self.role_input = QComboBox()
+        self.role_input.addItem("只读观看", ROLE_VIEWER)
+        self.role_input.addItem("可操作", ROLE_OPERATOR)
+        control_layout.addWidget(self.role_input)
+
+        self.codec_input = QComboBox()
+        self.codec_input.addItems(available_codecs())
+        control_layout.addWidget(self.codec_input)
+
+        self.connect_button = QPushButton("连接到服务器")
+        self.connect_button.clicked.connect(self.toggle_connection)
+        control_layout.addWidget(self.connect_button)
+
+        self.status_label = QLabel("未连接")
+        self.status_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        control_layout.addWidget(self.status_label)
+        layout.addLayout(control_layout)
+
+        # 远程画面
+        self.screen = ScreenLabel()
+        self.screen.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.screen.setMinimumSize(800, 600)
+        self.screen.setStyleSheet("border: 1px solid black;")
+        self.screen.clicked.connect(self.handle_click)
+        layout.addWidget(self.screen)
+
+        self.viewer_thread = None
+        logger.info("观看界面初始化完成")
+
+    def toggle_connection(self):
+        if self.viewer_thread is None:
+            host = self.host_input.text()
+            self.viewer_thread = ViewerThread(host, 5000, self.role_input.currentData(),
+                                              self.codec_input.currentText())
+            self.viewer_thread.status_signal.connect(self.update_status)
+            self.viewer_thread.error_signal.connect(self.show_error)
+            self.viewer_thread.frame_ready.connect(self.update_screen)
+            self.viewer_thread.finished.connect(self.handle_finished)
+            self.viewer_thread.start()
+            self.connect_button.setText("断开连接")
+        else:
+            self.viewer_thread.stop()
+
+    def handle_finished(self):
+        self.viewer_thread = None
+        self.connect_button.setText("连接到服务器")
+        self.status_label.setText("未连接")
+        self.screen.clear()
+
+    def update_screen(self, qimg):
+        self.screen.frame_size = (qimg.width(), qimg.height())
+        pixmap = QPixmap.fromImage(qimg).scaled(
+            self.screen.size(), Qt.AspectRatioMode.KeepAspectRatio,
+            Qt.TransformationMode.FastTransformation)
+        self.screen.setPixmap(pixmap)
+
+    def handle_click(self, x, y):
+        if self.viewer_thread:
+            self.viewer_thread.send_input(EV_MOUSE_CLICK, x, y)
+
+    def keyPressEvent(self, event):
+        if self.viewer_thread and event.text():
+            self.viewer_thread.send_input(EV_KEY_PRESS, ord(event.text()[0]))
+        super().keyPressEvent(event)
+
+    def update_status(self, message):
+        self.status_label.setText(message)
+        logger.info(f"状态更新: {message}")
+
+    def show_error(self, message):
+        QMessageBox.critical(self, "错误", message)
+
+    def closeEvent(self, event):
+        if self.viewer_thread:
+            self.viewer_thread.stop()
+            self.viewer_thread.wait()
+        logger.info("应用程序关闭")
+        event.accept()
+
+if __name__ == '__main__':
+    logger.info("启动远程画面观看端")
+    app = QApplication(sys.argv)
+    window = ViewerWindow()
+    window.show()
+    sys.exit(app.exec())